@@ -2,39 +2,272 @@ import pandas as pd
 import numpy as np
 import datetime
 import math
+import os
+import io
+import json
+import hashlib
+import threading
+import types
+import collections
+import multiprocessing
+import concurrent.futures
+from multiprocessing import shared_memory
+
+STATIC_DATA_SET_FILES = ['staticfiles/historic_dataset.csv', 'staticfiles/forward_dataset.csv', 'staticfiles/mortality_risk_table.csv']
+# keys of the datasets in the model parameter object and of the ids they can be given by instead
+DATA_SET_ID_KEYS = {'historic_asset_return_data': 'historic_dataset_id', 'forward_asset_return_data': 'forward_dataset_id', 'mortality_data': 'mortality_dataset_id'}
+# default percentiles shown on the portfolio value and income fan charts
+FAN_CHART_PERCENTILES = [0, 10, 25, 50, 75, 90, 100]
+# resolution (percentage points) to which CalcMaxBacktestedSWRs finds maximum zero-fail withdrawal rates
+MAX_SWR_TOLERANCE = 0.01
+# cap on the (rows x years) values of one RunAssetMixBatch pass, which bounds its memory use when many asset mixes are run together
+ASSET_MIX_BATCH_ELEMENTS = 2 ** 21
+# step (percentage points) of the coarse asset mix grid run by OptimiseAssetMix, the default finest step (resolution) it refines to and the default cap on asset mixes it runs
+ASSET_MIX_GRID_STEP = 10
+ASSET_MIX_RESOLUTION = 10
+ASSET_MIX_EVALUATION_BUDGET = 250
+# number of best asset mixes (on each of the 'max' and 'min' measures) OptimiseAssetMix refines its search around each round
+ASSET_MIX_REFINE_CELLS = 2
+# cap on the number of variants in one 'simulation_batch' request
+SIMULATION_BATCH_MAX_VARIANTS = 50
+# 'historics' configurations (currency set, geographic set, rolling return period) precomputed by WarmHistoricsCache for each version of the datafiles, over the full data range with default coupons, along with up to HISTORICS_WARM_MOST_REQUESTED of the most requested configurations
+HISTORICS_WARM_CONFIGURATIONS = [(currency_set, geographic_set, period) for currency_set, geographic_set in [('USD', 'DOMESTIC'), ('USD', 'GLOBAL'), ('GBP', 'GLOBAL')] for period in [5, 10, 15, 20, 25]]
+HISTORICS_WARM_MOST_REQUESTED = 32
+# cap on the configurations GetHistoricsAnalysis counts requests for (past it the counts are halved and only the most requested half kept, so old and one-off configurations fall away)
+HISTORICS_REQUEST_COUNTS_MAX = 1024
+# default blend step (equity percentage points) and rolling windows (years) of the 'historics' risk/return frontier (returnvariance), the keys of the original windows (other windows are keyed on their length in years) and the limits on requested steps and windows
+FRONTIER_STEP = 10
+FRONTIER_WINDOWS = [3, 10, 20]
+FRONTIER_WINDOW_KEYS = {3: 'one', 10: 'ten', 20: 'twenty'}
+FRONTIER_MAX_WINDOWS = 10
+FRONTIER_MAX_WINDOW = 50
+
+# Returns the directory holding the compiled (columnar binary) form of a static csv datafile, e.g. 'staticfiles/historic_dataset.compiled'
+class CompiledDataSetDirectory:
+    def __init__(self, file_path):
+        self.path = os.path.splitext(file_path)[0] + '.compiled'
+
+# Compiles a static csv datafile into one .npy file per column plus a manifest.json recording the content hash of the csv file it was built from.  Column files are written under new names and the manifest is replaced last so running workers never read a half written dataset.
+class CompileDataSet:
+    def __init__(self, file_path):
+        with open(file_path, 'rb') as f:
+            raw = f.read()
+        content_hash = hashlib.sha256(raw).hexdigest()
+        data_set = pd.read_csv(io.BytesIO(raw))
+        directory = CompiledDataSetDirectory(file_path).path
+        os.makedirs(directory, exist_ok=True)
+        columns = []
+        for a, column_name in enumerate(data_set.columns):
+            column = data_set[column_name].to_numpy()
+            if column.dtype.kind not in 'biuf':
+                raise ValueError("Column '" + str(column_name) + "' of " + file_path + " is not numeric and can not be compiled")
+            column_file = 'column' + str(a) + '-' + content_hash[:16] + '.npy'
+            np.save(os.path.join(directory, column_file + '.tmp'), column, allow_pickle=False)
+            os.replace(os.path.join(directory, column_file + '.tmp.npy'), os.path.join(directory, column_file))
+            columns.append({'name': column_name, 'file': column_file, 'dtype': column.dtype.str, 'length': len(column)})
+        manifest = {'source': os.path.basename(file_path), 'content_hash': content_hash, 'columns': columns}
+        with open(os.path.join(directory, 'manifest.json.tmp'), 'w') as f:
+            json.dump(manifest, f)
+        os.replace(os.path.join(directory, 'manifest.json.tmp'), os.path.join(directory, 'manifest.json'))
+        current_files = [column['file'] for column in columns] + ['manifest.json']
+        for file_name in os.listdir(directory):
+            if file_name not in current_files:
+                os.remove(os.path.join(directory, file_name))
+        self.directory = directory
+        self.content_hash = content_hash
+        self.columns = [column['name'] for column in columns]
+
+# Memory-maps (read-only) the compiled form of a static csv datafile so all worker processes share the same pages.  Returns columns = None if no compiled form exists or it was built from a different version of the csv file.
+class LoadCompiledDataSet:
+    def __init__(self, file_path, content_hash):
+        directory = CompiledDataSetDirectory(file_path).path
+        self.columns = None
+        try:
+            with open(os.path.join(directory, 'manifest.json'), 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return
+        if manifest.get('content_hash') != content_hash:
+            return
+        columns = {}
+        try:
+            for column in manifest['columns']:
+                columns[column['name']] = np.load(os.path.join(directory, column['file']), mmap_mode='r', allow_pickle=False)
+        except (OSError, ValueError, KeyError):
+            return
+        self.columns = columns
+
+# Loads and parses static datafiles (held on server) once per worker process.  Each column is held as a read-only array (memory-mapped from the compiled form where it is up to date, otherwise parsed from the csv file) and the file is only re-read when its modification time or size changes.
+class DataSetRegistry:
+    data_sets = {}
+    lock = threading.Lock()
+
+    def __init__(self, file_path):
+        file_stat = os.stat(file_path)
+        signature = (file_stat.st_mtime_ns, file_stat.st_size)
+        with DataSetRegistry.lock:
+            entry = DataSetRegistry.data_sets.get(file_path)
+            if entry is None or entry['signature'] != signature:
+                with open(file_path, 'rb') as f:
+                    raw = f.read()
+                content_hash = hashlib.sha256(raw).hexdigest()
+                columns = LoadCompiledDataSet(file_path, content_hash).columns
+                if columns is None:
+                    data_set = pd.read_csv(io.BytesIO(raw))
+                    columns = {}
+                    for column_name in data_set.columns:
+                        column = data_set[column_name].to_numpy(copy=True)
+                        column.setflags(write=False)
+                        columns[column_name] = column
+                entry = {'signature': signature, 'content_hash': content_hash, 'columns': types.MappingProxyType(columns)}
+                DataSetRegistry.data_sets[file_path] = entry
+        self.signature = entry['signature']
+        self.content_hash = entry['content_hash']
+        self.columns = entry['columns']
+
+# Simple bounded least-recently-used cache shared by all requests in a worker process.  Capped on number of entries and (optionally) on total size in bytes of the entries (size given by the caller on put).  Counts hits and misses.
+class LRUCache:
+    def __init__(self, max_entries, max_bytes = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.sizes = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value, size = 0):
+        with self.lock:
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            if key in self.entries:
+                self.total_bytes -= self.sizes[key]
+            self.entries[key] = value
+            self.sizes[key] = size
+            self.total_bytes += size
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries or (self.max_bytes is not None and self.total_bytes > self.max_bytes):
+                evicted_key, evicted_value = self.entries.popitem(last = False)
+                self.total_bytes -= self.sizes.pop(evicted_key)
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.total_bytes, 'hits': self.hits, 'misses': self.misses}
+
+# Validated custom datasets (historic / forward / mortality data uploaded in the request body) keyed on (dataset key, content hash) so each upload is only validated by the serializer once.
+validated_data_set_cache = LRUCache(32)
+
+# Prepared return data (PrepareReturnData) keyed on dataset ids, date range, currency / geographic set, tax, fee, coupon and circular settings.  Users mostly vary withdrawal and asset mix parameters between requests so the same prepared series are reused.
+prepared_return_data_cache = LRUCache(64, 64 * 1024 * 1024)
+
+# Forward yield curves (ForwardCurves) keyed on the forward dataset's update date and dataset id (content hash).  Shared by the 'simulation' / 'asset_mix_optimisation' and 'historics' views (the server's own forward dataset has the same id in both).
+forward_curves_cache = LRUCache(16)
+
+# Growth factor indexes (GrowthFactorIndex) keyed on the prepared return series, asset mix, data direction and number of cycles / years.  One index serves both CalcMaxBacktestedSWRs and RunSimulation in a simulation request.
+growth_factor_index_cache = LRUCache(256, 64 * 1024 * 1024)
+
+# 'historics' analyses (HistoricsAnalysis) keyed on the historic datafile content hash, forward dataset update date and request configuration (currency / geographic set, date range, rolling return period, coupons and frontier settings).  The analysis only depends on these so is served straight from the cache on a hit.  Capped on size as well as entries as the frontier settings make some analyses far larger than others.
+historics_cache = LRUCache(512, 64 * 1024 * 1024)
+
+# Returns content hash of a dataset object in the model parameter object (used as its dataset id)
+class DataSetContentHash:
+    def __init__(self, data_set):
+        self.content_hash = hashlib.sha256(json.dumps(data_set, sort_keys = True, separators = (',', ':')).encode()).hexdigest()
+
+# Collects the server's own datasets from the static datafiles (via DataSetRegistry) in the form used in the model parameter object.  Built once per version of the datafiles and treated as read-only and pre-validated.
+class DefaultDataSets:
+    data_sets = {}
+    lock = threading.Lock()
+
+    def __init__(self):
+        historic_registry = DataSetRegistry('staticfiles/historic_dataset.csv')
+        forward_registry = DataSetRegistry('staticfiles/forward_dataset.csv')
+        mortality_registry = DataSetRegistry('staticfiles/mortality_risk_table.csv')
+        key = (historic_registry.content_hash, forward_registry.content_hash, mortality_registry.content_hash)
+        with DefaultDataSets.lock:
+            if key not in DefaultDataSets.data_sets:
+                historic_data = RetrieveHistoricData(historic_registry.columns)
+                forward_data = RetrieveForwardData(forward_registry.columns)
+                mortality_data = RetrieveMortalityData(mortality_registry.columns)
+                DefaultDataSets.data_sets.clear()
+                DefaultDataSets.data_sets[key] = {
+                'historic_asset_return_data': {
+                'globaleq': historic_data.globaleq,
+                'useq': historic_data.useq,
+                'tengilt': historic_data.tengilt,
+                'ukcpi': historic_data.ukcpi,
+                'gbpusd': historic_data.gbpusd,
+                'year': historic_data.year,
+                'tentsy': historic_data.tentsy,
+                'uscpi': historic_data.uscpi,
+                'usdusd': historic_data.usdusd,
+                },
+                'forward_asset_return_data': {
+                'gbp_index_bond_forward': forward_data.gbp_index_bond_forward,
+                'gbp_bond_forward': forward_data.gbp_bond_forward,
+                'usd_index_bond_forward': forward_data.usd_index_bond_forward,
+                'usd_bond_forward': forward_data.usd_bond_forward,
+                'update_date': forward_data.update_date,
+                },
+                'mortality_data': {
+                'male': mortality_data.male,
+                'female': mortality_data.female,
+                'joint': mortality_data.joint,
+                'male_years_left': mortality_data.male_years_left,
+                'female_years_left': mortality_data.female_years_left,
+                },
+                }
+            self.data_sets = DefaultDataSets.data_sets[key]
+        self.data_set_ids = {
+        'historic_asset_return_data': historic_registry.content_hash,
+        'forward_asset_return_data': forward_registry.content_hash,
+        'mortality_data': mortality_registry.content_hash,
+        }
 
-# Collects dataset from static datafile (held on server) and returns this data.  Also provides missing default data to model parameter object.
+# Resolves the datasets for the model parameter object and provides missing default data to it.  Datasets can be given in full (custom upload), by reference ('historic_dataset_id', 'forward_dataset_id', 'mortality_dataset_id' set to the content hash of the server's own dataset or of a custom dataset already validated) or left out (server's own dataset).  Datasets that are already validated are taken out of data_object and returned in data_sets so the serializer does not re-validate them.
 class AddDefaultData:
     def __init__(self, data_object):
-        if 'historic_asset_return_data' not in data_object: 
-            historic_data = RetrieveHistoricData(pd.read_csv('staticfiles/historic_dataset.csv'))
-            data_object['historic_asset_return_data'] = {
-            'globaleq': historic_data.globaleq,
-            'useq': historic_data.useq,
-            'tengilt': historic_data.tengilt,
-            'ukcpi': historic_data.ukcpi,
-            'gbpusd': historic_data.gbpusd,
-            'year': historic_data.year,
-            'tentsy': historic_data.tentsy,
-            'uscpi': historic_data.uscpi,
-            'usdusd': historic_data.usdusd,
-            }
-        if 'forward_asset_return_data' not in data_object:
-            forward_data = RetrieveForwardData(pd.read_csv('staticfiles/forward_dataset.csv'))
-            data_object['forward_asset_return_data'] = {
-            'gbp_index_bond_forward': forward_data.gbp_index_bond_forward,
-            'gbp_bond_forward': forward_data.gbp_bond_forward,
-            'usd_index_bond_forward': forward_data.usd_index_bond_forward,
-            'usd_bond_forward': forward_data.usd_bond_forward,
-            'update_date': forward_data.update_date,
-            }
-        if 'mortality_data' not in data_object:
-            mortality_data = RetrieveMortalityData(pd.read_csv('staticfiles/mortality_risk_table.csv'))
-            data_object['mortality_data'] = {
-            'male': mortality_data.male,
-            'female': mortality_data.female,
-            'joint': mortality_data.joint,
-            }
+        default_data = DefaultDataSets()
+        data_sets = {}
+        data_set_ids = {}
+        unvalidated_data_set_ids = {}
+        errors = {}
+        for key in DATA_SET_ID_KEYS:
+            id_key = DATA_SET_ID_KEYS[key]
+            if key in data_object:
+                data_set_id = DataSetContentHash(data_object[key]).content_hash
+                validated_data_set = validated_data_set_cache.get((key, data_set_id))
+                if validated_data_set is not None:
+                    data_sets[key] = validated_data_set
+                    del data_object[key]
+                else:
+                    unvalidated_data_set_ids[key] = data_set_id
+                data_set_ids[key] = data_set_id
+            elif id_key in data_object and data_object[id_key] != default_data.data_set_ids[key]:
+                # ids are content hashes so anything other than a string (e.g. a list or object, which cannot be a cache key) is an unknown id
+                validated_data_set = validated_data_set_cache.get((key, data_object[id_key])) if isinstance(data_object[id_key], str) else None
+                if validated_data_set is not None:
+                    data_sets[key] = validated_data_set
+                    data_set_ids[key] = data_object[id_key]
+                else:
+                    errors[id_key] = ['Unknown dataset id.']
+            else:
+                data_sets[key] = default_data.data_sets[key]
+                data_set_ids[key] = default_data.data_set_ids[key]
+        self.data_sets = data_sets
+        self.data_set_ids = data_set_ids
+        self.unvalidated_data_set_ids = unvalidated_data_set_ids
+        self.errors = errors
         if 'equity_tax' not in data_object: data_object['equity_tax'] = float(0)
         if 'bond_tax' not in data_object: data_object['bond_tax'] = float(0)
         if 'draw_tax' not in data_object: data_object['draw_tax'] = float(0)
@@ -91,6 +324,10 @@ class AddDefaultData:
         if 'yale_weighting' not in data_object: data_object['yale_weighting']  = 70
         if 'vanguard_decrease_floor' not in data_object: data_object['vanguard_decrease_floor']  = 1.5
         if 'vanguard_increase_ceiling' not in data_object: data_object['vanguard_increase_ceiling']  = 5
+        if 'fan_chart_percentiles' not in data_object: data_object['fan_chart_percentiles'] = list(FAN_CHART_PERCENTILES)
+        if 'optimisation_resolution' not in data_object: data_object['optimisation_resolution'] = ASSET_MIX_RESOLUTION
+        if 'optimisation_budget' not in data_object: data_object['optimisation_budget'] = ASSET_MIX_EVALUATION_BUDGET
+        if 'allocation_surface' not in data_object: data_object['allocation_surface'] = "0"
         self.data_object = data_object
 
 # these are the Boglehead Variable Percentage Withdrawal datatables
@@ -146,13 +383,17 @@ class ReverseArray:
             new_sub_array = []
         self.data_set = new_array
 
-# Excel style present value caculator
+# Excel style present value caculator.  Uses the closed form annuity formula so rate can be a single rate or a numpy array of rates (priced all at once).
 class PresentValue:
     def __init__(self, rate, nper, pmt, fv):
-        pv = 0
-        for a in range(nper):
-            pv = pv + pmt / ((1 + rate) ** (a + 1))
-        pv = pv + fv / ((1 + rate) ** (nper))
+        rate = np.asarray(rate, dtype = float)
+        log_growth = nper * np.log1p(rate)
+        discount = np.exp(-log_growth)
+        # (1 - (1 + rate) ** -nper) / rate, with expm1 keeping precision for rates close to zero (and nper for a zero rate)
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            annuity_factor = np.where(rate == 0, float(nper), -np.expm1(-log_growth) / rate)
+        pv = pmt * annuity_factor + fv * discount
+        if pv.ndim == 0: pv = float(pv)
         self.pv = pv
 
 # Strips 'columns' of historic asset return data object into seperate data arrays ready to package as JSON object to send to frontend
@@ -186,33 +427,33 @@ class RetrieveMortalityData:
         self.male_years_left = data_set['MaleYearsLeft'].tolist()
         self.female_years_left = data_set['FemaleYearsLeft'].tolist()
 
-# Strips 'columns' of historic data object and forms sub-set returned as seperate data arrays (for historic returns analysis, dataset is fed in directly from csv file in static files)
+# Strips 'columns' of historic data object and forms sub-set returned as seperate data arrays (for historic returns analysis, dataset is fed in from the csv file in static files via DataSetRegistry)
 class LoadHistoricData:
     def __init__(self, data_set, start_year, end_year, currency_set, geographic_set):
         years = data_set['Year'].tolist()
         start_list = years.index(start_year)
         end_list = years.index(end_year)
         if (currency_set == 'GBP' and geographic_set == 'GLOBAL'):
-            self.historic_equity = data_set['GLOBALEQ'].tolist()[start_list:(end_list + 1)]
-            self.historic_bond = data_set['10GILT'].tolist()[start_list:(end_list + 1)]
-            self.historic_index_bond = data_set['10GILT'].tolist()[start_list:(end_list + 1)]
-            self.historic_cpi = data_set['UKCPI'].tolist()[start_list:(end_list + 1)]
-            self.historic_fx = data_set['GBPUSD'].tolist()[start_list:(end_list + 1)]
-            self.years = data_set['Year'].tolist()[start_list:(end_list + 1)]
+            self.historic_equity = data_set['GLOBALEQ'][start_list:(end_list + 1)].tolist()
+            self.historic_bond = data_set['10GILT'][start_list:(end_list + 1)].tolist()
+            self.historic_index_bond = data_set['10GILT'][start_list:(end_list + 1)].tolist()
+            self.historic_cpi = data_set['UKCPI'][start_list:(end_list + 1)].tolist()
+            self.historic_fx = data_set['GBPUSD'][start_list:(end_list + 1)].tolist()
+            self.years = data_set['Year'][start_list:(end_list + 1)].tolist()
         elif (currency_set == 'USD' and geographic_set == 'DOMESTIC'):
-            self.historic_equity = data_set['USEQ'].tolist()[start_list:(end_list + 1)]
-            self.historic_bond = data_set['10TSY'].tolist()[start_list:(end_list + 1)]
-            self.historic_index_bond = data_set['10TSY'].tolist()[start_list:(end_list + 1)]
-            self.historic_cpi = data_set['USCPI'].tolist()[start_list:(end_list + 1)]
-            self.historic_fx = data_set['USDUSD'].tolist()[start_list:(end_list + 1)]
-            self.years = data_set['Year'].tolist()[start_list:(end_list + 1)]
+            self.historic_equity = data_set['USEQ'][start_list:(end_list + 1)].tolist()
+            self.historic_bond = data_set['10TSY'][start_list:(end_list + 1)].tolist()
+            self.historic_index_bond = data_set['10TSY'][start_list:(end_list + 1)].tolist()
+            self.historic_cpi = data_set['USCPI'][start_list:(end_list + 1)].tolist()
+            self.historic_fx = data_set['USDUSD'][start_list:(end_list + 1)].tolist()
+            self.years = data_set['Year'][start_list:(end_list + 1)].tolist()
         else: 
-            self.historic_equity = data_set['GLOBALEQ'].tolist()[start_list:(end_list + 1)]
-            self.historic_bond = data_set['10TSY'].tolist()[start_list:(end_list + 1)]
-            self.historic_index_bond = data_set['10TSY'].tolist()[start_list:(end_list + 1)]
-            self.historic_cpi = data_set['USCPI'].tolist()[start_list:(end_list + 1)]
-            self.historic_fx = data_set['USDUSD'].tolist()[start_list:(end_list + 1)]
-            self.years = data_set['Year'].tolist()[start_list:(end_list + 1)]
+            self.historic_equity = data_set['GLOBALEQ'][start_list:(end_list + 1)].tolist()
+            self.historic_bond = data_set['10TSY'][start_list:(end_list + 1)].tolist()
+            self.historic_index_bond = data_set['10TSY'][start_list:(end_list + 1)].tolist()
+            self.historic_cpi = data_set['USCPI'][start_list:(end_list + 1)].tolist()
+            self.historic_fx = data_set['USDUSD'][start_list:(end_list + 1)].tolist()
+            self.years = data_set['Year'][start_list:(end_list + 1)].tolist()
 
 # Creates sub-set of historic asset return data out of full set (for simulation class, dataset is a JSON object)
 class PrepareHistoricDataSet:
@@ -276,1284 +517,846 @@ class PrepareMortalityDataSet:
         self.male_years_left = data_set['male_years_left']
         self.female_years_left = data_set['female_years_left']
 
-# Takes historic asset return data, converts into real terms and applies tax parameters and returns prepared data
+# Spot and par yield curves (decimal, read-only arrays) of a forward rate curve (percent).  The spot rate for year a is the geometric average of the forward rates up to year a (from the cumulative product of forward growth) and the par rate for year a is the annual coupon at which an a year bond prices at par, i.e. (1 - discount factor for year a) / sum of discount factors up to year a.
+class ForwardYieldCurve:
+    def __init__(self, forward):
+        growth = np.cumprod(1 + np.asarray(forward, dtype = float) / 100)
+        spot = (growth ** (1 / np.arange(1, len(growth) + 1))) - 1
+        discount = 1 / growth
+        par = (1 - discount) / np.cumsum(discount)
+        for array in [spot, par]:
+            array.setflags(write = False)
+        self.spot = spot
+        self.par = par
+
+# Yield curves (ForwardYieldCurve) of the bond and index bond forward curves of a forward dataset (in the form of 'forward_asset_return_data') for both currencies, keyed on (currency, 'bond' / 'index_bond')
+class ForwardCurves:
+    def __init__(self, forward_data):
+        curves = {}
+        for currency in ['GBP', 'USD']:
+            for bond in ['bond', 'index_bond']:
+                curves[(currency, bond)] = ForwardYieldCurve(forward_data[currency.lower() + '_' + bond + '_forward'])
+        self.curves = curves
+
+# Returns the forward yield curves (ForwardCurves) of a forward dataset from forward_curves_cache, building and caching them if not held
+class GetForwardCurves:
+    def __init__(self, forward_data_set_id, forward_data):
+        key = (float(forward_data['update_date']), forward_data_set_id)
+        forward_curves = forward_curves_cache.get(key)
+        if forward_curves is None:
+            forward_curves = ForwardCurves(forward_data)
+            forward_curves_cache.put(key, forward_curves)
+        self.forward_curves = forward_curves
+
+# Takes historic asset return data, converts into real terms and applies tax parameters and returns prepared data.  Whole series are calculated at once as numpy arrays ('_array' attributes, read-only) with tuple versions kept under the original names for the simulation classes.
 class PrepareReturnData:
-    def __init__(self, equity, historic_bond, historic_index_bond, cpi, historic_fx, equity_tax, bond_tax, bond_coupon, index_bond_coupon, forward_index_bond, forward_bond, fees, circular_simulation):
-        historic_equity_real = []
-        historic_bond_real = []
-        historic_index_bond_real = []
-        cpi_change = []
-        forward_index_bond_taxed = []
-        forward_bond_taxed = []
-        forward_index_bond_spot_curve = []
-
-        for a in range(len(equity) - 1):
-            num = float(equity[a + 1]) / float(historic_fx [a + 1])
-            denom = float(equity[a]) / float(historic_fx [a])
-            num_cpi = float(cpi[a + 1])
-            denom_cpi = float(cpi[a])
-            change = (((num / denom) - 1 - fees) * (1 - equity_tax)) - ((num_cpi / denom_cpi) - 1) 
-            historic_equity_real.append(change)
-        for a in range(len(historic_bond) - 1):
-            num = PresentValue(float(historic_bond[a + 1]) / 100, 10, bond_coupon, 100).pv
-            denom = PresentValue(float(historic_bond[a]) / 100, 10, bond_coupon, 100).pv
-            num_cpi = float(cpi[a + 1])
-            denom_cpi = float(cpi[a])
-            change = ((num / denom) - 1 - fees) * (1 - bond_tax) + (float(historic_bond[a]) / 100) * (1 - bond_tax) - ((num_cpi / denom_cpi) - 1)
-            historic_bond_real.append(change)
-        for a in range(len(historic_index_bond) - 1):
-            num = PresentValue(float(historic_index_bond[a + 1]) / 100, 10, index_bond_coupon, 100).pv
-            denom = PresentValue(float(historic_index_bond[a]) / 100, 10, index_bond_coupon, 100).pv
-            change = ((num / denom) - 1 - fees) * (1 - bond_tax) + (float(historic_index_bond[a]) / 100) * (1 - bond_tax) 
-            historic_index_bond_real.append(change)    
-        for a in range(len(cpi) - 1):
-            num_cpi = float(cpi[a + 1])
-            denom_cpi = float(cpi[a])
-            change = ((num_cpi / denom_cpi) - 1) 
-            cpi_change.append(change)
-        for a in range(len(forward_index_bond)):
-            tax_adjust = ((forward_index_bond[a] / 100) - fees) * (1 - bond_tax)
-            forward_index_bond_taxed.append(tax_adjust)
-        for a in range(len(forward_bond)):
-            tax_adjust = ((forward_bond[a] / 100) - fees) * (1 - bond_tax)
-            forward_bond_taxed.append(tax_adjust)
-        for a in range(len(forward_index_bond)):
-            if a == 0: forward_index_bond_spot_curve.append(forward_index_bond[0] / 100)
-            else:
-                forward_index_bond_spot_curve.append(((((1 + forward_index_bond_spot_curve[-1]) ** a) * (1 + forward_index_bond[a] / 100)) ** (1 / (a + 1))) - 1)
-
- 
-        self.forward_index_bond_taxed = forward_index_bond_taxed
-        self.forward_bond_taxed = forward_bond_taxed
-        # forward_index_bond_spot_curve is used in calculation of sum of discounted future withdrawals
-        self.forward_index_bond_spot_curve = forward_index_bond_spot_curve
-
-        # introduce circular bootstrapping...
+    def __init__(self, equity, historic_bond, historic_index_bond, cpi, historic_fx, equity_tax, bond_tax, bond_coupon, index_bond_coupon, forward_index_bond, forward_bond, fees, circular_simulation, forward_index_bond_spot_curve = None):
+        equity = np.asarray(equity, dtype = float)
+        historic_bond = np.asarray(historic_bond, dtype = float)
+        historic_index_bond = np.asarray(historic_index_bond, dtype = float)
+        cpi = np.asarray(cpi, dtype = float)
+        historic_fx = np.asarray(historic_fx, dtype = float)
+        forward_index_bond = np.asarray(forward_index_bond, dtype = float)
+        forward_bond = np.asarray(forward_bond, dtype = float)
+
+        cpi_change = (cpi[1:] / cpi[:-1]) - 1
+        equity_fx = equity / historic_fx
+        historic_equity_real = (((equity_fx[1:] / equity_fx[:-1]) - 1 - fees) * (1 - equity_tax)) - cpi_change
+        bond_price = PresentValue(historic_bond / 100, 10, bond_coupon, 100).pv
+        historic_bond_real = ((bond_price[1:] / bond_price[:-1]) - 1 - fees) * (1 - bond_tax) + (historic_bond[:-1] / 100) * (1 - bond_tax) - cpi_change
+        index_bond_price = PresentValue(historic_index_bond / 100, 10, index_bond_coupon, 100).pv
+        historic_index_bond_real = ((index_bond_price[1:] / index_bond_price[:-1]) - 1 - fees) * (1 - bond_tax) + (historic_index_bond[:-1] / 100) * (1 - bond_tax)
+        forward_index_bond_taxed = ((forward_index_bond / 100) - fees) * (1 - bond_tax)
+        forward_bond_taxed = ((forward_bond / 100) - fees) * (1 - bond_tax)
+        # spot rate for year a is the geometric average of the forward rates up to year a (given already built from the shared forward curves, see GetForwardCurves)
+        if forward_index_bond_spot_curve is None: forward_index_bond_spot_curve = ForwardYieldCurve(forward_index_bond).spot
+
+        # introduce circular bootstrapping... the real return series are doubled (series followed by all but its last year) so back-testing cycles starting late in the series wrap around to its start.  Built as new arrays; the original series are left untouched.
         if circular_simulation == "1":
-            historic_equity_real_extended = historic_equity_real
-            historic_bond_real_extended = historic_bond_real
-            historic_index_bond_real_extended = historic_index_bond_real
-            cpi_change_extended = cpi_change
-            for a in range(len(historic_equity_real) - 1):
-                historic_equity_real_extended.append(historic_equity_real[a])
-                historic_bond_real_extended.append(historic_bond_real[a])
-                historic_index_bond_real_extended.append(historic_index_bond_real[a])
-                cpi_change_extended.append(cpi_change[a])
-            self.historic_equity_real = historic_equity_real_extended
-            self.historic_bond_real = historic_bond_real_extended
-            self.historic_index_bond_real = historic_index_bond_real_extended
-            self.cpi_change = cpi_change_extended
+            historic_equity_real = np.concatenate((historic_equity_real, historic_equity_real[:-1]))
+            historic_bond_real = np.concatenate((historic_bond_real, historic_bond_real[:-1]))
+            historic_index_bond_real = np.concatenate((historic_index_bond_real, historic_index_bond_real[:-1]))
+            cpi_change = np.concatenate((cpi_change, cpi_change[:-1]))
+
+        for array in [cpi_change, historic_equity_real, historic_bond_real, historic_index_bond_real, forward_index_bond_taxed, forward_bond_taxed]:
+            array.setflags(write = False)
+        self.cpi_change_array = cpi_change
+        self.historic_equity_real_array = historic_equity_real
+        self.historic_bond_real_array = historic_bond_real
+        self.historic_index_bond_real_array = historic_index_bond_real
+        self.forward_index_bond_taxed_array = forward_index_bond_taxed
+        self.forward_bond_taxed_array = forward_bond_taxed
+        self.forward_index_bond_spot_curve_array = forward_index_bond_spot_curve
+
+        # immutable sequence versions for the simulation classes (which index year by year)
+        self.historic_equity_real = tuple(historic_equity_real.tolist())
+        self.historic_bond_real = tuple(historic_bond_real.tolist())
+        self.historic_index_bond_real = tuple(historic_index_bond_real.tolist())
+        self.cpi_change = tuple(cpi_change.tolist())
+        self.forward_index_bond_taxed = tuple(forward_index_bond_taxed.tolist())
+        self.forward_bond_taxed = tuple(forward_bond_taxed.tolist())
+        # forward_index_bond_spot_curve is used in calculation of sum of discounted future withdrawals
+        self.forward_index_bond_spot_curve = tuple(forward_index_bond_spot_curve.tolist())
+        # approximate memory held (arrays plus tuple versions holding python floats), used to size-cap prepared_return_data_cache
+        self.nbytes = 5 * sum(array.nbytes for array in [cpi_change, historic_equity_real, historic_bond_real, historic_index_bond_real, forward_index_bond_taxed, forward_bond_taxed, forward_index_bond_spot_curve])
+
+# Returns prepared return data (PrepareReturnData) from prepared_return_data_cache, preparing and caching it if not held (with the index bond spot curve taken from the forward yield curves given, see GetForwardCurves).  Datasets are identified by their dataset ids (content hashes) so the key does not depend on the size of the datasets.  Prepared data is read-only so can be shared between requests.
+class GetPreparedReturnData:
+    def __init__(self, data_set_ids, historic_data_set, forward_data_set, data_start_year, data_end_year, currency_set, geographic_set, equity_tax, bond_tax, bond_coupon, index_bond_coupon, fees, circular_simulation, forward_curves):
+        key = (data_set_ids['historic_asset_return_data'], data_set_ids['forward_asset_return_data'], data_start_year, data_end_year, currency_set, geographic_set, equity_tax, bond_tax, fees, bond_coupon, index_bond_coupon, circular_simulation)
+        return_data_set = prepared_return_data_cache.get(key)
+        if return_data_set is None:
+            return_data_set = PrepareReturnData(historic_data_set.historic_equity, historic_data_set.historic_bond, historic_data_set.historic_index_bond, historic_data_set.historic_cpi, historic_data_set.historic_fx, equity_tax, bond_tax, bond_coupon, index_bond_coupon, forward_data_set.forward_index_bond, forward_data_set.forward_bond, fees, circular_simulation, forward_curves.curves[('GBP' if currency_set == 'GBP' else 'USD', 'index_bond')].spot)
+            prepared_return_data_cache.put(key, return_data_set, return_data_set.nbytes)
+        self.key = key
+        self.return_data_set = return_data_set
+
+# Works out when each of the three annuities is bought and the income targeted / cost of purchase.  Follows the annuity income trackers in the back-testing cycle (these do not depend on returns so are the same for every cycle) - only whether the portfolio can afford the purchase differs by cycle.  'purchase_year' is the year after withdrawals start (None if never bought).
+class AnnuityPurchaseSchedule:
+    def __init__(self, withdrawal_amount, annual_withdrawal_inc, annuity_option_list, annuity_increase_list, annuity_price_list, annuity_tax_rate_list, annuity_percent_withdrawal_list, annuity_start_year_list, years, years_to_withdrawal):
+        annuity_price, annuity_price2, annuity_price3 = annuity_price_list
+        annuity_tax_rate, annuity_tax_rate2, annuity_tax_rate3 = annuity_tax_rate_list
+        annuity_start_year, annuity_start_year2, annuity_start_year3 = annuity_start_year_list
+        if annuity_option_list[1] == "4": annual_annuity2_inc = annuity_increase_list[1] / 100
+        else: annual_annuity2_inc = 0
+        if annuity_option_list[2] == "4": annual_annuity3_inc = annuity_increase_list[2] / 100
+        else: annual_annuity3_inc = 0
 
-        else: 
-            self.historic_equity_real = historic_equity_real
-            self.historic_bond_real = historic_bond_real
-            self.historic_index_bond_real = historic_index_bond_real
-            self.cpi_change = cpi_change
-
-# Calculates and returns withdrawal amount (from running portfolio) for specific year in back-test cycle.  Nets off annuity income and scales amount upwards for tax costs.
-class CalcConstantWithdrawal:
-    def __init__(self, withdrawal_amount, draw_adjust, annual_withdrawal_inc, draw_tax, year, annuity_income, annuity_tax, annuity_income2, annuity_tax2, annuity_income3, annuity_tax3):
-        self.result = ((withdrawal_amount * draw_adjust[year] * ((1 + annual_withdrawal_inc) ** (year)) - annuity_income * (1 - annuity_tax) - annuity_income2 * (1 - annuity_tax2) - annuity_income3 * (1 - annuity_tax3))  / (1 - draw_tax))
-        self.unadjusted_result = ((withdrawal_amount * ((1 + annual_withdrawal_inc) ** (year)) - annuity_income * (1 - annuity_tax) - annuity_income2 * (1 - annuity_tax2) - annuity_income3 * (1 - annuity_tax3)) / (1 - draw_tax))
-
-# Calculates and returns withdrawal bonus amount (from running portfolio) for specific year in back-test cycle.  Scales amount upwards for tax costs.
-class CalcBonusWithdrawal:
-    def __init__(self, bonus_target, draw_adjust, annual_withdrawal_inc, draw_tax, year, annuity_income, annuity_tax, annuity_income2, annuity_tax_rate2, annuity_income3, annuity_tax3):
-        self.result = ((bonus_target * draw_adjust[year] * ((1 + annual_withdrawal_inc) ** (year))) / (1 - draw_tax))
-
-# Calculates and returns proportional withdrawal amount (from running portfolio) for specific year in back-test cycle.  Nets off annuity income and scales amount upwards for tax costs.
-class CalcProportionalWithdrawal:
-    def __init__(self, target_withdrawal_percent, draw_adjust, draw_tax, year, running_portfolio_value, min_withdrawal_floor, annual_withdrawal_inc, annuity_income, annuity_tax, annuity_income2, annuity_tax2, annuity_income3, annuity_tax3, net_other_income):
-        if net_other_income == "0":
-            result = ((running_portfolio_value * (target_withdrawal_percent / 100) * draw_adjust[year] * ((1 + annual_withdrawal_inc) ** (year))) / (1 - draw_tax))
-            floor = ((min_withdrawal_floor * draw_adjust[year] * ((1 + annual_withdrawal_inc) ** (year))) / (1 - draw_tax))
-            self.result = max(result, floor)
-        else:
-            result = ((running_portfolio_value * (target_withdrawal_percent / 100) * draw_adjust[year] * ((1 + annual_withdrawal_inc) ** (year)) - annuity_income * (1 - annuity_tax) - annuity_income2 * (1 - annuity_tax2) - annuity_income3 * (1 - annuity_tax3)) / (1 - draw_tax))
-            floor = ((min_withdrawal_floor * draw_adjust[year] * ((1 + annual_withdrawal_inc) ** (year)) - annuity_income * (1 - annuity_tax) - annuity_income2 * (1 - annuity_tax2) - annuity_income3 * (1 - annuity_tax3)) / (1 - draw_tax))
-            self.result = max(result, floor)
-
-# Calculates and returns Yale formula proportional withdrawal amount (from running portfolio) for specific year in back-test cycle.  Nets off annuity income and scales amount upwards for tax costs.
-class CalcProportionalWithdrawalYale:
-    def __init__(self, target_withdrawal_percent, draw_adjust, draw_tax, year, running_portfolio_value, min_withdrawal_floor, annual_withdrawal_inc, annuity_income, annuity_tax, annuity_income2, annuity_tax2, annuity_income3, annuity_tax3, b, previous_draw, yale_weighting, net_other_income):
-        weight = yale_weighting / 100
-        if net_other_income == "0":
-            if b == 0: 
-                result = ((running_portfolio_value * (target_withdrawal_percent / 100) * draw_adjust[year] * ((1 + annual_withdrawal_inc) ** (year))) / (1 - draw_tax))
-                result_unadjusted = ((running_portfolio_value * (target_withdrawal_percent / 100) * ((1 + annual_withdrawal_inc) ** (year))) / (1 - draw_tax))
-            else:    
-                result = ((((1 - weight) * (running_portfolio_value * (target_withdrawal_percent / 100)) + weight * previous_draw) * draw_adjust[year] * ((1 + annual_withdrawal_inc) ** (year))) / (1 - draw_tax))
-                result_unadjusted = ((((1 - weight) * (running_portfolio_value * (target_withdrawal_percent / 100)) + weight * previous_draw) * ((1 + annual_withdrawal_inc) ** (year))) / (1 - draw_tax))
-            floor = ((min_withdrawal_floor * draw_adjust[year] * ((1 + annual_withdrawal_inc) ** (year))) / (1 - draw_tax))
-            self.result = max(result, floor)
-            self.result_unadjusted = result_unadjusted
+        tracker = (withdrawal_amount * annuity_percent_withdrawal_list[0] / 100) / (1 - annuity_tax_rate)
+        tracker2 = annuity_percent_withdrawal_list[1]
+        tracker3 = annuity_percent_withdrawal_list[2]
+        for b in range(years_to_withdrawal):
+            if b != 0: tracker = tracker * (1 + annual_withdrawal_inc)
+            if b != 0: tracker2 = tracker2 * (1 + annual_annuity2_inc)
+            # (as in the back-testing cycle, tracker2 picks up tracker3 in the first year)
+            if b == 0: tracker2 = tracker3
+            else: tracker3 = tracker3 * (1 + annual_annuity3_inc)
+
+        purchase_year = [None, None, None]
+        target_income = [0, 0, 0]
+        purchase_cost = [0, 0, 0]
+        for b in range(years - years_to_withdrawal):
+            first_step = (b == 0 and years_to_withdrawal == 0)
+            if b <= (annuity_start_year2 - 1 - years_to_withdrawal):
+                if not first_step: tracker2 = tracker2 * (1 + annual_annuity2_inc)
+                if b == (annuity_start_year2 - 1 - years_to_withdrawal):
+                    try: purchase_cost[1] = (tracker2 / (annuity_price2 / 100))
+                    except: purchase_cost[1] = 0
+                    purchase_year[1] = b
+                    target_income[1] = tracker2
+            if b <= (annuity_start_year3 - 1 - years_to_withdrawal):
+                if not first_step: tracker3 = tracker3 * (1 + annual_annuity3_inc)
+                if b == (annuity_start_year3 - 1 - years_to_withdrawal):
+                    try: purchase_cost[2] = (tracker3 / (annuity_price3 / 100))
+                    except: purchase_cost[2] = 0
+                    purchase_year[2] = b
+                    target_income[2] = tracker3
+            if b <= (annuity_start_year - 1 - years_to_withdrawal):
+                if not first_step: tracker = tracker * (1 + annual_withdrawal_inc)
+                if b == (annuity_start_year - 1 - years_to_withdrawal):
+                    # This nets the state and occupational pensions off what is required to achieved annuity withdrawal coverage
+                    if annuity_start_year2 and annuity_start_year3 <= annuity_start_year:
+                        tracker = max((tracker - tracker2 * (1 - annuity_tax_rate2) - tracker3 * (1 - annuity_tax_rate3)), 0)
+                    elif annuity_start_year2 <= annuity_start_year:
+                        tracker = max((tracker - tracker2 * (1 - annuity_tax_rate2)), 0)
+                    elif annuity_start_year3 <= annuity_start_year:
+                        tracker = max((tracker - tracker3 * (1 - annuity_tax_rate3)), 0)
+                    try: purchase_cost[0] = (tracker / (annuity_price / 100))
+                    except: purchase_cost[0] = 0
+                    purchase_year[0] = b
+                    target_income[0] = tracker
+        self.purchase_year = purchase_year
+        self.target_income = target_income
+        self.purchase_cost = purchase_cost
+
+# Matrix of portfolio growth factors (1 + real return on the asset mix) for each back-testing cycle (rows) and year of the cycle (columns).  Built at once from (read-only) windows onto the return series.  If asset_mix is an (M x 5) array of asset mixes the growth factors of every mix are built at once as a (years x M x cycles) array (year-major, as RunSimulationCycles steps through a batch of mixes a year at a time).
+class CycleGrowthFactors:
+    def __init__(self, equity_real, bond_real, index_bond_real, asset_mix, cpi, index_bond_forward, bond_forward, data_direction, cycles, years):
+        equity_real = np.lib.stride_tricks.sliding_window_view(np.asarray(equity_real, dtype = float), years)[:cycles]
+        if data_direction == "back":
+            bond_real = np.lib.stride_tricks.sliding_window_view(np.asarray(bond_real, dtype = float), years)[:cycles]
+            index_bond_real = np.lib.stride_tricks.sliding_window_view(np.asarray(index_bond_real, dtype = float), years)[:cycles]
         else:
-            if b == 0: 
-                result = ((running_portfolio_value * (target_withdrawal_percent / 100) * draw_adjust[year] * ((1 + annual_withdrawal_inc) ** (year)) - annuity_income * (1 - annuity_tax) - annuity_income2 * (1 - annuity_tax2) - annuity_income3 * (1 - annuity_tax3)) / (1 - draw_tax))
-                result_unadjusted = ((running_portfolio_value * (target_withdrawal_percent / 100) * ((1 + annual_withdrawal_inc) ** (year)) - annuity_income * (1 - annuity_tax) - annuity_income2 * (1 - annuity_tax2) - annuity_income3 * (1 - annuity_tax3)) / (1 - draw_tax))
-            else:    
-                result = ((((1 - weight) * (running_portfolio_value * (target_withdrawal_percent / 100)) + weight * previous_draw) * draw_adjust[year] * ((1 + annual_withdrawal_inc) ** (year)) - annuity_income * (1 - annuity_tax) - annuity_income2 * (1 - annuity_tax2) - annuity_income3 * (1 - annuity_tax3)) / (1 - draw_tax))
-                result_unadjusted = ((((1 - weight) * (running_portfolio_value * (target_withdrawal_percent / 100)) + weight * previous_draw) * ((1 + annual_withdrawal_inc) ** (year)) - annuity_income * (1 - annuity_tax) - annuity_income2 * (1 - annuity_tax2) - annuity_income3 * (1 - annuity_tax3)) / (1 - draw_tax))
-            floor = ((min_withdrawal_floor * draw_adjust[year] * ((1 + annual_withdrawal_inc) ** (year)) - annuity_income * (1 - annuity_tax) - annuity_income2 * (1 - annuity_tax2) - annuity_income3 * (1 - annuity_tax3)) / (1 - draw_tax))
-            self.result = max(result, floor)
-            self.result_unadjusted = result_unadjusted
-       
-# Calculates and returns Vanguard Dynamic Withdrawal formula proportional withdrawal amount (from running portfolio) for specific year in back-test cycle.  Nets off annuity income and scales amount upwards for tax costs.
-class CalcProportionalWithdrawalVanguard:
-    def __init__(self, target_withdrawal_percent, draw_adjust, draw_tax, year, running_portfolio_value, min_withdrawal_floor, annual_withdrawal_inc, annuity_income, annuity_tax, annuity_income2, annuity_tax2, annuity_income3, annuity_tax3, b, previous_draw, vanguard_decrease_floor, vanguard_increase_ceiling, net_other_income):
-        if net_other_income == "0":
-            if b == 0:
-                self.result_unadjusted = ((running_portfolio_value * (target_withdrawal_percent / 100) * ((1 + annual_withdrawal_inc) ** (year))) / (1 - draw_tax))
-                result_adjusted = ((running_portfolio_value * (target_withdrawal_percent / 100) * draw_adjust[year] * ((1 + annual_withdrawal_inc) ** (year))) / (1 - draw_tax))
-                floor = ((min_withdrawal_floor * draw_adjust[year] * ((1 + annual_withdrawal_inc) ** (year))) / (1 - draw_tax))
-                self.result = max(result_adjusted, floor)
-            else:
-                result_before_cap_floor = ((running_portfolio_value * (target_withdrawal_percent / 100) * ((1 + annual_withdrawal_inc) ** (year))) / (1 - draw_tax))
-                result_capped = min(previous_draw * (1 + vanguard_increase_ceiling / 100), result_before_cap_floor)
-                result_floored_capped = max(previous_draw * (1 - vanguard_decrease_floor / 100), result_capped)
-                self.result_unadjusted = result_floored_capped
-                try: 
-                    result_adjusted = (result_floored_capped / result_before_cap_floor) * ((running_portfolio_value * (target_withdrawal_percent / 100) * draw_adjust[year] * ((1 + annual_withdrawal_inc) ** (year))) / (1 - draw_tax))
-                except:
-                    result_adjusted = result_before_cap_floor
-                floor = ((min_withdrawal_floor * draw_adjust[year] * ((1 + annual_withdrawal_inc) ** (year))) / (1 - draw_tax))
-                self.result = max(result_adjusted, floor)
-        else: 
-            if b == 0:
-                self.result_unadjusted = ((running_portfolio_value * (target_withdrawal_percent / 100) * ((1 + annual_withdrawal_inc) ** (year)) - annuity_income * (1 - annuity_tax) - annuity_income2 * (1 - annuity_tax2) - annuity_income3 * (1 - annuity_tax3)) / (1 - draw_tax))
-                result_adjusted = ((running_portfolio_value * (target_withdrawal_percent / 100) * draw_adjust[year] * ((1 + annual_withdrawal_inc) ** (year)) - annuity_income * (1 - annuity_tax) - annuity_income2 * (1 - annuity_tax2) - annuity_income3 * (1 - annuity_tax3)) / (1 - draw_tax))
-                floor = ((min_withdrawal_floor * draw_adjust[year] * ((1 + annual_withdrawal_inc) ** (year)) - annuity_income * (1 - annuity_tax) - annuity_income2 * (1 - annuity_tax2) - annuity_income3 * (1 - annuity_tax3)) / (1 - draw_tax))
-                self.result = max(result_adjusted, floor)
-            else:
-                result_before_cap_floor = ((running_portfolio_value * (target_withdrawal_percent / 100) * ((1 + annual_withdrawal_inc) ** (year)) - annuity_income * (1 - annuity_tax) - annuity_income2 * (1 - annuity_tax2) - annuity_income3 * (1 - annuity_tax3)) / (1 - draw_tax))
-                result_capped = min(previous_draw * (1 + vanguard_increase_ceiling / 100), result_before_cap_floor)
-                result_floored_capped = max(previous_draw * (1 - vanguard_decrease_floor / 100), result_capped)
-                self.result_unadjusted = result_floored_capped
-                try: 
-                    result_adjusted = (result_floored_capped / result_before_cap_floor) * ((running_portfolio_value * (target_withdrawal_percent / 100) * draw_adjust[year] * ((1 + annual_withdrawal_inc) ** (year)) - annuity_income * (1 - annuity_tax) - annuity_income2 * (1 - annuity_tax2) - annuity_income3 * (1 - annuity_tax3)) / (1 - draw_tax))
-                except:
-                    result_adjusted = result_before_cap_floor
-                floor = ((min_withdrawal_floor * draw_adjust[year] * ((1 + annual_withdrawal_inc) ** (year)) - annuity_income * (1 - annuity_tax) - annuity_income2 * (1 - annuity_tax2) - annuity_income3 * (1 - annuity_tax3)) / (1 - draw_tax))
-                self.result = max(result_adjusted, floor)
-
-# Calculates and returns Bogleheads variable percentage withdrawal formula withdrawal amount (from running portfolio) for specific year in back-test cycle.  Nets off annuity income and scales amount upwards for tax costs.
-class CalcVPW:
-    def __init__(self, draw_adjust, draw_tax, running_portfolio_value, annual_withdrawal_inc, annuity_income, annuity_tax_rate, annuity_income2, annuity_tax_rate2, annuity_income3, annuity_tax_rate3, vpw_data, asset_mix, start_simulation_age, b, years_to_withdrawal, years):
-        start = max(start_simulation_age - 40, 0)
-        offset = max(years - 60, 0)        
-        row = min(max(start + years_to_withdrawal + b - offset, 0), 59)
-
-        if asset_mix[0] < 0.4:
-            draw_percents = vpw_data.vpwthirty[row]
-        elif asset_mix[0] < 0.5:
-            draw_percents = vpw_data.vpwforty[row]
-        elif asset_mix[0] < 0.6:
-            draw_percents = vpw_data.vpwfifty[row]
-        elif asset_mix[0] < 0.7:
-            draw_percents = vpw_data.vpwsixty[row]
-        else: 
-            draw_percents = vpw_data.vpwseventy[row]
-
-        self.result = running_portfolio_value * draw_percents * draw_adjust[b] / (1 - draw_tax)
-        self.result_unadjusted = running_portfolio_value * draw_percents / (1 - draw_tax)
-        self.draw_percents = draw_percents
-
-# Runs back-testing cycle simulation. Takes prepared parameters and prepared return data and returns data series of results.
-class RunSimulation:
-    def __init__(self, equity_real, bond_real, index_bond_real, asset_mix, start_sum, withdrawal_amount, years, annual_withdrawal_inc, draw_adjust, cpi, index_bond_forward, bond_forward, draw_tax, bonus_target, safest_swr_across_years, dynamic_option, target_withdrawal_percent, min_withdrawal_floor, flex_real_decrease, flex_real_increase, years_no_flex, spring_back, annuity_option_list, annuity_increase_list, annuity_price_list, annuity_tax_rate_list, cpi_change, annuity_percent_withdrawal_list, start_simulation_age, annuity_start_year_list, mortality_data_pull, ilb_spot_curve, data_direction, years_contributions, contribution, contribution_increase, years_between, yale_weighting, vanguard_decrease_floor, vanguard_increase_ceiling, vpw_data, net_other_income):
-                
-        annuity_option = annuity_option_list[0]
-        annuity_increase = annuity_increase_list[0]
-        annuity_price = annuity_price_list[0]
-        annuity_tax_rate = annuity_tax_rate_list[0]
-        annuity_percent_withdrawal = annuity_percent_withdrawal_list[0]
-        annuity_start_year = annuity_start_year_list[0]
-
-        annuity_option2 = annuity_option_list[1]
-        annuity_increase2 = annuity_increase_list[1]
-        annuity_price2 = annuity_price_list[1]
-        annuity_tax_rate2 = annuity_tax_rate_list[1]
-        annuity_percent_withdrawal2 = annuity_percent_withdrawal_list[1]
-        annuity_start_year2 = annuity_start_year_list[1]
-
-        annuity_option3 = annuity_option_list[2]
-        annuity_increase3 = annuity_increase_list[2]
-        annuity_price3 = annuity_price_list[2]
-        annuity_tax_rate3 = annuity_tax_rate_list[2]
-        annuity_percent_withdrawal3 = annuity_percent_withdrawal_list[2]
-        annuity_start_year3 = annuity_start_year_list[2]
-
-        # self.occupational_pension_check = [annuity_option3, annuity_increase3, annuity_price3, annuity_tax_rate3, annuity_percent_withdrawal3, annuity_start_year3]
-
+            cpi = np.lib.stride_tricks.sliding_window_view(np.asarray(cpi, dtype = float), years)[:cycles]
+            bond_real = np.asarray(bond_forward[:years], dtype = float) - cpi
+            index_bond_real = np.asarray(index_bond_forward[:years], dtype = float)
+        if np.ndim(asset_mix) == 2:
+            asset_mix = np.asarray(asset_mix, dtype = float).T[:, np.newaxis, :, np.newaxis]
+            equity_real, bond_real, index_bond_real = [returns.T.reshape(years, 1, -1) for returns in (equity_real, bond_real, index_bond_real)]
+        self.growth = 1 + equity_real * asset_mix[0] + bond_real * asset_mix[3] + index_bond_real * asset_mix[4]
+
+# Contributions made in each of the years_contributions years of the simulation (growing by contribution_increase percent a year)
+class ContributionStream:
+    def __init__(self, contribution, contribution_increase, years_contributions):
+        contributions = []
+        running_contribution = contribution
+        for b in range(years_contributions):
+            contributions.append(running_contribution)
+            running_contribution = running_contribution * (1 + contribution_increase / 100)
+        self.contributions = contributions
+
+# Index of blended portfolio growth factors for one set of return series, asset mix and data direction: the (cycles x years) growth factor matrix of CycleGrowthFactors with running products along each cycle from the start (growth_to_year[:, b] is the growth over years 0 to b - 1) and to the end (growth_to_end[:, b] is the growth over years b to the end).  Growth over any window of years and the value reached by a start value plus a stream of contributions are read from the running products instead of being stepped through a year at a time.  Arrays are read-only as indexes are shared between requests.
+class GrowthFactorIndex:
+    def __init__(self, growth):
+        growth_to_year = np.concatenate((np.ones((growth.shape[0], 1)), np.cumprod(growth, axis = 1)), axis = 1)
+        growth_to_end = np.ascontiguousarray(np.cumprod(growth[:, ::-1], axis = 1)[:, ::-1])
+        for array in (growth, growth_to_year, growth_to_end): array.flags.writeable = False
+        self.growth = growth
+        self.growth_to_year = growth_to_year
+        self.growth_to_end = growth_to_end
+        self.nbytes = growth.nbytes + growth_to_year.nbytes + growth_to_end.nbytes
+
+    # growth of each cycle over years first_year to last_year - 1
+    def window_growth(self, first_year, last_year):
+        return self.growth_to_year[:, last_year] / self.growth_to_year[:, first_year]
+
+    # running portfolio value of each cycle at the end of each of the first 'years' years (cycles x years) starting from start_value, with contributions[b] added at the start of year b (none after the end of the list) and no growth applied to values that are not positive.  Where no value can fall to zero or below this is (start_value + contributions to date each taken back to year 0 by the running products) x growth to the end of the year, otherwise the years are stepped through.
+    def accumulation_path(self, start_value, contributions, years):
+        contributions = np.concatenate((np.asarray(contributions[:years], dtype = float), np.zeros(max(years - len(contributions), 0))))
+        if start_value >= 0 and np.all(contributions >= 0) and np.all(self.growth[:, :years] > 0):
+            return self.growth_to_year[:, 1:years + 1] * (start_value + np.cumsum(contributions / self.growth_to_year[:, :years], axis = 1))
+        path = np.empty((self.growth.shape[0], years))
+        running_portfolio_value = np.full(self.growth.shape[0], float(start_value))
+        for b in range(years):
+            running_portfolio_value = running_portfolio_value + contributions[b]
+            running_portfolio_value = np.where(running_portfolio_value > 0, running_portfolio_value * self.growth[:, b], running_portfolio_value)
+            path[:, b] = running_portfolio_value
+        return path
+
+# Returns the GrowthFactorIndex for the return series, asset mix and data direction from growth_factor_index_cache, building and caching it if not held.  The return series are the (immutable) tuples of PrepareReturnData so they can be part of the key.
+class GetGrowthFactorIndex:
+    def __init__(self, equity_real, bond_real, index_bond_real, asset_mix, cpi, index_bond_forward, bond_forward, data_direction, cycles, years):
+        key = (tuple(equity_real), tuple(bond_real), tuple(index_bond_real), tuple(asset_mix), tuple(cpi), tuple(index_bond_forward), tuple(bond_forward), data_direction, cycles, years)
+        growth_factor_index = growth_factor_index_cache.get(key)
+        if growth_factor_index is None:
+            growth_factor_index = GrowthFactorIndex(CycleGrowthFactors(equity_real, bond_real, index_bond_real, asset_mix, cpi, index_bond_forward, bond_forward, data_direction, cycles, years).growth)
+            growth_factor_index_cache.put(key, growth_factor_index, growth_factor_index.nbytes)
+        self.growth_factor_index = growth_factor_index
+
+# Cycle-batched back-testing engine.  Rather than running each back-testing cycle in turn, all cycles are advanced together a year at a time with the running portfolio values of the cycles held in one array (zero floor, fail tagging, annuity purchase and annuity income netting applied element-wise).  Path dependent withdrawal options carry their state (e.g. running flex adjustment, previous draw) as one value per cycle and update it with masked (np.where) steps.  Results are written a year at a time into (years x cycles) arrays allocated up front, so each year is one contiguous row, and are returned as (cycles x years) arrays (unless streams is False, when only the end portfolio values and fail tags are returned).  income_totals keeps each cycle's total income (withdrawals including annuity income, net of tax) over the years of withdrawals.  If asset_mix is an (M x 5) array of asset mixes the cycles of every mix are run together as (M x cycles) rows (row = mix x cycles + cycle) - see RunAssetMixBatch.
+class RunSimulationCycles:
+    __slots__ = ['cycles', 'mix_count', 'years_to_withdrawal', 'end_portfolio_values', 'total_withdrawals', 'portfolio_values', 'withdrawals_all_periods', 'withdrawals', 'annuity_income', 'annuity_income2', 'annuity_income3', 'withdrawal_net_annuity', 'simulation_fail_tag', 'unadjusted_draw_tracker', 'annuity_purchase_cost']
+
+    def __init__(self, equity_real, bond_real, index_bond_real, asset_mix, start_sum, withdrawal_amount, years, annual_withdrawal_inc, draw_adjust, cpi, index_bond_forward, bond_forward, draw_tax, bonus_target, safest_swr_across_years, dynamic_option, target_withdrawal_percent, min_withdrawal_floor, flex_real_decrease, flex_real_increase, years_no_flex, spring_back, annuity_option_list, annuity_increase_list, annuity_price_list, annuity_tax_rate_list, cpi_change, annuity_percent_withdrawal_list, start_simulation_age, annuity_start_year_list, data_direction, years_contributions, contribution, contribution_increase, years_between, yale_weighting, vanguard_decrease_floor, vanguard_increase_ceiling, vpw_data, net_other_income, streams = True, income_totals = False):
+        annuity_option, annuity_option2, annuity_option3 = annuity_option_list
+        annuity_increase, annuity_increase2, annuity_increase3 = annuity_increase_list
+        annuity_tax_rate, annuity_tax_rate2, annuity_tax_rate3 = annuity_tax_rate_list
         if annuity_option2 == "4": annual_annuity2_inc = annuity_increase2 / 100
         else: annual_annuity2_inc = 0
         if annuity_option3 == "4": annual_annuity3_inc = annuity_increase3 / 100
         else: annual_annuity3_inc = 0
+        proportional_option = dynamic_option in ['proportional', 'yale', 'vanguard', 'vpw']
+        # withdrawal flex only applies where no annuity is bought to cover the withdrawal
+        flex_option = dynamic_option == 'constantflex' and (annuity_option == '3' or annuity_percent_withdrawal_list[0] == 0)
 
-        running_portfolio_value = start_sum
-        end_single_cycle_portfolio_values = []
-        through_single_cycle_portfolio_values = [start_sum]
-        all_portfolio_values_through_all_cycles = []
-        through_single_cycle_withdrawals = []
-        through_single_cycle_annuity_income = []
-        through_single_cycle_annuity_income2 = []
-        through_single_cycle_annuity_income3 = []
-        through_single_cycle_withdrawal_net_annuity = []
-        all_withdrawals_through_all_cycles = []
-        all_withdrawals_through_all_cycles_mort_adjusted_discounted = []
-        all_withdrawals_through_all_cycles_all_periods = []
-        annuity_income_through_all_cycles = []
-        annuity_income2_through_all_cycles = []
-        annuity_income3_through_all_cycles = []
-        withdrawal_net_annuity_through_all_cycles = []        
-        running_flex_withdrawal_adjustment = 1
-        through_single_cycle_avg_withdrawal = []
-        through_single_cycle_avg_withdrawal_mort_adjusted = []
-        mortality_adjustments = SurvivorshipWeightings(years, start_simulation_age, mortality_data_pull).result
-        through_single_cycle_withdrawals_mort_adjusted = []      
-        through_single_cycle_withdrawals_mort_adjusted_discounted = []
-        annuity_income_tracker_pre_purchase = (withdrawal_amount * annuity_percent_withdrawal / 100) / (1 - annuity_tax_rate)
-        annuity_income_tracker_pre_purchase2 = (annuity_percent_withdrawal2)
-        annuity_income_tracker_pre_purchase3 = (annuity_percent_withdrawal3)
-        annuity_income = 0
-        annuity_income2 = 0
-        annuity_income3 = 0
-        simulation_fail_tag = 0
-        simulation_fail_tag_through_all_cycles = []
-        bonus_payment = 0
-        # Below is to stop annuity option running if data_direction is 'back' (as frontend only allows annuity parameters to be changed if data_direction is 'forward').  Otherwise set annuity_percent_withdrawal to zero.
-        # if data_direction == "back": annuity_percent_withdrawal = 0
-        data_tracker = []
-        data_tracker_parent = []
-        running_contribution = contribution
+        cycles = len(equity_real) - years
         years_to_withdrawal = years_contributions + years_between
-        unadjusted_draw_tracker = []
-        annuity_purchase_cost = 0
-        annuity_purchase_cost2 = 0
-        annuity_purchase_cost3 = 0
-        annuity_purchase_cost_tracker = []
-
-        # 'a in range' represents each back-testing cycle and 'b in range' represents each year in each cycle
-        for a in range(len(equity_real) - years):
-            for b in range(years_to_withdrawal):
-                if b < years_contributions:
-                    running_portfolio_value += running_contribution
-                    running_contribution = running_contribution * (1 + contribution_increase / 100)
-                if data_direction == "back":
-                    if(running_portfolio_value > 0): running_portfolio_value = running_portfolio_value * (1 + equity_real[b + a] * asset_mix[0] + bond_real[b + a] * asset_mix[3] + index_bond_real[b + a] * asset_mix[4])
-                else:
-                    if(running_portfolio_value > 0): running_portfolio_value = running_portfolio_value * (1 + equity_real[b + a] * asset_mix[0] + (bond_forward[b] - cpi[b + a]) * asset_mix[3] + index_bond_forward[b] * asset_mix[4])
-                through_single_cycle_portfolio_values.append(running_portfolio_value)
-                if(a == 0): unadjusted_draw_tracker.append(0)
-
-                if b == 0: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase
-                else: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase * (1 + annual_withdrawal_inc)   
-
-                if b == 0: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2
-                else: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2 * (1 + annual_annuity2_inc) 
-
-                if b == 0: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase3
-                else: annuity_income_tracker_pre_purchase3 = annuity_income_tracker_pre_purchase3 * (1 + annual_annuity3_inc) 
-
-                through_single_cycle_annuity_income.append(0)
-                through_single_cycle_annuity_income2.append(0)
-                through_single_cycle_annuity_income3.append(0)
-                through_single_cycle_withdrawal_net_annuity.append(0)               
-
+        if np.ndim(asset_mix) == 2:
+            # growth factors for a batch of asset mixes are built for the batch as a whole rather than cached per mix (and running products are only taken if there are years before withdrawals start)
+            mix_count = len(asset_mix)
+            growth = CycleGrowthFactors(equity_real, bond_real, index_bond_real, asset_mix, cpi, index_bond_forward, bond_forward, data_direction, cycles, years).growth.reshape(years, mix_count * cycles)
+            growth_factor_index = GrowthFactorIndex(np.ascontiguousarray(growth.T)) if years_to_withdrawal > 0 else None
+            equity_share = np.repeat(np.asarray(asset_mix, dtype = float)[:, 0], cycles)
+        else:
+            mix_count = 1
+            growth_factor_index = GetGrowthFactorIndex(equity_real, bond_real, index_bond_real, asset_mix, cpi, index_bond_forward, bond_forward, data_direction, cycles, years).growth_factor_index
+            growth = np.ascontiguousarray(growth_factor_index.growth.T)
+            equity_share = asset_mix[0]
+        rows = mix_count * cycles
+        # a batch of asset mixes can carry the maximum SWR by simulation year of each mix ((M x years), see RunAssetMixBatch) - this is spread to (years x rows) so each year reads one value per row
+        if np.ndim(safest_swr_across_years) == 2: safest_swr_across_years = np.repeat(np.asarray(safest_swr_across_years, dtype = float).T, cycles, axis = 1)
+        # cpi changes (years x rows) are only needed to keep fixed and fixed increase (type "1" and "2") annuity income in real terms
+        if set(annuity_option_list) & {"1", "2"}: cpi_change = np.tile(np.lib.stride_tricks.sliding_window_view(np.asarray(cpi_change, dtype = float), years)[:cycles].T, (1, mix_count))
+        if dynamic_option == 'vpw':
+            # VPW table for each row picked by the equity share of its asset mix (under 40%, 40-50%, 50-60%, 60-70%, 70% and over)
+            vpw_tables = np.array([vpw_data.vpwthirty, vpw_data.vpwforty, vpw_data.vpwfifty, vpw_data.vpwsixty, vpw_data.vpwseventy], dtype = float)
+            vpw_table = np.searchsorted([0.4, 0.5, 0.6, 0.7], equity_share, side = 'right')
+        annuities = AnnuityPurchaseSchedule(withdrawal_amount, annual_withdrawal_inc, annuity_option_list, annuity_increase_list, annuity_price_list, annuity_tax_rate_list, annuity_percent_withdrawal_list, annuity_start_year_list, years, years_to_withdrawal)
+
+        portfolio_values = np.empty((years + 1, rows))
+        if streams:
+            # withdrawals for all years of the simulation (zero before withdrawals start) - 'withdrawals' is the part from the start of withdrawals
+            withdrawals_all_periods = np.zeros((years, rows))
+            annuity_income_record = np.zeros((years, rows))
+            annuity_income2_record = np.zeros((years, rows))
+            annuity_income3_record = np.zeros((years, rows))
+            withdrawal_net_annuity = np.zeros((years, rows))
+        simulation_fail_tag = np.zeros(rows, dtype = bool)
+        total_withdrawals = np.zeros(rows) if income_totals else None
+        unadjusted_draw_tracker = np.zeros(years)
+
+        portfolio_values[0] = float(start_sum)
+        if years_to_withdrawal > 0: portfolio_values[1:years_to_withdrawal + 1] = growth_factor_index.accumulation_path(start_sum, ContributionStream(contribution, contribution_increase, years_contributions).contributions, years_to_withdrawal).T
+        running_portfolio_value = portfolio_values[years_to_withdrawal].copy()
+
+        # annuity incomes stay scalar (zero) until an annuity is bought so that the netting of annuity income off withdrawals is not done value by value when there is none
+        annuity_income = 0.0
+        annuity_income2 = 0.0
+        annuity_income3 = 0.0
+        running_flex_withdrawal_adjustment = np.ones(rows)
+        previous_draw = np.zeros(rows)
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
             for b in range(years - years_to_withdrawal):
-                if b < (annuity_start_year2 - 1 - years_to_withdrawal):
-                    if b == 0 and years_to_withdrawal == 0: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2
-                    else: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2 * (1 + annual_annuity2_inc)
-                elif b == (annuity_start_year2 - 1 - years_to_withdrawal):
-                    if b == 0 and years_to_withdrawal == 0: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2
-                    else: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2 * (1 + annual_annuity2_inc)
-                    try: 
-                        annuity_purchase_cost2 = (annuity_income_tracker_pre_purchase2 / (annuity_price2 / 100))
-                    except: 
-                        annuity_purchase_cost2 = 0
-                    if running_portfolio_value >= annuity_purchase_cost2:
-                        running_portfolio_value = running_portfolio_value - annuity_purchase_cost2
-                        annuity_income2 = annuity_income_tracker_pre_purchase2
-                    else: 
-                        # This scales back the size of the annuity income that can be purchased if there are insufficient funds to purchase the entire target annuity
-                        annuity_income2 = annuity_income_tracker_pre_purchase2 * (running_portfolio_value / annuity_purchase_cost2)
-                        running_portfolio_value = 0
-
-                if b < (annuity_start_year3 - 1 - years_to_withdrawal):
-                    if b == 0 and years_to_withdrawal == 0: annuity_income_tracker_pre_purchase3 = annuity_income_tracker_pre_purchase3
-                    else: annuity_income_tracker_pre_purchase3 = annuity_income_tracker_pre_purchase3 * (1 + annual_annuity3_inc)
-                elif b == (annuity_start_year3 - 1 - years_to_withdrawal):
-                    if b == 0 and years_to_withdrawal == 0: annuity_income_tracker_pre_purchase3 = annuity_income_tracker_pre_purchase3
-                    else: annuity_income_tracker_pre_purchase3 = annuity_income_tracker_pre_purchase3 * (1 + annual_annuity3_inc)
-                    try: 
-                        annuity_purchase_cost3 = (annuity_income_tracker_pre_purchase3 / (annuity_price3 / 100))
-                    except: 
-                        annuity_purchase_cost3 = 0
-                    if running_portfolio_value >= annuity_purchase_cost3:
-                        running_portfolio_value = running_portfolio_value - annuity_purchase_cost3
-                        annuity_income3 = annuity_income_tracker_pre_purchase3
-                    else: 
-                        # This scales back the size of the annuity income that can be purchased if there are insufficient funds to purchase the entire target annuity
-                        annuity_income3 = annuity_income_tracker_pre_purchase3 * (running_portfolio_value / annuity_purchase_cost3)
-                        running_portfolio_value = 0
-
-                if b < (annuity_start_year - 1 - years_to_withdrawal):
-                    if b == 0 and years_to_withdrawal == 0: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase
-                    else: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase * (1 + annual_withdrawal_inc)
-                elif b == (annuity_start_year - 1 - years_to_withdrawal):
-                    if b == 0 and years_to_withdrawal == 0: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase
-                    else: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase * (1 + annual_withdrawal_inc)
-                    # This nets the state and occupational pensions off what is required to achieved annuity withdrawal coverage
-                    if annuity_start_year2 and annuity_start_year3 <= annuity_start_year: 
-                        annuity_income_tracker_pre_purchase = max((annuity_income_tracker_pre_purchase - annuity_income_tracker_pre_purchase2 * (1 - annuity_tax_rate2) - annuity_income_tracker_pre_purchase3 * (1 - annuity_tax_rate3)), 0) 
-                    elif annuity_start_year2 <= annuity_start_year: 
-                        annuity_income_tracker_pre_purchase = max((annuity_income_tracker_pre_purchase - annuity_income_tracker_pre_purchase2 * (1 - annuity_tax_rate2)), 0) 
-                    elif annuity_start_year3 <= annuity_start_year: 
-                        annuity_income_tracker_pre_purchase = max((annuity_income_tracker_pre_purchase - annuity_income_tracker_pre_purchase3 * (1 - annuity_tax_rate3)), 0) 
-                    else: 
-                        annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase 
-                    try: 
-                        annuity_purchase_cost = (annuity_income_tracker_pre_purchase / (annuity_price / 100))
-                    except: 
-                        annuity_purchase_cost = 0
-                    if running_portfolio_value >= annuity_purchase_cost:
-                        running_portfolio_value = running_portfolio_value - annuity_purchase_cost
-                        annuity_income = annuity_income_tracker_pre_purchase
-                    else: 
-                        # This scales back the size of the annuity income that can be purchased if there are insufficient funds to purchase the entire target annuity
-                        annuity_income = annuity_income_tracker_pre_purchase * (running_portfolio_value / annuity_purchase_cost)
-                        running_portfolio_value = 0                        
-
-                # Below calculates withdrawal amount (draw) according to withdrawal option (dynamic_option) selected. The three classes above (Calc ConstantWithdrawal, CalcProportionalWithdrawal, CalcBonusWithdrawal) calculate the withdrawal amounts for each cycle. Withdrawal amounts are calculated net of any annuity income. Net withdrawal amounts are scaled up to cover cost of any deferred income tax - this is applied only to the net as cost of deferred income tax already applied to annuity purchase amount. 
+                year = b + years_to_withdrawal
+
+                # annuities are bought in order 2, 3, 1 (as income from 2 and 3 is netted off annuity 1).  If the portfolio can not cover the purchase the annuity income is scaled back and the portfolio is used up.
+                for annuity in [1, 2, 0]:
+                    if annuities.purchase_year[annuity] == b:
+                        purchase_cost = annuities.purchase_cost[annuity]
+                        target_income = annuities.target_income[annuity]
+                        affordable = running_portfolio_value >= purchase_cost
+                        income = np.where(affordable, target_income, target_income * (running_portfolio_value / purchase_cost))
+                        running_portfolio_value = np.where(affordable, running_portfolio_value - purchase_cost, 0.0)
+                        if annuity == 0: annuity_income = income
+                        elif annuity == 1: annuity_income2 = income
+                        else: annuity_income3 = income
+
+                net_annuity_income = annuity_income * (1 - annuity_tax_rate)
+                net_annuity_income2 = annuity_income2 * (1 - annuity_tax_rate2)
+                net_annuity_income3 = annuity_income3 * (1 - annuity_tax_rate3)
+                withdrawal_inc = ((1 + annual_withdrawal_inc) ** (year))
+
                 # This reads the maximum SWR by simulation year for use in withdrawal bonus and withdrawal flex calculations.  It reads the value for the preceding year to add assurance the bonus or flexed withdrawal is not too large.
                 if b == 0:
                     min_multiple = 1 / (safest_swr_across_years[b + years_to_withdrawal] / 100)
                 else:
                     min_multiple = 1 / (safest_swr_across_years[b - 1 + years_to_withdrawal] / 100)
 
-                if(dynamic_option == 'proportional' or dynamic_option == 'yale' or dynamic_option == 'vanguard' or dynamic_option == 'vpw'):
-                    bonus = 0
-                    if b == 0: previous_draw = 0
-                    if(dynamic_option == 'yale'):
-                        calc = CalcProportionalWithdrawalYale(target_withdrawal_percent, draw_adjust, draw_tax, (b + years_to_withdrawal), running_portfolio_value, min_withdrawal_floor, annual_withdrawal_inc, annuity_income, annuity_tax_rate, annuity_income2, annuity_tax_rate2, annuity_income3, annuity_tax_rate3, b, previous_draw, yale_weighting, net_other_income)
-                        draw = calc.result
-                        previous_draw = calc.result_unadjusted
-                    elif(dynamic_option == 'vanguard'):
-                        calc = CalcProportionalWithdrawalVanguard(target_withdrawal_percent, draw_adjust, draw_tax, (b + years_to_withdrawal), running_portfolio_value, min_withdrawal_floor, annual_withdrawal_inc, annuity_income, annuity_tax_rate, annuity_income2, annuity_tax_rate2, annuity_income3, annuity_tax_rate3, b, previous_draw, vanguard_decrease_floor, vanguard_increase_ceiling, net_other_income)
-                        draw = calc.result
-                        previous_draw = calc.result_unadjusted
-                    elif(dynamic_option == 'vpw'):
-                        calc = CalcVPW(draw_adjust, draw_tax, running_portfolio_value, annual_withdrawal_inc, annuity_income, annuity_tax_rate, annuity_income2, annuity_tax_rate2, annuity_income3, annuity_tax_rate3, vpw_data, asset_mix, start_simulation_age, b, years_to_withdrawal, years)
-                        draw = calc.result
-                        previous_draw = calc.result_unadjusted
-                        # data_tracker.append(calc.draw_percents)
+                # Below calculates withdrawal amount (draw) according to withdrawal option (dynamic_option) selected. Withdrawal amounts are calculated net of any annuity income (for proportional options only if net_other_income is set). Net withdrawal amounts are scaled up to cover cost of any deferred income tax.
+                if proportional_option:
+                    bonus_payment = 0
+                    target_draw = running_portfolio_value * (target_withdrawal_percent / 100)
+                    floor = min_withdrawal_floor * draw_adjust[year] * withdrawal_inc
+                    if net_other_income != "0": floor = floor - net_annuity_income - net_annuity_income2 - net_annuity_income3
+                    floor = floor / (1 - draw_tax)
+                    if dynamic_option == 'vpw':
+                        draw_percent = vpw_tables[vpw_table, min(max(max(start_simulation_age - 40, 0) + years_to_withdrawal + b - max(years - 60, 0), 0), 59)]
+                        draw = running_portfolio_value * draw_percent * draw_adjust[b] / (1 - draw_tax)
+                        previous_draw = running_portfolio_value * draw_percent / (1 - draw_tax)
+                    elif dynamic_option == 'yale':
+                        # Yale: weighted average of last year's (unadjusted) draw and the target percentage of the portfolio
+                        if b > 0: target_draw = (1 - yale_weighting / 100) * target_draw + (yale_weighting / 100) * previous_draw
+                        draw = target_draw * draw_adjust[year] * withdrawal_inc
+                        previous_draw = target_draw * withdrawal_inc
+                        if net_other_income != "0":
+                            draw = draw - net_annuity_income - net_annuity_income2 - net_annuity_income3
+                            previous_draw = previous_draw - net_annuity_income - net_annuity_income2 - net_annuity_income3
+                        draw = np.maximum(draw / (1 - draw_tax), floor)
+                        previous_draw = previous_draw / (1 - draw_tax)
+                    elif dynamic_option == 'vanguard':
+                        # Vanguard: target percentage of the portfolio, capped / floored at a percentage change on last year's (unadjusted) draw
+                        draw_before_cap_floor = target_draw * withdrawal_inc
+                        draw = target_draw * draw_adjust[year] * withdrawal_inc
+                        if net_other_income != "0":
+                            draw_before_cap_floor = draw_before_cap_floor - net_annuity_income - net_annuity_income2 - net_annuity_income3
+                            draw = draw - net_annuity_income - net_annuity_income2 - net_annuity_income3
+                        draw_before_cap_floor = draw_before_cap_floor / (1 - draw_tax)
+                        draw = draw / (1 - draw_tax)
+                        if b == 0:
+                            previous_draw = draw_before_cap_floor
+                        else:
+                            draw_floored_capped = np.maximum(previous_draw * (1 - vanguard_decrease_floor / 100), np.minimum(previous_draw * (1 + vanguard_increase_ceiling / 100), draw_before_cap_floor))
+                            draw = np.where(draw_before_cap_floor == 0, draw_before_cap_floor, (draw_floored_capped / draw_before_cap_floor) * draw)
+                            previous_draw = draw_floored_capped
+                        draw = np.maximum(draw, floor)
                     else:
-                        draw = CalcProportionalWithdrawal(target_withdrawal_percent, draw_adjust, draw_tax, (b + years_to_withdrawal), running_portfolio_value, min_withdrawal_floor, annual_withdrawal_inc, annuity_income, annuity_tax_rate, annuity_income2, annuity_tax_rate2, annuity_income3, annuity_tax_rate3, net_other_income).result 
-                    single_withdrawal = ((max(min(draw, running_portfolio_value),0)) * (1 - draw_tax)) + (annuity_income * (1 - annuity_tax_rate)) + (annuity_income2 * (1 - annuity_tax_rate2) ) + (annuity_income3 * (1 - annuity_tax_rate3))
-                    through_single_cycle_withdrawals.append(single_withdrawal)
-        
-                    through_single_cycle_annuity_income.append(annuity_income * (1 - annuity_tax_rate))
-                    through_single_cycle_annuity_income2.append(annuity_income2 * (1 - annuity_tax_rate2))
-                    through_single_cycle_annuity_income3.append(annuity_income3 * (1 - annuity_tax_rate3))
-                    through_single_cycle_withdrawal_net_annuity.append(single_withdrawal - annuity_income * (1 - annuity_tax_rate) - annuity_income2 * (1 - annuity_tax_rate2) - annuity_income3 * (1 - annuity_tax_rate3))
+                        draw = target_draw * draw_adjust[year] * withdrawal_inc
+                        if net_other_income != "0": draw = draw - net_annuity_income - net_annuity_income2 - net_annuity_income3
+                        draw = np.maximum(draw / (1 - draw_tax), floor)
+                    unadjusted_draw_tracker[year] = draw[0]
+                    drawn = np.maximum(np.minimum(draw, running_portfolio_value), 0)
 
-                    # Ensures simulated portfolio value can not turn negative whilst recording a fail if it would have done had the the due withdrawal been taken in full.
-                    if (running_portfolio_value - draw) < 0:
-                        simulation_fail_tag = 1
-                    running_portfolio_value = max((running_portfolio_value - draw),0)
-
-                    if(a == 0): unadjusted_draw_tracker.append(draw)  
-
-                    # Conditional running_portfolio_value > 0 is not whilst code stops running_portfolio_value from turning negative.
-                    if data_direction == "back":
-                        if(running_portfolio_value > 0): running_portfolio_value = running_portfolio_value * (1 + equity_real[b + a + years_to_withdrawal] * asset_mix[0] + bond_real[b + a + years_to_withdrawal] * asset_mix[3] + index_bond_real[b + a + years_to_withdrawal] * asset_mix[4])
-                    else:
-                        if(running_portfolio_value > 0): running_portfolio_value = running_portfolio_value * (1 + equity_real[b + a + years_to_withdrawal] * asset_mix[0] + (bond_forward[b + years_to_withdrawal] - cpi[b + a + years_to_withdrawal]) * asset_mix[3] + index_bond_forward[b + years_to_withdrawal] * asset_mix[4])
-                    through_single_cycle_portfolio_values.append(running_portfolio_value)
-                
                 else:
-                    if(dynamic_option == 'constantbonus'): 
-                        bonus = CalcBonusWithdrawal(bonus_target, draw_adjust, annual_withdrawal_inc, draw_tax, (b + years_to_withdrawal), annuity_income, annuity_tax_rate,  annuity_income2, annuity_tax_rate2, annuity_income3, annuity_tax_rate3).result
-                    else:
-                        bonus = 0
-                    
+                    if dynamic_option == 'constantbonus': bonus = ((bonus_target * draw_adjust[year] * withdrawal_inc) / (1 - draw_tax))
+                    else: bonus = 0
                     # Unadjusted_draw is used for withdrawal flex and withdrawal bonus calculation.  It excludes any year by year adjustments to the withdrawal level (e.g. as % normal withdrawal level). This is used to calculate the maximum possible extra withdrawal permitted whilst remaining inside the max SWR.  The max SWR already incorporates the effect of year by year adjustments to the withdrawal level.
-                    unadjusted_draw = CalcConstantWithdrawal(withdrawal_amount, draw_adjust, annual_withdrawal_inc, draw_tax, (b + years_to_withdrawal), annuity_income, annuity_tax_rate,  annuity_income2, annuity_tax_rate2, annuity_income3, annuity_tax_rate3).unadjusted_result
-                    if(dynamic_option == 'constantflex' and annuity_option == '3') or (dynamic_option == 'constantflex' and annuity_percent_withdrawal == 0):
-                        if (unadjusted_draw > 0 and b >= years_no_flex):
-                            # this checks whether sufficient portfolio value to flex withdrawal level upwards...
-                            if(running_portfolio_value / (unadjusted_draw * running_flex_withdrawal_adjustment * (1 + flex_real_increase/100)) > min_multiple): 
-                                if(spring_back == "1"):
-                                    if running_flex_withdrawal_adjustment >= 1:
-                                        running_flex_withdrawal_adjustment = running_flex_withdrawal_adjustment + (flex_real_increase/100)
-                                        draw = CalcConstantWithdrawal(withdrawal_amount, draw_adjust, annual_withdrawal_inc, draw_tax, (b + years_to_withdrawal), annuity_income, annuity_tax_rate, annuity_income2, annuity_tax_rate2, annuity_income3, annuity_tax_rate3).result * running_flex_withdrawal_adjustment
-                                    else:
-                                        running_flex_withdrawal_adjustment = min((running_portfolio_value / (unadjusted_draw * min_multiple)), 1)
-                                        draw = CalcConstantWithdrawal(withdrawal_amount, draw_adjust, annual_withdrawal_inc, draw_tax, (b + years_to_withdrawal), annuity_income, annuity_tax_rate, annuity_income2, annuity_tax_rate2, annuity_income3, annuity_tax_rate3).result * running_flex_withdrawal_adjustment
-                                else:
-                                    running_flex_withdrawal_adjustment = running_flex_withdrawal_adjustment + (flex_real_increase/100)
-                                    draw = CalcConstantWithdrawal(withdrawal_amount, draw_adjust, annual_withdrawal_inc, draw_tax, (b + years_to_withdrawal), annuity_income, annuity_tax_rate,  annuity_income2, annuity_tax_rate2, annuity_income3, annuity_tax_rate3).result * running_flex_withdrawal_adjustment
-                            # ...of sufficient portfolio value to maintain withdrawal level...
-                            elif(running_portfolio_value / (unadjusted_draw * running_flex_withdrawal_adjustment) >= min_multiple): 
-                                draw = CalcConstantWithdrawal(withdrawal_amount, draw_adjust, annual_withdrawal_inc, draw_tax, (b + years_to_withdrawal), annuity_income, annuity_tax_rate, annuity_income2, annuity_tax_rate2, annuity_income3, annuity_tax_rate3).result * running_flex_withdrawal_adjustment
-                            # ...otherwise this flexes withdrawal level downwards
-                            else:
-                                running_flex_withdrawal_adjustment = running_flex_withdrawal_adjustment - (flex_real_decrease/100)
-                                draw = CalcConstantWithdrawal(withdrawal_amount, draw_adjust, annual_withdrawal_inc, draw_tax, (b + years_to_withdrawal), annuity_income, annuity_tax_rate,  annuity_income2, annuity_tax_rate2, annuity_income3, annuity_tax_rate3).result * running_flex_withdrawal_adjustment
-                        else:
-                            draw = CalcConstantWithdrawal(withdrawal_amount, draw_adjust, annual_withdrawal_inc, draw_tax, (b + years_to_withdrawal), annuity_income, annuity_tax_rate, annuity_income2, annuity_tax_rate2, annuity_income3, annuity_tax_rate3).result
-                    else:
-                        draw = CalcConstantWithdrawal(withdrawal_amount, draw_adjust, annual_withdrawal_inc, draw_tax, (b + years_to_withdrawal), annuity_income, annuity_tax_rate, annuity_income2, annuity_tax_rate2, annuity_income3, annuity_tax_rate3).result
-                    
-                    if(a == 0): unadjusted_draw_tracker.append(unadjusted_draw)  
-
-                    # This calculates the withdrawal recorded as part of the data output, capped by sufficient portfolio value availability to pay it.  The withdrawals are recorded net of tax, since they have been previously scaled up to include the cost of tax ('draw').
-                    if(b == 0): 
-                        single_withdrawal = (max(min(draw, running_portfolio_value),0) * (1 - draw_tax)) + (annuity_income * (1 - annuity_tax_rate)) + (annuity_income2 * (1 - annuity_tax_rate2)) + (annuity_income3 * (1 - annuity_tax_rate3))
-                        through_single_cycle_withdrawals.append(single_withdrawal)
-                    
-                    else:
-                        if(unadjusted_draw > 0):
-                            # this is to stop negative draw (e.g. state pension > withdrawal) screwing up the min funding multiple check...
-                            if(((running_portfolio_value - max(draw,0)) / max(unadjusted_draw,0)) > min_multiple):
-                                # bonus_payment = max(min((bonus),((running_portfolio_value - draw) - (min_multiple * unadjusted_draw))),0)
-                                bonus_payment = max(min((bonus),((running_portfolio_value - max(draw,0)) - (min_multiple * max(unadjusted_draw,0)))),0)
-                                single_withdrawal = ((bonus_payment * (1 - draw_tax)) + (max(min(draw, running_portfolio_value),0) * (1 - draw_tax)) + (annuity_income * (1 - annuity_tax_rate)) + (annuity_income2 * (1 - annuity_tax_rate2)) + (annuity_income3 * (1 - annuity_tax_rate3)))
-                                through_single_cycle_withdrawals.append(single_withdrawal)
-                            else: 
-                                single_withdrawal = ((max(min(draw, running_portfolio_value),0) * (1 - draw_tax)) + (annuity_income * (1 - annuity_tax_rate)) + (annuity_income2 * (1 - annuity_tax_rate2)) + (annuity_income3 * (1 - annuity_tax_rate3)))
-                                through_single_cycle_withdrawals.append(single_withdrawal)
-                        else:
-                            bonus_payment = max(min((bonus),(running_portfolio_value - max(draw,0))),0)
-                            single_withdrawal = ((bonus_payment * (1 - draw_tax)) + (annuity_income * (1 - annuity_tax_rate)) + (annuity_income2 * (1 - annuity_tax_rate2)) + (annuity_income3 * (1 - annuity_tax_rate3)))
-                            through_single_cycle_withdrawals.append(single_withdrawal)
-
-                    through_single_cycle_annuity_income.append(annuity_income * (1 - annuity_tax_rate))
-                    through_single_cycle_annuity_income2.append(annuity_income2 * (1 - annuity_tax_rate2))
-                    through_single_cycle_annuity_income3.append(annuity_income3 * (1 - annuity_tax_rate3))
-                    through_single_cycle_withdrawal_net_annuity.append(single_withdrawal - annuity_income * (1 - annuity_tax_rate) - annuity_income2 * (1 - annuity_tax_rate2) - annuity_income3 * (1 - annuity_tax_rate3))
-
-                    # Deduction of bonus and draw (including cost of tax) from portfolio value. Ensures simulated portfolio value can not turn negative whilst recording a fail if it would have done had the the due withdrawal been taken in full.
-                    if (running_portfolio_value - draw) < 0:
-                        simulation_fail_tag = 1
-                    running_portfolio_value = max((running_portfolio_value - draw - bonus_payment),0)
-
-                    # Conditional running_portfolio_value > 0 is to stop running_portfolio_value from turning negative.
-                    if data_direction == "back":
-                        if(running_portfolio_value > 0): running_portfolio_value = running_portfolio_value * (1 + equity_real[b + a + years_to_withdrawal] * asset_mix[0] + bond_real[b + a + years_to_withdrawal] * asset_mix[3] + index_bond_real[b + a + years_to_withdrawal] * asset_mix[4])
+                    draw = ((withdrawal_amount * draw_adjust[year] * withdrawal_inc - net_annuity_income - net_annuity_income2 - net_annuity_income3) / (1 - draw_tax))
+                    unadjusted_draw = ((withdrawal_amount * withdrawal_inc - net_annuity_income - net_annuity_income2 - net_annuity_income3) / (1 - draw_tax))
+                    if flex_option and b >= years_no_flex:
+                        # flexes withdrawal level upwards if sufficient portfolio value, maintains it if sufficient portfolio value to maintain it, otherwise flexes it downwards (spring_back returns a reduced withdrawal level straight to the level the portfolio supports, up to the unflexed level)
+                        flex = unadjusted_draw > 0
+                        flex_up = (running_portfolio_value / (unadjusted_draw * running_flex_withdrawal_adjustment * (1 + flex_real_increase / 100))) > min_multiple
+                        flex_hold = (running_portfolio_value / (unadjusted_draw * running_flex_withdrawal_adjustment)) >= min_multiple
+                        if spring_back == "1": flexed_up = np.where(running_flex_withdrawal_adjustment >= 1, running_flex_withdrawal_adjustment + (flex_real_increase / 100), np.minimum((running_portfolio_value / (unadjusted_draw * min_multiple)), 1))
+                        else: flexed_up = running_flex_withdrawal_adjustment + (flex_real_increase / 100)
+                        flexed = np.where(flex_up, flexed_up, np.where(flex_hold, running_flex_withdrawal_adjustment, running_flex_withdrawal_adjustment - (flex_real_decrease / 100)))
+                        running_flex_withdrawal_adjustment = np.where(flex, flexed, running_flex_withdrawal_adjustment)
+                        draw = np.where(flex, draw * running_flex_withdrawal_adjustment, draw)
+                    unadjusted_draw_tracker[year] = np.ravel(unadjusted_draw)[0]
+
+                    # This calculates the withdrawal recorded as part of the data output, capped by sufficient portfolio value availability to pay it.  After the first year a bonus is paid if the portfolio value (after the draw) is above min_multiple times the unadjusted draw (limited to the excess), and a negative unadjusted draw (e.g. state pension > withdrawal) means only the bonus and annuity income are recorded.
+                    drawn = np.maximum(np.minimum(draw, running_portfolio_value), 0)
+                    if b == 0:
+                        bonus_payment = 0
+                    elif dynamic_option != 'constantbonus':
+                        # (bonus is zero so no bonus payment can be made)
+                        bonus_payment = 0
+                        drawn = np.where(unadjusted_draw > 0, drawn, 0.0)
                     else:
-                        if(running_portfolio_value > 0): running_portfolio_value = running_portfolio_value * (1 + equity_real[b + a + years_to_withdrawal] * asset_mix[0] + (bond_forward[b + years_to_withdrawal] - cpi[b + a + years_to_withdrawal]) * asset_mix[3] + index_bond_forward[b + years_to_withdrawal] * asset_mix[4])
-                    through_single_cycle_portfolio_values.append(running_portfolio_value)
+                        excess_portfolio_value = running_portfolio_value - np.maximum(draw, 0)
+                        bonus_payment = np.where(unadjusted_draw > 0, np.where((excess_portfolio_value / np.maximum(unadjusted_draw, 0)) > min_multiple, np.maximum(np.minimum(bonus, excess_portfolio_value - (min_multiple * np.maximum(unadjusted_draw, 0))), 0), 0.0), np.maximum(np.minimum(bonus, excess_portfolio_value), 0))
+                        drawn = np.where(unadjusted_draw > 0, drawn, 0.0)
+
+                # The withdrawals are recorded net of tax, since they have been previously scaled up to include the cost of tax ('draw').
+                if streams or income_totals:
+                    single_withdrawal = (bonus_payment * (1 - draw_tax)) + (drawn * (1 - draw_tax)) + net_annuity_income + net_annuity_income2 + net_annuity_income3
+                if income_totals: total_withdrawals += single_withdrawal
+                if streams:
+                    withdrawals_all_periods[year] = single_withdrawal
+                    annuity_income_record[year] = net_annuity_income
+                    annuity_income2_record[year] = net_annuity_income2
+                    annuity_income3_record[year] = net_annuity_income3
+                    withdrawal_net_annuity[year] = single_withdrawal - net_annuity_income - net_annuity_income2 - net_annuity_income3
+
+                # Deduction of bonus and draw (including cost of tax) from portfolio value. Ensures simulated portfolio value can not turn negative whilst recording a fail if it would have done had the the due withdrawal been taken in full.
+                simulation_fail_tag |= (running_portfolio_value - draw) < 0
+                running_portfolio_value = np.maximum(running_portfolio_value - draw - bonus_payment, 0)
+                running_portfolio_value = np.where(running_portfolio_value > 0, running_portfolio_value * growth[year], running_portfolio_value)
+                if streams: portfolio_values[year + 1] = running_portfolio_value
 
                 # Adjusts annuity income to keep it in real terms (e.g. if fixed type (type = "1"), then income is reduced by inflation rate)
-                if annuity_option == "1": annuity_income = annuity_income / (1 + cpi_change [b + a + years_to_withdrawal])
-                elif annuity_option == "2": annuity_income = annuity_income * (1 + annuity_increase / 100) / (1 + cpi_change [b + a + years_to_withdrawal])
-                else: annuity_income = annuity_income
-
-                if annuity_option2 == "1": annuity_income2 = annuity_income2 / (1 + cpi_change [b + a + years_to_withdrawal])
-                elif annuity_option2 == "2": annuity_income2 = annuity_income2 * (1 + annuity_increase2 / 100) / (1 + cpi_change [b + a + years_to_withdrawal])
-                elif annuity_option2 == "3": annuity_income2 = annuity_income2
-                else: annuity_income2 = annuity_income2 * (1 + annual_annuity2_inc)
-
-                if annuity_option3 == "1": annuity_income3 = annuity_income3 / (1 + cpi_change [b + a + years_to_withdrawal])
-                elif annuity_option3 == "2": annuity_income3 = annuity_income3 * (1 + annuity_increase3 / 100) / (1 + cpi_change [b + a + years_to_withdrawal])
-                elif annuity_option3 == "3": annuity_income3 = annuity_income3
-                else: annuity_income3 = annuity_income3 * (1 + annual_annuity3_inc)                   
-                
-                bonus_payment = 0
-
-            # Survivorship adjustment (e.g. withdrawal recorded x probability of survivorship to associated age) and temporal discount (using 'real' interest rate curve)
-            for a in range(years - years_to_withdrawal):
-                through_single_cycle_withdrawals_mort_adjusted.append((through_single_cycle_withdrawals[a] * mortality_adjustments[a + years_to_withdrawal]))
-                through_single_cycle_withdrawals_mort_adjusted_discounted.append((through_single_cycle_withdrawals[a] * mortality_adjustments[a + years_to_withdrawal])/((1 + ilb_spot_curve[a + years_to_withdrawal]) ** (a + years_to_withdrawal)))
-            through_single_cycle_avg_withdrawal_mort_adjusted.append(sum(through_single_cycle_withdrawals_mort_adjusted)/len(through_single_cycle_withdrawals_mort_adjusted))
-            through_single_cycle_avg_withdrawal.append(sum(through_single_cycle_withdrawals)/len(through_single_cycle_withdrawals))
-
-            end_single_cycle_portfolio_values.append(running_portfolio_value)
-            all_portfolio_values_through_all_cycles.append(through_single_cycle_portfolio_values)
-            
-            annuity_income_through_all_cycles.append(through_single_cycle_annuity_income)
-            annuity_income2_through_all_cycles.append(through_single_cycle_annuity_income2)
-            annuity_income3_through_all_cycles.append(through_single_cycle_annuity_income3)
-            withdrawal_net_annuity_through_all_cycles.append(through_single_cycle_withdrawal_net_annuity)  
-            through_single_cycle_annuity_income = []
-            through_single_cycle_annuity_income2 = []
-            through_single_cycle_annuity_income3 = []
-            through_single_cycle_withdrawal_net_annuity = []
-
-            all_withdrawals_through_all_cycles.append(through_single_cycle_withdrawals)
-            all_withdrawals_through_all_cycles_mort_adjusted_discounted.append(through_single_cycle_withdrawals_mort_adjusted_discounted)
-            through_single_cycle_withdrawal_all_periods = [0] * years_to_withdrawal + through_single_cycle_withdrawals
-            all_withdrawals_through_all_cycles_all_periods.append(through_single_cycle_withdrawal_all_periods)
-
-            annuity_income = 0
-            annuity_income_tracker_pre_purchase = (withdrawal_amount * annuity_percent_withdrawal / 100) / (1 - annuity_tax_rate)
-            annuity_income2 = 0
-            annuity_income_tracker_pre_purchase2 = (annuity_percent_withdrawal2)
-            annuity_income3 = 0
-            annuity_income_tracker_pre_purchase3 = (annuity_percent_withdrawal3)            
-            through_single_cycle_portfolio_values = [start_sum]
-            through_single_cycle_withdrawals = []
-            through_single_cycle_withdrawals_mort_adjusted = []
-            through_single_cycle_withdrawals_mort_adjusted_discounted = []
-            through_single_cycle_withdrawal_all_periods = []
-            running_portfolio_value = start_sum
-            running_flex_withdrawal_adjustment = 1
-            simulation_fail_tag_through_all_cycles.append(simulation_fail_tag)
-            simulation_fail_tag = 0
-            running_contribution = contribution
-            data_tracker_parent.append(data_tracker)
-            data_tracker = []
-            annuity_purchase_cost_tracker.append([annuity_purchase_cost, annuity_purchase_cost2])
-
-        # sorts out data for percentile chart for portfolio values
-        porfolio_value_dec0 = []
-        porfolio_value_dec10 = []
-        porfolio_value_dec25 = []
-        porfolio_value_dec50 = []
-        porfolio_value_dec75 = []
-        porfolio_value_dec90 = []
-        porfolio_value_dec100 = []
-        portfolio_value_fan_chart_data = []
-        vertical = []
-        for a in range(len(all_portfolio_values_through_all_cycles[0])):
-            for b in range(len(all_portfolio_values_through_all_cycles)):
-                vertical.append(all_portfolio_values_through_all_cycles[b][a])
-            porfolio_value_dec0.append(np.percentile(vertical, 0))
-            porfolio_value_dec10.append(np.percentile(vertical, 10))
-            porfolio_value_dec25.append(np.percentile(vertical, 25))
-            porfolio_value_dec50.append(np.percentile(vertical, 50))
-            porfolio_value_dec75.append(np.percentile(vertical, 75))
-            porfolio_value_dec90.append(np.percentile(vertical, 90))
-            porfolio_value_dec100.append(np.percentile(vertical, 100))
-            vertical = []
-        portfolio_value_fan_chart_data.append(porfolio_value_dec0)
-        portfolio_value_fan_chart_data.append(porfolio_value_dec10)
-        portfolio_value_fan_chart_data.append(porfolio_value_dec25)
-        portfolio_value_fan_chart_data.append(porfolio_value_dec50)
-        portfolio_value_fan_chart_data.append(porfolio_value_dec75)
-        portfolio_value_fan_chart_data.append(porfolio_value_dec90)
-        portfolio_value_fan_chart_data.append(porfolio_value_dec100)
-
-        # sorts out data for percentile chart for income / withdrawal
-        income_value_dec0 = []
-        income_value_dec10 = []
-        income_value_dec25 = []
-        income_value_dec50 = []
-        income_value_dec75 = []
-        income_value_dec90 = []
-        income_value_dec100 = []
-        income_value_fan_chart_data = []
-        vertical = []
-        for a in range(len(all_withdrawals_through_all_cycles_all_periods[0])):
-            for b in range(len(all_withdrawals_through_all_cycles_all_periods)):
-                vertical.append(all_withdrawals_through_all_cycles_all_periods[b][a])
-            income_value_dec0.append(np.percentile(vertical, 0))
-            income_value_dec10.append(np.percentile(vertical, 10))
-            income_value_dec25.append(np.percentile(vertical, 25))
-            income_value_dec50.append(np.percentile(vertical, 50))
-            income_value_dec75.append(np.percentile(vertical, 75))
-            income_value_dec90.append(np.percentile(vertical, 90))
-            income_value_dec100.append(np.percentile(vertical, 100))
-            vertical = []
-        income_value_fan_chart_data.append(income_value_dec0)
-        income_value_fan_chart_data.append(income_value_dec10)
-        income_value_fan_chart_data.append(income_value_dec25)
-        income_value_fan_chart_data.append(income_value_dec50)
-        income_value_fan_chart_data.append(income_value_dec75)
-        income_value_fan_chart_data.append(income_value_dec90)
-        income_value_fan_chart_data.append(income_value_dec100)
-
-        # sorts out data for median income by type through simulation chart
-        annuity_income_through_all_cycles_median = []
-        annuity_income2_through_all_cycles_median = []
-        annuity_income3_through_all_cycles_median = []
-        withdrawal_net_annuity_all_cycles_median = []
-        median_withdraw_by_type_all_cycles = []
-        vertical = []
-        for a in range(len(annuity_income2_through_all_cycles[0])):
-            for b in range(len(annuity_income2_through_all_cycles)):    
-                vertical.append(annuity_income2_through_all_cycles[b][a])
-            annuity_income2_through_all_cycles_median.append(np.median(vertical))
-            vertical = []
-        vertical = []
-        for a in range(len(annuity_income3_through_all_cycles[0])):
-            for b in range(len(annuity_income3_through_all_cycles)):    
-                vertical.append(annuity_income3_through_all_cycles[b][a])
-            annuity_income3_through_all_cycles_median.append(np.median(vertical))
-            vertical = []
-        vertical = []
-        for a in range(len(annuity_income_through_all_cycles[0])):
-            for b in range(len(annuity_income_through_all_cycles)):    
-                vertical.append(annuity_income_through_all_cycles[b][a])
-            annuity_income_through_all_cycles_median.append(np.median(vertical))
-            vertical = []            
-        vertical = []  
-        for a in range(len(withdrawal_net_annuity_through_all_cycles[0])):
-            for b in range(len(withdrawal_net_annuity_through_all_cycles)):    
-                vertical.append(withdrawal_net_annuity_through_all_cycles[b][a])
-            withdrawal_net_annuity_all_cycles_median.append(np.median(vertical))
-            vertical = []
-        
-        median_withdraw_by_type_all_cycles.append(annuity_income2_through_all_cycles_median)
-        median_withdraw_by_type_all_cycles.append(annuity_income3_through_all_cycles_median)         
-        median_withdraw_by_type_all_cycles.append(annuity_income_through_all_cycles_median)        
-        median_withdraw_by_type_all_cycles.append(withdrawal_net_annuity_all_cycles_median)
+                if annuity_option == "1": annuity_income = annuity_income / (1 + cpi_change[year])
+                elif annuity_option == "2": annuity_income = annuity_income * (1 + annuity_increase / 100) / (1 + cpi_change[year])
+                if annuity_option2 == "1": annuity_income2 = annuity_income2 / (1 + cpi_change[year])
+                elif annuity_option2 == "2": annuity_income2 = annuity_income2 * (1 + annuity_increase2 / 100) / (1 + cpi_change[year])
+                elif annuity_option2 != "3": annuity_income2 = annuity_income2 * (1 + annual_annuity2_inc)
+                if annuity_option3 == "1": annuity_income3 = annuity_income3 / (1 + cpi_change[year])
+                elif annuity_option3 == "2": annuity_income3 = annuity_income3 * (1 + annuity_increase3 / 100) / (1 + cpi_change[year])
+                elif annuity_option3 != "3": annuity_income3 = annuity_income3 * (1 + annual_annuity3_inc)
+
+        self.cycles = cycles
+        self.mix_count = mix_count
+        self.years_to_withdrawal = years_to_withdrawal
+        self.end_portfolio_values = running_portfolio_value
+        self.total_withdrawals = total_withdrawals
+        if streams:
+            self.portfolio_values = np.ascontiguousarray(portfolio_values.T)
+            self.withdrawals_all_periods = np.ascontiguousarray(withdrawals_all_periods.T)
+            self.withdrawals = self.withdrawals_all_periods[:, years_to_withdrawal:]
+            self.annuity_income = np.ascontiguousarray(annuity_income_record.T)
+            self.annuity_income2 = np.ascontiguousarray(annuity_income2_record.T)
+            self.annuity_income3 = np.ascontiguousarray(annuity_income3_record.T)
+            self.withdrawal_net_annuity = np.ascontiguousarray(withdrawal_net_annuity.T)
+        self.simulation_fail_tag = simulation_fail_tag
+        self.unadjusted_draw_tracker = unadjusted_draw_tracker
+        self.annuity_purchase_cost = [annuities.purchase_cost[0], annuities.purchase_cost[1]]
 
-        deciles = [np.percentile(end_single_cycle_portfolio_values, i) for i in range(0, 100, 10)]
-        deciles.append(max(end_single_cycle_portfolio_values))
+# Percentiles of each column (simulation year) of a (cycles x years) results array for a chosen list of percentiles.  All percentiles are found in one pass; returns a (percentiles x years) array.
+class ColumnPercentiles:
+    def __init__(self, data, percentiles):
+        self.result = np.percentile(data, percentiles, axis = 0)
+
+# Runs back-testing cycle simulation. Takes prepared parameters and prepared return data and returns data series of results.  Results are numpy arrays (cycles x years for the all-cycle streams) - converting them to lists is left to the views.
+class RunSimulation:
+    __slots__ = ['fan_chart_percentiles', 'simulation_fails', 'value_decile_data', 'all_value_streams', 'all_withdrawal_streams', 'sum_mort_adjusted_discounted_withdrawal', 'avg_mort_adjusted_withdrawal', 'avg_withdrawal', 'avg_end_value', 'unadjusted_draw_tracker', 'annuity_purchase_cost_tracker', 'median_withdraw_by_type_all_cycles', 'portfolio_value_fan_chart_data', 'income_value_fan_chart_data', 'withdrawal_histogram_data', 'withdrawal_histogram_edges']
+
+    def __init__(self, equity_real, bond_real, index_bond_real, asset_mix, start_sum, withdrawal_amount, years, annual_withdrawal_inc, draw_adjust, cpi, index_bond_forward, bond_forward, draw_tax, bonus_target, safest_swr_across_years, dynamic_option, target_withdrawal_percent, min_withdrawal_floor, flex_real_decrease, flex_real_increase, years_no_flex, spring_back, annuity_option_list, annuity_increase_list, annuity_price_list, annuity_tax_rate_list, cpi_change, annuity_percent_withdrawal_list, start_simulation_age, annuity_start_year_list, mortality_data_pull, ilb_spot_curve, data_direction, years_contributions, contribution, contribution_increase, years_between, yale_weighting, vanguard_decrease_floor, vanguard_increase_ceiling, vpw_data, net_other_income, fan_chart_percentiles = FAN_CHART_PERCENTILES):
+        # RunSimulationCycles runs all back-testing cycles at once and returns (cycles x years) arrays of results
+        simulation_cycles = RunSimulationCycles(equity_real, bond_real, index_bond_real, asset_mix, start_sum, withdrawal_amount, years, annual_withdrawal_inc, draw_adjust, cpi, index_bond_forward, bond_forward, draw_tax, bonus_target, safest_swr_across_years, dynamic_option, target_withdrawal_percent, min_withdrawal_floor, flex_real_decrease, flex_real_increase, years_no_flex, spring_back, annuity_option_list, annuity_increase_list, annuity_price_list, annuity_tax_rate_list, cpi_change, annuity_percent_withdrawal_list, start_simulation_age, annuity_start_year_list, data_direction, years_contributions, contribution, contribution_increase, years_between, yale_weighting, vanguard_decrease_floor, vanguard_increase_ceiling, vpw_data, net_other_income)
+        years_to_withdrawal = simulation_cycles.years_to_withdrawal
+        portfolio_values = simulation_cycles.portfolio_values
+        withdrawals = simulation_cycles.withdrawals
+        withdrawals_all_periods = simulation_cycles.withdrawals_all_periods
+        end_portfolio_values = portfolio_values[:, -1]
+        mortality_adjustments = SurvivorshipWeightings(years, start_simulation_age, mortality_data_pull).result
+
+        # Survivorship adjustment (e.g. withdrawal recorded x probability of survivorship to associated age) and temporal discount (using 'real' interest rate curve)
+        withdrawals_mort_adjusted = withdrawals * np.asarray(mortality_adjustments[years_to_withdrawal:years], dtype = float)
+        withdrawals_mort_adjusted_discounted = withdrawals_mort_adjusted / ((1 + np.asarray(ilb_spot_curve[years_to_withdrawal:years], dtype = float)) ** np.arange(years_to_withdrawal, years))
+
+        # percentile (fan) charts for portfolio values and income / withdrawal and median income by type through simulation - each is one pass over the (cycles x years) results
+        portfolio_value_fan_chart_data = ColumnPercentiles(portfolio_values, fan_chart_percentiles).result
+        income_value_fan_chart_data = ColumnPercentiles(withdrawals_all_periods, fan_chart_percentiles).result
+        median_withdraw_by_type_all_cycles = np.median(np.stack((simulation_cycles.annuity_income2, simulation_cycles.annuity_income3, simulation_cycles.annuity_income, simulation_cycles.withdrawal_net_annuity)), axis = 1)
+
+        deciles = np.append(np.percentile(end_portfolio_values, np.arange(0, 100, 10)), np.max(end_portfolio_values))
 
         #Calculate of withdrawal histogram output...
-        draw_hist_data = []
-        for a in range(len(all_withdrawals_through_all_cycles)):
-            for b in range(len(all_withdrawals_through_all_cycles[a])):
-                draw_hist_data.append(all_withdrawals_through_all_cycles[a][b])
-        if (np.max(draw_hist_data) - np.min(draw_hist_data)) > 100000: interval = 10000
-        elif np.max(np.max(draw_hist_data) - np.min(draw_hist_data)) > 50000: interval = 5000
-        elif np.max(np.max(draw_hist_data) - np.min(draw_hist_data)) > 20000: interval = 2000
+        draw_hist_data = withdrawals.ravel()
+        draw_max = np.max(draw_hist_data)
+        draw_min = np.min(draw_hist_data)
+        if (draw_max - draw_min) > 100000: interval = 10000
+        elif (draw_max - draw_min) > 50000: interval = 5000
+        elif (draw_max - draw_min) > 20000: interval = 2000
         else: interval = 1000
-        rounded_max = np.ceil(np.max(draw_hist_data)/ interval) * interval
-        rounded_min = np.floor(np.min(draw_hist_data)/ interval) * interval
+        rounded_max = np.ceil(draw_max / interval) * interval
+        rounded_min = np.floor(draw_min / interval) * interval
         hist, bin_edges = np.histogram(draw_hist_data, bins=range(int(rounded_min), (int(rounded_max) + interval + 1), interval))
-        draw_hist_data_count = hist.tolist()
-        draw_hist_data_edges = bin_edges.tolist()
-        draw_hist_data_percent = []
-        for a in range(len(draw_hist_data_count)):
-            draw_hist_data_percent.append(draw_hist_data_count[a] / len(draw_hist_data))
-        self.withdrawal_histogram_data = draw_hist_data_percent
-        self.withdrawal_histogram_edges = draw_hist_data_edges
-
-        total_draw_adjusted = []
-        for a in range(len(all_withdrawals_through_all_cycles_mort_adjusted_discounted)):
-            total_draw_adjusted.append(sum(all_withdrawals_through_all_cycles_mort_adjusted_discounted[a]))
-
-        self.simulation_fails = sum(simulation_fail_tag_through_all_cycles) / len(simulation_fail_tag_through_all_cycles)
+        self.withdrawal_histogram_data = hist / len(draw_hist_data)
+        self.withdrawal_histogram_edges = bin_edges
+
+        self.simulation_fails = float(np.mean(simulation_cycles.simulation_fail_tag))
         self.value_decile_data = deciles
-        self.all_value_streams = all_portfolio_values_through_all_cycles
-        self.all_withdrawal_streams = all_withdrawals_through_all_cycles_all_periods
-        self.sum_mort_adjusted_discounted_withdrawal = sum(total_draw_adjusted) / len(total_draw_adjusted)
-        self.avg_mort_adjusted_withdrawal = sum(through_single_cycle_avg_withdrawal_mort_adjusted) / len(through_single_cycle_avg_withdrawal_mort_adjusted)
-        self.avg_withdrawal = sum(through_single_cycle_avg_withdrawal) / len(through_single_cycle_avg_withdrawal)
-        self.avg_mort_adjusted_withdrawal = sum(through_single_cycle_avg_withdrawal_mort_adjusted) / len(through_single_cycle_avg_withdrawal_mort_adjusted)
-        self.avg_end_value = sum(end_single_cycle_portfolio_values) / len(end_single_cycle_portfolio_values)
-        self.unadjusted_draw_tracker = unadjusted_draw_tracker
-        self.data_tracker_parent = data_tracker_parent
-        self.annuity_purchase_cost_tracker = annuity_purchase_cost_tracker
+        self.all_value_streams = portfolio_values
+        self.all_withdrawal_streams = withdrawals_all_periods
+        self.sum_mort_adjusted_discounted_withdrawal = float(np.mean(withdrawals_mort_adjusted_discounted.sum(axis = 1)))
+        self.avg_mort_adjusted_withdrawal = float(np.mean(withdrawals_mort_adjusted.mean(axis = 1)))
+        self.avg_withdrawal = float(np.mean(withdrawals.mean(axis = 1)))
+        self.avg_end_value = float(np.mean(end_portfolio_values))
+        self.unadjusted_draw_tracker = simulation_cycles.unadjusted_draw_tracker
+        self.annuity_purchase_cost_tracker = np.broadcast_to(simulation_cycles.annuity_purchase_cost, (simulation_cycles.cycles, 2))
         self.median_withdraw_by_type_all_cycles = median_withdraw_by_type_all_cycles
+        self.fan_chart_percentiles = fan_chart_percentiles
         self.portfolio_value_fan_chart_data = portfolio_value_fan_chart_data
         self.income_value_fan_chart_data = income_value_fan_chart_data
 
-# Algorithm that calculates i) back-tested, zero fail safe withdrawal rate (SWR) for each seperate back-testing cycle and ii) back-tested, zero fail safe withdrawal rate (SWR) for each year through simulation (using all back-testing cycles).  Takes prepared parameters and prepared data and returns data curves.
+# Back-testing cycles over one stretch of years as searched by CalcMaxBacktestedSWRs for the maximum zero-fail withdrawal.  Each cycle starts the stretch on start_value and each year adds contributions (contribution_first / contribution_second), buys annuities, takes the withdrawal (trial withdrawal x draw_adjust x withdrawal_inc, net of annuity income and grossed up for draw tax) and applies the cycle's growth factor.  year_offset is the year of the simulation the stretch starts on.  growth_to_end (optional) gives the products of the growth factors from each year to the end of the stretch.  end_values() returns the values of the cycles at the end of the stretch for a trial withdrawal per cycle (negative where a cycle fails).
+class BacktestedSWRStretch:
+    def __init__(self, growth, start_value, withdrawal_unit, draw_adjust, withdrawal_inc, contribution_first, contribution_second, draw_tax, annual_withdrawal_inc, annuity_option_list, annuity_increase_list, annuity_price_list, annuity_tax_rate_list, annuity_percent_withdrawal_list, annuity_start_year_list, cpi, cpi_change, year_offset, tracker_pre_steps, growth_to_end = None):
+        self.growth = growth
+        self.growth_to_end = growth_to_end
+        self.start_value = start_value
+        self.withdrawal_unit = withdrawal_unit
+        self.draw_adjust = draw_adjust
+        self.withdrawal_inc = withdrawal_inc
+        self.contribution_first = contribution_first
+        self.contribution_second = contribution_second
+        self.draw_tax = draw_tax
+        self.annual_withdrawal_inc = annual_withdrawal_inc
+        self.annuity_option_list = annuity_option_list
+        self.annuity_increase_list = annuity_increase_list
+        self.annuity_price_list = annuity_price_list
+        self.annuity_tax_rate_list = annuity_tax_rate_list
+        self.annuity_percent_withdrawal_list = annuity_percent_withdrawal_list
+        self.annuity_start_year_list = annuity_start_year_list
+        self.cpi = np.asarray(cpi, dtype = float)
+        self.cpi_change = np.asarray(cpi_change, dtype = float)
+        self.year_offset = year_offset
+        self.tracker_pre_steps = tracker_pre_steps
+        # this sets the value increase for state pension through simulation years 
+        if annuity_option_list[1] == "4": self.annual_annuity2_inc = annuity_increase_list[1] / 100
+        else: self.annual_annuity2_inc = 0
+        if annuity_option_list[2] == "4": self.annual_annuity3_inc = annuity_increase_list[2] / 100
+        else: self.annual_annuity3_inc = 0
+        # year of the stretch each annuity is bought in (annuities with no income bought or bought outside the stretch have no effect)
+        self.purchase_year = [annuity_start_year_list[i] - 1 - year_offset for i in range(3)]
+        contribution_years = [b for b in range(len(draw_adjust)) if contribution_first[b] or contribution_second[b]]
+        if contribution_years: self.last_contribution_year = contribution_years[-1]
+        else: self.last_contribution_year = -1
+        self.annuities_bought = any(annuity_percent_withdrawal_list[i] != 0 and 0 <= self.purchase_year[i] < len(draw_adjust) for i in range(3))
+
+    # end value of one cycle for a trial withdrawal as end_values() but with plain floats (quicker than an array pass when only one cycle is being searched)
+    def end_value(self, cycle, withdrawal):
+        annuity_option, annuity_option2, annuity_option3 = self.annuity_option_list
+        annuity_increase, annuity_increase2, annuity_increase3 = self.annuity_increase_list
+        annuity_price, annuity_price2, annuity_price3 = self.annuity_price_list
+        annuity_tax_rate, annuity_tax_rate2, annuity_tax_rate3 = self.annuity_tax_rate_list
+        annuity_start_year, annuity_start_year2, annuity_start_year3 = self.annuity_start_year_list
+        purchase_year, purchase_year2, purchase_year3 = self.purchase_year
+        annual_withdrawal_inc = self.annual_withdrawal_inc
+        annual_annuity2_inc = self.annual_annuity2_inc
+        annual_annuity3_inc = self.annual_annuity3_inc
+        draw_tax = self.draw_tax
+        growth = self.growth[cycle].tolist()
+        draw_adjust = self.draw_adjust
+        withdrawal_inc = self.withdrawal_inc
+        contribution_first = self.contribution_first
+        contribution_second = self.contribution_second
+        cpi = self.cpi
+        cpi_change = self.cpi_change
+        first_cpi = cycle + self.year_offset
+        last_contribution_year = self.last_contribution_year
+
+        running_portfolio_value = float(self.start_value[cycle])
+        annuity_income = 0
+        annuity_income_tracker_pre_purchase = (withdrawal * self.annuity_percent_withdrawal_list[0] / 100) / (1 - annuity_tax_rate)
+        annuity_income2 = 0
+        annuity_income_tracker_pre_purchase2 = self.annuity_percent_withdrawal_list[1]
+        annuity_income3 = 0
+        annuity_income_tracker_pre_purchase3 = self.annuity_percent_withdrawal_list[2]
+        for b in range(self.tracker_pre_steps):
+            annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase * (1 + annual_withdrawal_inc)
+            annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2 * (1 + annual_annuity2_inc)
+
+        for b in range(len(growth)):
+            # a failed cycle stays failed once there are no more contributions to come
+            if running_portfolio_value < 0 and b > last_contribution_year: return running_portfolio_value
+            first_step = (b == 0 and self.year_offset == 0)
+            running_portfolio_value += contribution_first[b]
+            if b <= purchase_year2:
+                if not first_step: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2 * (1 + annual_annuity2_inc)
+                if b == purchase_year2:
+                    try: annuity_purchase_cost2 = (annuity_income_tracker_pre_purchase2 / (annuity_price2 / 100))
+                    except: annuity_purchase_cost2 = 0
+                    running_portfolio_value = running_portfolio_value - annuity_purchase_cost2
+                    annuity_income2 = annuity_income_tracker_pre_purchase2
+
+            running_portfolio_value += contribution_second[b]
+            if b <= purchase_year3:
+                if not first_step: annuity_income_tracker_pre_purchase3 = annuity_income_tracker_pre_purchase3 * (1 + annual_annuity3_inc)
+                if b == purchase_year3:
+                    try: annuity_purchase_cost3 = (annuity_income_tracker_pre_purchase3 / (annuity_price3 / 100))
+                    except: annuity_purchase_cost3 = 0
+                    running_portfolio_value = running_portfolio_value - annuity_purchase_cost3
+                    annuity_income3 = annuity_income_tracker_pre_purchase3
+
+            if b <= purchase_year:
+                if not first_step: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase * (1 + annual_withdrawal_inc)
+                if b == purchase_year:
+                    if annuity_start_year2 and annuity_start_year3 <= annuity_start_year: 
+                        annuity_income_tracker_pre_purchase = max((annuity_income_tracker_pre_purchase - annuity_income_tracker_pre_purchase2 * (1 - annuity_tax_rate2) - annuity_income_tracker_pre_purchase3 * (1 - annuity_tax_rate3)), 0) 
+                    elif annuity_start_year2 <= annuity_start_year: 
+                        annuity_income_tracker_pre_purchase = max((annuity_income_tracker_pre_purchase - annuity_income_tracker_pre_purchase2 * (1 - annuity_tax_rate2)), 0) 
+                    elif annuity_start_year3 <= annuity_start_year: 
+                        annuity_income_tracker_pre_purchase = max((annuity_income_tracker_pre_purchase - annuity_income_tracker_pre_purchase3 * (1 - annuity_tax_rate3)), 0) 
+                    try: annuity_purchase_cost = (annuity_income_tracker_pre_purchase / (annuity_price / 100))
+                    except: annuity_purchase_cost = 0
+                    running_portfolio_value = running_portfolio_value - annuity_purchase_cost
+                    annuity_income = annuity_income_tracker_pre_purchase
+
+            if(running_portfolio_value >= 0): running_portfolio_value = running_portfolio_value - (withdrawal * draw_adjust[b] * withdrawal_inc[b] - annuity_income * (1 - annuity_tax_rate) - annuity_income2 * (1 - annuity_tax_rate2) - annuity_income3 * (1 - annuity_tax_rate3)) / (1 - draw_tax)
+            if(running_portfolio_value > 0): running_portfolio_value = running_portfolio_value * growth[b]
+
+            cpi_delta = cpi[first_cpi + b]
+            cpi_change_delta = cpi_change[first_cpi + b]
+            if annuity_option == "1": annuity_income = annuity_income / (1 + cpi_delta)
+            elif annuity_option == "2": annuity_income = annuity_income * (1 + annuity_increase / 100) / (1 + cpi_delta)
+
+            if annuity_option2 == "1": annuity_income2 = annuity_income2 / (1 + cpi_change_delta)
+            elif annuity_option2 == "2": annuity_income2 = annuity_income2 * (1 + annuity_increase2 / 100) / (1 + cpi_change_delta)
+            elif annuity_option2 == "3": annuity_income2 = annuity_income2
+            else: annuity_income2 = annuity_income2 * (1 + annual_annuity2_inc)
+
+            if annuity_option3 == "1": annuity_income3 = annuity_income3 / (1 + cpi_change_delta)
+            elif annuity_option3 == "2": annuity_income3 = annuity_income3 * (1 + annuity_increase3 / 100) / (1 + cpi_change_delta)
+            elif annuity_option3 == "3": annuity_income3 = annuity_income3
+            else: annuity_income3 = annuity_income3 * (1 + annual_annuity3_inc)
+        return running_portfolio_value
+
+    # end value of the given cycles (all cycles if None) for a trial withdrawal per cycle, negative where the cycle fails.  The cycles are run together a year at a time as arrays.
+    def end_values(self, withdrawal, cycles = None):
+        annuity_option, annuity_option2, annuity_option3 = self.annuity_option_list
+        annuity_increase, annuity_increase2, annuity_increase3 = self.annuity_increase_list
+        annuity_price, annuity_price2, annuity_price3 = self.annuity_price_list
+        annuity_tax_rate, annuity_tax_rate2, annuity_tax_rate3 = self.annuity_tax_rate_list
+        annuity_start_year, annuity_start_year2, annuity_start_year3 = self.annuity_start_year_list
+        purchase_year, purchase_year2, purchase_year3 = self.purchase_year
+        annual_withdrawal_inc = self.annual_withdrawal_inc
+        annual_annuity2_inc = self.annual_annuity2_inc
+        annual_annuity3_inc = self.annual_annuity3_inc
+        draw_tax = self.draw_tax
+        if cycles is None: cycles = np.arange(self.growth.shape[0])
+        growth = self.growth[cycles]
+        first_cpi = cycles + self.year_offset
+
+        running_portfolio_value = np.asarray(self.start_value, dtype = float)[cycles]
+        withdrawal = np.asarray(withdrawal, dtype = float)
+        annuity_income = 0
+        annuity_income_tracker_pre_purchase = (withdrawal * self.annuity_percent_withdrawal_list[0] / 100) / (1 - annuity_tax_rate)
+        annuity_income2 = 0
+        annuity_income_tracker_pre_purchase2 = self.annuity_percent_withdrawal_list[1]
+        annuity_income3 = 0
+        annuity_income_tracker_pre_purchase3 = self.annuity_percent_withdrawal_list[2]
+        for b in range(self.tracker_pre_steps):
+            annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase * (1 + annual_withdrawal_inc)
+            annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2 * (1 + annual_annuity2_inc)
+
+        for b in range(growth.shape[1]):
+            # failed cycles stay failed once there are no more contributions to come
+            if b > self.last_contribution_year and np.all(running_portfolio_value < 0): break
+            first_step = (b == 0 and self.year_offset == 0)
+            running_portfolio_value = running_portfolio_value + self.contribution_first[b]
+            if b <= purchase_year2:
+                if not first_step: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2 * (1 + annual_annuity2_inc)
+                if b == purchase_year2:
+                    try: annuity_purchase_cost2 = (annuity_income_tracker_pre_purchase2 / (annuity_price2 / 100))
+                    except: annuity_purchase_cost2 = 0
+                    running_portfolio_value = running_portfolio_value - annuity_purchase_cost2
+                    annuity_income2 = annuity_income_tracker_pre_purchase2
+
+            running_portfolio_value = running_portfolio_value + self.contribution_second[b]
+            if b <= purchase_year3:
+                if not first_step: annuity_income_tracker_pre_purchase3 = annuity_income_tracker_pre_purchase3 * (1 + annual_annuity3_inc)
+                if b == purchase_year3:
+                    try: annuity_purchase_cost3 = (annuity_income_tracker_pre_purchase3 / (annuity_price3 / 100))
+                    except: annuity_purchase_cost3 = 0
+                    running_portfolio_value = running_portfolio_value - annuity_purchase_cost3
+                    annuity_income3 = annuity_income_tracker_pre_purchase3
+
+            if b <= purchase_year:
+                if not first_step: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase * (1 + annual_withdrawal_inc)
+                if b == purchase_year:
+                    if annuity_start_year2 and annuity_start_year3 <= annuity_start_year: 
+                        annuity_income_tracker_pre_purchase = np.maximum((annuity_income_tracker_pre_purchase - annuity_income_tracker_pre_purchase2 * (1 - annuity_tax_rate2) - annuity_income_tracker_pre_purchase3 * (1 - annuity_tax_rate3)), 0) 
+                    elif annuity_start_year2 <= annuity_start_year: 
+                        annuity_income_tracker_pre_purchase = np.maximum((annuity_income_tracker_pre_purchase - annuity_income_tracker_pre_purchase2 * (1 - annuity_tax_rate2)), 0) 
+                    elif annuity_start_year3 <= annuity_start_year: 
+                        annuity_income_tracker_pre_purchase = np.maximum((annuity_income_tracker_pre_purchase - annuity_income_tracker_pre_purchase3 * (1 - annuity_tax_rate3)), 0) 
+                    # (a zero price is taken as no purchase cost)
+                    if (annuity_price / 100) != 0: annuity_purchase_cost = (annuity_income_tracker_pre_purchase / (annuity_price / 100))
+                    else: annuity_purchase_cost = 0
+                    running_portfolio_value = running_portfolio_value - annuity_purchase_cost
+                    annuity_income = annuity_income_tracker_pre_purchase
+
+            running_portfolio_value = np.where(running_portfolio_value >= 0, running_portfolio_value - (withdrawal * self.draw_adjust[b] * self.withdrawal_inc[b] - annuity_income * (1 - annuity_tax_rate) - annuity_income2 * (1 - annuity_tax_rate2) - annuity_income3 * (1 - annuity_tax_rate3)) / (1 - draw_tax), running_portfolio_value)
+            running_portfolio_value = np.where(running_portfolio_value > 0, running_portfolio_value * growth[:, b], running_portfolio_value)
+
+            cpi_delta = self.cpi[first_cpi + b]
+            cpi_change_delta = self.cpi_change[first_cpi + b]
+            if annuity_option == "1": annuity_income = annuity_income / (1 + cpi_delta)
+            elif annuity_option == "2": annuity_income = annuity_income * (1 + annuity_increase / 100) / (1 + cpi_delta)
+
+            if annuity_option2 == "1": annuity_income2 = annuity_income2 / (1 + cpi_change_delta)
+            elif annuity_option2 == "2": annuity_income2 = annuity_income2 * (1 + annuity_increase2 / 100) / (1 + cpi_change_delta)
+            elif annuity_option2 == "3": annuity_income2 = annuity_income2
+            else: annuity_income2 = annuity_income2 * (1 + annual_annuity2_inc)
+
+            if annuity_option3 == "1": annuity_income3 = annuity_income3 / (1 + cpi_change_delta)
+            elif annuity_option3 == "2": annuity_income3 = annuity_income3 * (1 + annuity_increase3 / 100) / (1 + cpi_change_delta)
+            elif annuity_option3 == "3": annuity_income3 = annuity_income3
+            else: annuity_income3 = annuity_income3 * (1 + annual_annuity3_inc)
+        return running_portfolio_value
+
+# Finds the maximum zero-fail withdrawal rate (percentage of withdrawal_unit, to the nearest 'tolerance' below) for each cycle of a BacktestedSWRStretch.  Without annuity purchases, with contributions all made before withdrawals start and with positive growth and non-negative withdrawals, the end value of a cycle is linear in the withdrawal (start value x growth less withdrawal x sum of the withdrawal factors grown to the end of the stretch) so the maximum is solved directly from suffix products of the growth factors.  Other cycles fall back to bisection, keeping a bracket of grid points per cycle and evaluating all of them in one end_values() pass per step (about 14 passes at a 0.01 tolerance whatever the number of cycles).  Rates from 99% up are returned as 100 - tolerance.  With minimum_only only the lowest rate across the cycles (min_swr) is found, by branch and bound with cycles tried in cycle_order (e.g. worst start years first), and swr is None.
+class SolveMaxSWRs:
+    def __init__(self, stretch, tolerance = MAX_SWR_TOLERANCE, minimum_only = False, cycle_order = None):
+        cycles, stretch_years = stretch.growth.shape
+        top_step = int(round(100 / tolerance)) - 1
+        cap_step = int(round(99 / tolerance))
+        self.stretch = stretch
+        self.tolerance = tolerance
+        self.cap_step = cap_step
+        # end values within rounding error of zero are not counted as fails
+        self.fail_value = -1e-9 * abs(stretch.withdrawal_unit)
+        draw_factor = np.array(stretch.draw_adjust, dtype = float) * np.array(stretch.withdrawal_inc, dtype = float) / (1 - stretch.draw_tax)
+        contribution_first = np.array(stretch.contribution_first, dtype = float)
+        contribution_second = np.array(stretch.contribution_second, dtype = float)
+        drawing_years = np.flatnonzero(draw_factor)
+        if len(drawing_years) > 0: first_draw_year = drawing_years[0]
+        else: first_draw_year = stretch_years
+        contribution_years = np.flatnonzero(contribution_first + contribution_second)
+        linear = not stretch.annuities_bought and np.all(draw_factor >= 0) and (len(contribution_years) == 0 or contribution_years[-1] <= first_draw_year)
+
+        swr_step = np.zeros(cycles, dtype = int)
+        solved = np.zeros(cycles, dtype = bool)
+        if linear:
+            # portfolio values up to the first withdrawal do not depend on the withdrawal
+            running_portfolio_value = np.array(stretch.start_value, dtype = float) * np.ones(cycles)
+            for b in range(min(first_draw_year + 1, stretch_years)):
+                running_portfolio_value = running_portfolio_value + contribution_first[b]
+                running_portfolio_value = running_portfolio_value + contribution_second[b]
+                if b < first_draw_year: running_portfolio_value = np.where(running_portfolio_value > 0, running_portfolio_value * stretch.growth[:, b], running_portfolio_value)
+            growth = stretch.growth[:, first_draw_year:]
+            if stretch.growth_to_end is not None: growth_to_end = stretch.growth_to_end[:, first_draw_year:]
+            else: growth_to_end = np.cumprod(growth[:, ::-1], axis = 1)[:, ::-1]
+            solved = np.all(growth > 0, axis = 1)
+            with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                if growth.shape[1] > 0: 
+                    end_value = running_portfolio_value * growth_to_end[:, 0]
+                    end_draw = stretch.withdrawal_unit * (growth_to_end @ draw_factor[first_draw_year:])
+                else:
+                    end_value = running_portfolio_value
+                    end_draw = np.zeros(cycles)
+                max_swr = np.where(end_draw > 0, end_value / end_draw, np.where(end_value >= 0, np.inf, -np.inf))
+                swr_step = np.where(max_swr >= 99, top_step, np.floor(np.clip(max_swr, 0, 99) / tolerance)).astype(int)
+                near_grid = solved & (np.abs(max_swr / tolerance - np.round(max_swr / tolerance)) < 1e-6)
+            # where the maximum falls on a grid point rounding in the solution can put it a grid point out so the grid points either side are checked year by year (only for cycles that can set the minimum with minimum_only)
+            if minimum_only and np.any(solved): near_grid = near_grid & (swr_step <= swr_step[solved].min() + 1)
+            near_grid = np.flatnonzero(near_grid)
+            if len(near_grid) > 0:
+                near_step = swr_step[near_grid]
+                next_step = np.minimum(near_step + 1, cap_step)
+                next_step_safe = (near_step < cap_step) & self.steps_safe(next_step, near_grid)
+                near_step = np.where(next_step_safe, np.where(next_step == cap_step, top_step, next_step), near_step)
+                step_failed = (near_step > 0) & (near_step < cap_step) & ~self.steps_safe(near_step, near_grid)
+                swr_step[near_grid] = np.where(step_failed, near_step - 1, near_step)
+
+        if not minimum_only:
+            unsolved = np.flatnonzero(~solved)
+            if len(unsolved) > 0:
+                cap_step_safe = self.steps_safe(np.full(len(unsolved), cap_step), unsolved)
+                swr_step[unsolved[cap_step_safe]] = top_step
+                swr_step[unsolved[~cap_step_safe]] = self.bisect_steps(unsolved[~cap_step_safe], cap_step)
+            self.swr = swr_step * tolerance
+            self.min_swr = min(self.swr.tolist())
+        else:
+            # branch and bound: only cycles that fail at the lowest maximum found so far can lower it, so the remaining cycles are tested at that threshold in one pass and only the first of those that fail (in cycle_order) is searched (one cycle at a time with end_value()) before the rest are tested again at the new (lower) threshold
+            if cycle_order is None: cycle_order = np.arange(cycles)
+            candidates = np.array([a for a in cycle_order if not solved[a]], dtype = int)
+            if np.any(solved): threshold = swr_step[solved].min()
+            else: threshold = top_step
+            while len(candidates) > 0:
+                test_step = min(threshold, cap_step)
+                candidates = candidates[~self.steps_safe(np.full(len(candidates), test_step), candidates)]
+                if len(candidates) == 0: break
+                threshold = self.bisect_cycle(candidates[0], test_step)
+                candidates = candidates[1:]
+            self.swr = None
+            self.min_swr = float(threshold * tolerance)
+
+    # whether each of the given cycles is safe (does not fail) at its grid step (from cap_step up the withdrawal is tested at 99%)
+    def steps_safe(self, steps, cycles):
+        withdrawal = np.where(steps >= self.cap_step, self.stretch.withdrawal_unit * 99, self.stretch.withdrawal_unit * steps * self.tolerance)
+        return self.stretch.end_values(withdrawal, cycles) >= self.fail_value
+
+    # bisection on the grid for one cycle known to fail at high_step using end_value()
+    def bisect_cycle(self, cycle, high_step):
+        low_step = 0
+        while high_step - low_step > 1:
+            mid_step = (low_step + high_step) // 2
+            if self.stretch.end_value(cycle, self.stretch.withdrawal_unit * mid_step * self.tolerance) >= self.fail_value: low_step = mid_step
+            else: high_step = mid_step
+        return low_step
+
+    # bisection on the grid for the given cycles at once, each known to fail at high_step (one pass of end_values() per halving of the brackets).  Returns the highest safe step of each cycle (0 if none).
+    def bisect_steps(self, cycles, high_step):
+        low_step = np.zeros(len(cycles), dtype = int)
+        high_step = np.full(len(cycles), high_step)
+        while np.any(high_step - low_step > 1):
+            mid_step = (low_step + high_step) // 2
+            mid_step_safe = self.steps_safe(mid_step, cycles)
+            low_step = np.where(mid_step_safe, mid_step, low_step)
+            high_step = np.where(mid_step_safe, high_step, mid_step)
+        return low_step
+
+# Algorithm that calculates i) back-tested, zero fail safe withdrawal rate (SWR) for each seperate back-testing cycle and ii) back-tested, zero fail safe withdrawal rate (SWR) for each year through simulation (using all back-testing cycles).  Takes prepared parameters and prepared data and returns data curves.  Maximum withdrawal rates are found to the nearest swr_tolerance (percentage points) by SolveMaxSWRs.
 class CalcMaxBacktestedSWRs:
-    def __init__(self, equity_real, bond_real, index_bond_real, asset_mix, start_sum, years, annual_withdrawal_inc, draw_adjust, cpi, index_bond_forward, bond_forward, draw_tax, annuity_option_list, annuity_increase_list, annuity_price_list, annuity_tax_rate_list, cpi_change, annuity_percent_withdrawal_list, annuity_start_year_list, data_direction, years_contributions, contribution, contribution_increase, years_between):
-        
-        annuity_option = annuity_option_list[0]
-        annuity_increase = annuity_increase_list[0]
-        annuity_price = annuity_price_list[0]
-        annuity_tax_rate = annuity_tax_rate_list[0]
-        annuity_percent_withdrawal = annuity_percent_withdrawal_list[0]
-        annuity_start_year = annuity_start_year_list[0]
-
-        annuity_option2 = annuity_option_list[1]
-        annuity_increase2 = annuity_increase_list[1]
-        annuity_price2 = annuity_price_list[1]
-        annuity_tax_rate2 = annuity_tax_rate_list[1]
-        annuity_percent_withdrawal2 = annuity_percent_withdrawal_list[1]
-        annuity_start_year2 = annuity_start_year_list[1]
-
-        annuity_option3 = annuity_option_list[2]
-        annuity_increase3 = annuity_increase_list[2]
-        annuity_price3 = annuity_price_list[2]
-        annuity_tax_rate3 = annuity_tax_rate_list[2]
-        annuity_percent_withdrawal3 = annuity_percent_withdrawal_list[2]
-        annuity_start_year3 = annuity_start_year_list[2]
+    def __init__(self, equity_real, bond_real, index_bond_real, asset_mix, start_sum, years, annual_withdrawal_inc, draw_adjust, cpi, index_bond_forward, bond_forward, draw_tax, annuity_option_list, annuity_increase_list, annuity_price_list, annuity_tax_rate_list, cpi_change, annuity_percent_withdrawal_list, annuity_start_year_list, data_direction, years_contributions, contribution, contribution_increase, years_between, swr_tolerance = MAX_SWR_TOLERANCE):
         
-
-        # this sets the value increase for state pension through simulation years 
-        if annuity_option2 == "4": annual_annuity2_inc = annuity_increase2 / 100
-        else: annual_annuity2_inc = 0
-        if annuity_option3 == "4": annual_annuity3_inc = annuity_increase3 / 100
-        else: annual_annuity3_inc = 0
-
         # this is to stop unwanted annuity effect happening in backward looking calc end values
         # if data_direction == 'back': 
         #     annuity_percent_withdrawal = 0
 
-        safe_withdrawal = []
+        cycles = len(equity_real) - years
         years_to_withdrawal = years_contributions + years_between
+        growth_factor_index = GetGrowthFactorIndex(equity_real, bond_real, index_bond_real, asset_mix, cpi, index_bond_forward, bond_forward, data_direction, max(cycles, 0), years).growth_factor_index
+        growth = growth_factor_index.growth
+        growth_to_end = growth_factor_index.growth_to_end
+        annuity_parameters = (annuity_option_list, annuity_increase_list, annuity_price_list, annuity_tax_rate_list, annuity_percent_withdrawal_list, annuity_start_year_list)
+
+        # running portfolio value of each cycle at the start of each year before any withdrawal (contributions and growth do not depend on the withdrawal)
+        start_running_portfolio_values = np.concatenate((np.full((max(cycles, 0), 1), float(start_sum)), growth_factor_index.accumulation_path(start_sum, ContributionStream(contribution, contribution_increase, years_contributions).contributions, years - 1)), axis = 1)
+        running_portfolio_value = start_running_portfolio_values[:, years_to_withdrawal]
+
+        withdrawal_unit = start_sum / 100
+        stretch_years = years - years_to_withdrawal
+        stretch = BacktestedSWRStretch(growth[:, years_to_withdrawal:], running_portfolio_value, withdrawal_unit, draw_adjust[years_to_withdrawal:years], [(1 + annual_withdrawal_inc) ** (b + years_to_withdrawal) for b in range(stretch_years)], [0] * stretch_years, [0] * stretch_years, draw_tax, annual_withdrawal_inc, *annuity_parameters, cpi, cpi_change, years_to_withdrawal, max(years_to_withdrawal - 1, 0), growth_to_end[:, years_to_withdrawal:])
+        safe_withdrawal = (SolveMaxSWRs(stretch, swr_tolerance).swr * withdrawal_unit).tolist()
+        # cycles with the lowest SWRs over the whole simulation are tried first when finding the safest SWR for each year sub-set
+        cycle_order = np.argsort(safe_withdrawal, kind = 'stable')
 
-        for a in range(len(equity_real) - years):
-            withdrawal_unit = start_sum / 100
-            withdrawal_counter = 1.0
-            while withdrawal_counter < 100:
-                withdrawal = withdrawal_unit * withdrawal_counter
-                running_portfolio_value = start_sum
-                running_contribution = contribution
-
-                annuity_income = 0
-                annuity_income_tracker_pre_purchase = (withdrawal * annuity_percent_withdrawal / 100) / (1 - annuity_tax_rate)                
-                annuity_income2 = 0                    
-                annuity_income_tracker_pre_purchase2 = (annuity_percent_withdrawal2)
-                annuity_income3 = 0                    
-                annuity_income_tracker_pre_purchase3 = (annuity_percent_withdrawal3)
-
-                for b in range(years_to_withdrawal):
-                    if b < years_contributions:
-                        running_portfolio_value += running_contribution
-                        running_contribution = running_contribution * (1 + contribution_increase / 100)
-                    if data_direction == "back":
-                        if(running_portfolio_value > 0): running_portfolio_value = running_portfolio_value * (1 + equity_real[b + a] * asset_mix[0] + bond_real[b + a] * asset_mix[3] + index_bond_real[b + a] * asset_mix[4])
-                    else:
-                        if(running_portfolio_value > 0): running_portfolio_value = running_portfolio_value * (1 + equity_real[b + a] * asset_mix[0] + (bond_forward[b] - cpi[b + a]) * asset_mix[3] + index_bond_forward[b] * asset_mix[4])
-                    if b == 0: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase
-                    else: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase * (1 + annual_withdrawal_inc)   
-                    if b == 0: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2
-                    else: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2 * (1 + annual_annuity2_inc) 
-
-                for b in range(years - years_to_withdrawal):      
-                    if b < (annuity_start_year2 - 1 - years_to_withdrawal):
-                        if b == 0 and years_to_withdrawal == 0: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2
-                        else: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2 * (1 + annual_annuity2_inc)         
-                    elif b == (annuity_start_year2 - 1 - years_to_withdrawal):
-                        if b == 0 and years_to_withdrawal == 0: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2
-                        else: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2 * (1 + annual_annuity2_inc)                        
-                        try: annuity_purchase_cost2 = (annuity_income_tracker_pre_purchase2 / (annuity_price2 / 100))
-                        except: annuity_purchase_cost2 = 0
-                        running_portfolio_value = running_portfolio_value - annuity_purchase_cost2
-                        annuity_income2 = annuity_income_tracker_pre_purchase2
-
-                    if b < (annuity_start_year3 - 1 - years_to_withdrawal):
-                        if b == 0 and years_to_withdrawal == 0: annuity_income_tracker_pre_purchase3 = annuity_income_tracker_pre_purchase3
-                        else: annuity_income_tracker_pre_purchase3 = annuity_income_tracker_pre_purchase3 * (1 + annual_annuity3_inc)         
-                    elif b == (annuity_start_year3 - 1 - years_to_withdrawal):
-                        if b == 0 and years_to_withdrawal == 0: annuity_income_tracker_pre_purchase3 = annuity_income_tracker_pre_purchase3
-                        else: annuity_income_tracker_pre_purchase3 = annuity_income_tracker_pre_purchase3 * (1 + annual_annuity3_inc)                        
-                        try: annuity_purchase_cost3 = (annuity_income_tracker_pre_purchase3 / (annuity_price3 / 100))
-                        except: annuity_purchase_cost3 = 0
-                        running_portfolio_value = running_portfolio_value - annuity_purchase_cost3
-                        annuity_income3 = annuity_income_tracker_pre_purchase3
-
-                    if b < (annuity_start_year - 1 - years_to_withdrawal):
-                        if b == 0 and years_to_withdrawal == 0: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase
-                        else: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase * (1 + annual_withdrawal_inc)
-                    elif b == (annuity_start_year - 1 - years_to_withdrawal):
-                        if b == 0 and years_to_withdrawal == 0: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase
-                        else: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase * (1 + annual_withdrawal_inc)
-                        if annuity_start_year2 and annuity_start_year3 <= annuity_start_year: 
-                            annuity_income_tracker_pre_purchase = max((annuity_income_tracker_pre_purchase - annuity_income_tracker_pre_purchase2 * (1 - annuity_tax_rate2) - annuity_income_tracker_pre_purchase3 * (1 - annuity_tax_rate3)), 0) 
-                        elif annuity_start_year2 <= annuity_start_year: 
-                            annuity_income_tracker_pre_purchase = max((annuity_income_tracker_pre_purchase - annuity_income_tracker_pre_purchase2 * (1 - annuity_tax_rate2)), 0) 
-                        elif annuity_start_year3 <= annuity_start_year: 
-                            annuity_income_tracker_pre_purchase = max((annuity_income_tracker_pre_purchase - annuity_income_tracker_pre_purchase3 * (1 - annuity_tax_rate3)), 0) 
-                        else: 
-                            annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase
-                        
-                        try: annuity_purchase_cost = (annuity_income_tracker_pre_purchase / (annuity_price / 100))
-                        except: annuity_purchase_cost = 0
-                        running_portfolio_value = running_portfolio_value - annuity_purchase_cost
-                        annuity_income = annuity_income_tracker_pre_purchase
-
-                    if(running_portfolio_value >= 0): running_portfolio_value = running_portfolio_value - (withdrawal * draw_adjust[b + years_to_withdrawal] * ((1 + annual_withdrawal_inc) ** (b + years_to_withdrawal)) - annuity_income * (1 - annuity_tax_rate) - annuity_income2 * (1 - annuity_tax_rate2) - annuity_income3 * (1 - annuity_tax_rate3)) / (1 - draw_tax)
-                    if data_direction == 'back':
-                        if(running_portfolio_value > 0): running_portfolio_value = running_portfolio_value * (1 + equity_real[b + a + years_to_withdrawal] * asset_mix[0] + bond_real[b + a + years_to_withdrawal] * asset_mix[3] + index_bond_real[b + a + years_to_withdrawal] * asset_mix[4])
-                    else:
-                        if(running_portfolio_value > 0): running_portfolio_value = running_portfolio_value * (1 + equity_real[b + a + years_to_withdrawal] * asset_mix[0] + (bond_forward[b + years_to_withdrawal] - cpi[b + a + years_to_withdrawal]) * asset_mix[3] + index_bond_forward[b + years_to_withdrawal] * asset_mix[4])        
-
-                    if annuity_option == "1": annuity_income = annuity_income / (1 + cpi[b + a + years_to_withdrawal])
-                    elif annuity_option == "2": annuity_income = annuity_income * (1 + annuity_increase / 100) / (1 + cpi[b + a + years_to_withdrawal])
-                    else: annuity_income = annuity_income
-
-                    if annuity_option2 == "1": annuity_income2 = annuity_income2 / (1 + cpi_change [b + a + years_to_withdrawal])
-                    elif annuity_option2 == "2": annuity_income2 = annuity_income2 * (1 + annuity_increase2 / 100) / (1 + cpi_change [b + a + years_to_withdrawal])
-                    elif annuity_option2 == "3": annuity_income2 = annuity_income2
-                    else: annuity_income2 = annuity_income2 * (1 + annual_annuity2_inc)
-
-                    if annuity_option3 == "1": annuity_income3 = annuity_income3 / (1 + cpi_change [b + a + years_to_withdrawal])
-                    elif annuity_option3 == "2": annuity_income3 = annuity_income3 * (1 + annuity_increase3 / 100) / (1 + cpi_change [b + a + years_to_withdrawal])
-                    elif annuity_option3 == "3": annuity_income3 = annuity_income3
-                    else: annuity_income3 = annuity_income3 * (1 + annual_annuity3_inc)
-
-                if (running_portfolio_value < 0): 
-                    withdrawal_counter -= 0.9
-                    break
-                withdrawal_counter += 1
-
-            while withdrawal_counter < 100:
-                withdrawal = withdrawal_unit * withdrawal_counter
-                running_portfolio_value = start_sum
-                running_contribution = contribution
-
-                annuity_income = 0
-                annuity_income_tracker_pre_purchase = (withdrawal * annuity_percent_withdrawal / 100) / (1 - annuity_tax_rate)                
-                annuity_income2 = 0                    
-                annuity_income_tracker_pre_purchase2 = (annuity_percent_withdrawal2)
-                annuity_income3 = 0                    
-                annuity_income_tracker_pre_purchase3 = (annuity_percent_withdrawal3)
-
-                for b in range(years_to_withdrawal):
-                    if b < years_contributions:
-                        running_portfolio_value += running_contribution
-                        running_contribution = running_contribution * (1 + contribution_increase / 100)
-                    if data_direction == "back":
-                        if(running_portfolio_value > 0): running_portfolio_value = running_portfolio_value * (1 + equity_real[b + a] * asset_mix[0] + bond_real[b + a] * asset_mix[3] + index_bond_real[b + a] * asset_mix[4])
-                    else:
-                        if(running_portfolio_value > 0): running_portfolio_value = running_portfolio_value * (1 + equity_real[b + a] * asset_mix[0] + (bond_forward[b] - cpi[b + a]) * asset_mix[3] + index_bond_forward[b] * asset_mix[4])
-                    if b == 0: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase
-                    else: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase * (1 + annual_withdrawal_inc)   
-                    if b == 0: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2
-                    else: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2 * (1 + annual_annuity2_inc) 
-
-                for b in range(years - years_to_withdrawal):      
-                    if b < (annuity_start_year2 - 1 - years_to_withdrawal):
-                        if b == 0 and years_to_withdrawal == 0: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2
-                        else: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2 * (1 + annual_annuity2_inc)         
-                    elif b == (annuity_start_year2 - 1 - years_to_withdrawal):
-                        if b == 0 and years_to_withdrawal == 0: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2
-                        else: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2 * (1 + annual_annuity2_inc)                        
-                        try: annuity_purchase_cost2 = (annuity_income_tracker_pre_purchase2 / (annuity_price2 / 100))
-                        except: annuity_purchase_cost2 = 0
-                        running_portfolio_value = running_portfolio_value - annuity_purchase_cost2
-                        annuity_income2 = annuity_income_tracker_pre_purchase2
-
-                    if b < (annuity_start_year3 - 1 - years_to_withdrawal):
-                        if b == 0 and years_to_withdrawal == 0: annuity_income_tracker_pre_purchase3 = annuity_income_tracker_pre_purchase3
-                        else: annuity_income_tracker_pre_purchase3 = annuity_income_tracker_pre_purchase3 * (1 + annual_annuity3_inc)         
-                    elif b == (annuity_start_year3 - 1 - years_to_withdrawal):
-                        if b == 0 and years_to_withdrawal == 0: annuity_income_tracker_pre_purchase3 = annuity_income_tracker_pre_purchase3
-                        else: annuity_income_tracker_pre_purchase3 = annuity_income_tracker_pre_purchase3 * (1 + annual_annuity3_inc)                        
-                        try: annuity_purchase_cost3 = (annuity_income_tracker_pre_purchase3 / (annuity_price3 / 100))
-                        except: annuity_purchase_cost3 = 0
-                        running_portfolio_value = running_portfolio_value - annuity_purchase_cost3
-                        annuity_income3 = annuity_income_tracker_pre_purchase3
-
-                    if b < (annuity_start_year - 1 - years_to_withdrawal):
-                        if b == 0 and years_to_withdrawal == 0: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase
-                        else: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase * (1 + annual_withdrawal_inc)
-                    elif b == (annuity_start_year - 1 - years_to_withdrawal):
-                        if b == 0 and years_to_withdrawal == 0: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase
-                        else: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase * (1 + annual_withdrawal_inc)
-                        if annuity_start_year2 and annuity_start_year3 <= annuity_start_year: 
-                            annuity_income_tracker_pre_purchase = max((annuity_income_tracker_pre_purchase - annuity_income_tracker_pre_purchase2 * (1 - annuity_tax_rate2) - annuity_income_tracker_pre_purchase3 * (1 - annuity_tax_rate3)), 0) 
-                        elif annuity_start_year2 <= annuity_start_year: 
-                            annuity_income_tracker_pre_purchase = max((annuity_income_tracker_pre_purchase - annuity_income_tracker_pre_purchase2 * (1 - annuity_tax_rate2)), 0) 
-                        elif annuity_start_year3 <= annuity_start_year: 
-                            annuity_income_tracker_pre_purchase = max((annuity_income_tracker_pre_purchase - annuity_income_tracker_pre_purchase3 * (1 - annuity_tax_rate3)), 0) 
-                        else: 
-                            annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase            
-                        try: annuity_purchase_cost = (annuity_income_tracker_pre_purchase / (annuity_price / 100))
-                        except: annuity_purchase_cost = 0
-                        running_portfolio_value = running_portfolio_value - annuity_purchase_cost
-                        annuity_income = annuity_income_tracker_pre_purchase
-
-                    if(running_portfolio_value >= 0): running_portfolio_value = running_portfolio_value - (withdrawal * draw_adjust[b + years_to_withdrawal] * ((1 + annual_withdrawal_inc) ** (b + years_to_withdrawal)) - annuity_income * (1 - annuity_tax_rate) - annuity_income2 * (1 - annuity_tax_rate2) - annuity_income3 * (1 - annuity_tax_rate3)) / (1 - draw_tax)
-                    if data_direction == 'back':
-                        if(running_portfolio_value > 0): running_portfolio_value = running_portfolio_value * (1 + equity_real[b + a + years_to_withdrawal] * asset_mix[0] + bond_real[b + a + years_to_withdrawal] * asset_mix[3] + index_bond_real[b + a + years_to_withdrawal] * asset_mix[4])
-                    else:
-                        if(running_portfolio_value > 0): running_portfolio_value = running_portfolio_value * (1 + equity_real[b + a + years_to_withdrawal] * asset_mix[0] + (bond_forward[b + years_to_withdrawal] - cpi[b + a + years_to_withdrawal]) * asset_mix[3] + index_bond_forward[b + years_to_withdrawal] * asset_mix[4])        
-
-                    if annuity_option == "1": annuity_income = annuity_income / (1 + cpi[b + a + years_to_withdrawal])
-                    elif annuity_option == "2": annuity_income = annuity_income * (1 + annuity_increase / 100) / (1 + cpi[b + a + years_to_withdrawal])
-                    else: annuity_income = annuity_income
-
-                    if annuity_option2 == "1": annuity_income2 = annuity_income2 / (1 + cpi_change [b + a + years_to_withdrawal])
-                    elif annuity_option2 == "2": annuity_income2 = annuity_income2 * (1 + annuity_increase2 / 100) / (1 + cpi_change [b + a + years_to_withdrawal])
-                    elif annuity_option2 == "3": annuity_income2 = annuity_income2
-                    else: annuity_income2 = annuity_income2 * (1 + annual_annuity2_inc)
-
-                    if annuity_option3 == "1": annuity_income3 = annuity_income3 / (1 + cpi_change [b + a + years_to_withdrawal])
-                    elif annuity_option3 == "2": annuity_income3 = annuity_income3 * (1 + annuity_increase3 / 100) / (1 + cpi_change [b + a + years_to_withdrawal])
-                    elif annuity_option3 == "3": annuity_income3 = annuity_income3
-                    else: annuity_income3 = annuity_income3 * (1 + annual_annuity3_inc)
-
-                if (running_portfolio_value < 0): 
-                    withdrawal_counter -= 0.09
-                    break
-                withdrawal_counter += 0.1
-
-            while withdrawal_counter < 100:
-                withdrawal = withdrawal_unit * withdrawal_counter
-                running_portfolio_value = start_sum
-                running_contribution = contribution
-
-                annuity_income = 0
-                annuity_income_tracker_pre_purchase = (withdrawal * annuity_percent_withdrawal / 100) / (1 - annuity_tax_rate)                
-                annuity_income2 = 0                    
-                annuity_income_tracker_pre_purchase2 = (annuity_percent_withdrawal2)
-                annuity_income3 = 0                    
-                annuity_income_tracker_pre_purchase3 = (annuity_percent_withdrawal3)
-
-                for b in range(years_to_withdrawal):
-                    if b < years_contributions:
-                        running_portfolio_value += running_contribution
-                        running_contribution = running_contribution * (1 + contribution_increase / 100)
-                    if data_direction == "back":
-                        if(running_portfolio_value > 0): running_portfolio_value = running_portfolio_value * (1 + equity_real[b + a] * asset_mix[0] + bond_real[b + a] * asset_mix[3] + index_bond_real[b + a] * asset_mix[4])
-                    else:
-                        if(running_portfolio_value > 0): running_portfolio_value = running_portfolio_value * (1 + equity_real[b + a] * asset_mix[0] + (bond_forward[b] - cpi[b + a]) * asset_mix[3] + index_bond_forward[b] * asset_mix[4])
-                    if b == 0: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase
-                    else: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase * (1 + annual_withdrawal_inc)   
-                    if b == 0: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2
-                    else: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2 * (1 + annual_annuity2_inc) 
-
-                for b in range(years - years_to_withdrawal):      
-                    if b < (annuity_start_year2 - 1 - years_to_withdrawal):
-                        if b == 0 and years_to_withdrawal == 0: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2
-                        else: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2 * (1 + annual_annuity2_inc)         
-                    elif b == (annuity_start_year2 - 1 - years_to_withdrawal):
-                        if b == 0 and years_to_withdrawal == 0: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2
-                        else: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2 * (1 + annual_annuity2_inc)                        
-                        # try: annuity_purchase_cost2 = (annuity_income_tracker_pre_purchase2 / (annuity_price2 / 100)) / (1 - draw_tax)
-                        try: annuity_purchase_cost2 = (annuity_income_tracker_pre_purchase2 / (annuity_price2 / 100))
-                        except: annuity_purchase_cost2 = 0
-                        running_portfolio_value = running_portfolio_value - annuity_purchase_cost2
-                        annuity_income2 = annuity_income_tracker_pre_purchase2
-
-                    if b < (annuity_start_year3 - 1 - years_to_withdrawal):
-                        if b == 0 and years_to_withdrawal == 0: annuity_income_tracker_pre_purchase3 = annuity_income_tracker_pre_purchase3
-                        else: annuity_income_tracker_pre_purchase3 = annuity_income_tracker_pre_purchase3 * (1 + annual_annuity3_inc)         
-                    elif b == (annuity_start_year3 - 1 - years_to_withdrawal):
-                        if b == 0 and years_to_withdrawal == 0: annuity_income_tracker_pre_purchase3 = annuity_income_tracker_pre_purchase3
-                        else: annuity_income_tracker_pre_purchase3 = annuity_income_tracker_pre_purchase3 * (1 + annual_annuity3_inc)                        
-                        try: annuity_purchase_cost3 = (annuity_income_tracker_pre_purchase3 / (annuity_price3 / 100))
-                        except: annuity_purchase_cost3 = 0
-                        running_portfolio_value = running_portfolio_value - annuity_purchase_cost3
-                        annuity_income3 = annuity_income_tracker_pre_purchase3
-
-                    if b < (annuity_start_year - 1 - years_to_withdrawal):
-                        if b == 0 and years_to_withdrawal == 0: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase
-                        else: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase * (1 + annual_withdrawal_inc)
-                    elif b == (annuity_start_year - 1 - years_to_withdrawal):
-                        if b == 0 and years_to_withdrawal == 0: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase
-                        else: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase * (1 + annual_withdrawal_inc)
-                        if annuity_start_year2 and annuity_start_year3 <= annuity_start_year: 
-                            annuity_income_tracker_pre_purchase = max((annuity_income_tracker_pre_purchase - annuity_income_tracker_pre_purchase2 * (1 - annuity_tax_rate2) - annuity_income_tracker_pre_purchase3 * (1 - annuity_tax_rate3)), 0) 
-                        elif annuity_start_year2 <= annuity_start_year: 
-                            annuity_income_tracker_pre_purchase = max((annuity_income_tracker_pre_purchase - annuity_income_tracker_pre_purchase2 * (1 - annuity_tax_rate2)), 0)
-                        elif annuity_start_year3 <= annuity_start_year: 
-                            annuity_income_tracker_pre_purchase = max((annuity_income_tracker_pre_purchase - annuity_income_tracker_pre_purchase3 * (1 - annuity_tax_rate3)), 0)
-                        else: 
-                            annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase
-                        try: annuity_purchase_cost = (annuity_income_tracker_pre_purchase / (annuity_price / 100))
-                        except: annuity_purchase_cost = 0
-                        running_portfolio_value = running_portfolio_value - annuity_purchase_cost
-                        annuity_income = annuity_income_tracker_pre_purchase
-
-                    if(running_portfolio_value >= 0): running_portfolio_value = running_portfolio_value - (withdrawal * draw_adjust[b + years_to_withdrawal] * ((1 + annual_withdrawal_inc) ** (b + years_to_withdrawal)) - annuity_income * (1 - annuity_tax_rate) - annuity_income2 * (1 - annuity_tax_rate2) - annuity_income3 * (1 - annuity_tax_rate3)) / (1 - draw_tax)
-                    if data_direction == 'back':
-                        if(running_portfolio_value > 0): running_portfolio_value = running_portfolio_value * (1 + equity_real[b + a + years_to_withdrawal] * asset_mix[0] + bond_real[b + a + years_to_withdrawal] * asset_mix[3] + index_bond_real[b + a + years_to_withdrawal] * asset_mix[4])
-                    else:
-                        if(running_portfolio_value > 0): running_portfolio_value = running_portfolio_value * (1 + equity_real[b + a + years_to_withdrawal] * asset_mix[0] + (bond_forward[b + years_to_withdrawal] - cpi[b + a + years_to_withdrawal]) * asset_mix[3] + index_bond_forward[b + years_to_withdrawal] * asset_mix[4])        
-
-                    if annuity_option == "1": annuity_income = annuity_income / (1 + cpi[b + a + years_to_withdrawal])
-                    elif annuity_option == "2": annuity_income = annuity_income * (1 + annuity_increase / 100) / (1 + cpi[b + a + years_to_withdrawal])
-                    else: annuity_income = annuity_income
-
-                    if annuity_option2 == "1": annuity_income2 = annuity_income2 / (1 + cpi_change [b + a + years_to_withdrawal])
-                    elif annuity_option2 == "2": annuity_income2 = annuity_income2 * (1 + annuity_increase2 / 100) / (1 + cpi_change [b + a + years_to_withdrawal])
-                    elif annuity_option2 == "3": annuity_income2 = annuity_income2
-                    else: annuity_income2 = annuity_income2 * (1 + annual_annuity2_inc)
-
-                    if annuity_option3 == "1": annuity_income3 = annuity_income3 / (1 + cpi_change [b + a + years_to_withdrawal])
-                    elif annuity_option3 == "2": annuity_income3 = annuity_income3 * (1 + annuity_increase3 / 100) / (1 + cpi_change [b + a + years_to_withdrawal])
-                    elif annuity_option3 == "3": annuity_income3 = annuity_income3
-                    else: annuity_income3 = annuity_income3 * (1 + annual_annuity3_inc)
-
-                if (running_portfolio_value < 0): 
-                    break
-                withdrawal_counter += 0.01
-            safe_withdrawal.append((withdrawal_counter - 0.01) * (withdrawal_unit))
-        safest_swr_in_year = []
         safest_swr_across_years = []
         minimum_funding_level_across_years = []
 
-        # this option gives the max running portfolio value at the beginning of the year sub-set (to calc swr with contribution at their smallest as % of running portfolio value)
+        # this option gives the max running portfolio value at the beginning of the year sub-set (to calc swr with contribution at their smallest as % of running portfolio value).  The running portfolio values of the cycles and the products of growth factors to the end of the simulation are read from the growth factor index for every year sub-set.
         for c in range(years):
-            start_running_portfolio_value = start_sum
-            running_contribution = contribution
-            range_start_running_portfolio_values = []
-            for d in range(len(equity_real) - (years)):
-                for e in range(c):
-                    if e < (years_contributions):
-                        start_running_portfolio_value += running_contribution
-                        running_contribution = running_contribution * (1 + contribution_increase / 100)
-                    if data_direction == 'back':
-                        if(start_running_portfolio_value >= 0): start_running_portfolio_value = start_running_portfolio_value * (1 + equity_real[e + d] * asset_mix[0] + bond_real[e + d] * asset_mix[3] + index_bond_real[e + d] * asset_mix[4])
-                    else:
-                        if(start_running_portfolio_value >= 0): start_running_portfolio_value = start_running_portfolio_value * (1 + equity_real[e + d] * asset_mix[0] + (bond_forward[e] - cpi[e + d]) * asset_mix[3] + index_bond_forward[e] * asset_mix[4])
-                range_start_running_portfolio_values.append(start_running_portfolio_value)
-                start_running_portfolio_value = start_sum
-                running_contribution = contribution
-            mid_simulation_running_portfolio_value = max(range_start_running_portfolio_values)
-            mid_simulation_running_contribution = running_contribution
-            for a in range(len(equity_real) - (years)):
-               
-                withdrawal_counter = 1.0
-                while withdrawal_counter < 100:
-                    running_portfolio_value = mid_simulation_running_portfolio_value
-                    withdrawal_unit = running_portfolio_value / 100
-                    withdrawal = withdrawal_counter * withdrawal_unit
-                    running_contribution = mid_simulation_running_contribution
-
-                    annuity_income = 0
-                    annuity_income_tracker_pre_purchase = (withdrawal * annuity_percent_withdrawal / 100) / (1 - annuity_tax_rate)
-                    annuity_income2 = 0                    
-                    annuity_income_tracker_pre_purchase2 = (annuity_percent_withdrawal2)
-                    annuity_income3 = 0                    
-                    annuity_income_tracker_pre_purchase3 = (annuity_percent_withdrawal3)
-
-                    for b in range(years - c):
-                        if b < (years_contributions - c):
-                            running_portfolio_value += running_contribution
-                            running_contribution = running_contribution * (1 + contribution_increase / 100)
-                        if b < (annuity_start_year2 - 1 - c):
-                            if b == 0 and c == 0: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2
-                            else: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2 * (1 + annual_annuity2_inc)
-                        elif b == (annuity_start_year2 - 1 - c):
-                            if b == 0 and c == 0: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2
-                            else: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2 * (1 + annual_annuity2_inc)                            
-                            try: annuity_purchase_cost2 = (annuity_income_tracker_pre_purchase2 / (annuity_price2 / 100))
-                            except: annuity_purchase_cost2 = 0
-                            running_portfolio_value = running_portfolio_value - annuity_purchase_cost2
-                            annuity_income2 = annuity_income_tracker_pre_purchase2
-
-                        if b < (years_contributions - c):
-                            running_portfolio_value += running_contribution
-                            running_contribution = running_contribution * (1 + contribution_increase / 100)
-                        if b < (annuity_start_year3 - 1 - c):
-                            if b == 0 and c == 0: annuity_income_tracker_pre_purchase3 = annuity_income_tracker_pre_purchase3
-                            else: annuity_income_tracker_pre_purchase3 = annuity_income_tracker_pre_purchase3 * (1 + annual_annuity3_inc)
-                        elif b == (annuity_start_year3 - 1 - c):
-                            if b == 0 and c == 0: annuity_income_tracker_pre_purchase3 = annuity_income_tracker_pre_purchase3
-                            else: annuity_income_tracker_pre_purchase3 = annuity_income_tracker_pre_purchase3 * (1 + annual_annuity3_inc)                            
-                            try: annuity_purchase_cost3 = (annuity_income_tracker_pre_purchase3 / (annuity_price3 / 100))
-                            except: annuity_purchase_cost3 = 0
-                            running_portfolio_value = running_portfolio_value - annuity_purchase_cost3
-                            annuity_income3 = annuity_income_tracker_pre_purchase3
-
-                        if b < (annuity_start_year - 1 - c):
-                            if b == 0 and c == 0: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase
-                            else: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase * (1 + annual_withdrawal_inc)
-                        elif b == (annuity_start_year - 1 - c):
-                            if b == 0 and c == 0: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase
-                            else: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase * (1 + annual_withdrawal_inc)
-                            if annuity_start_year2 and annuity_start_year3 <= annuity_start_year: 
-                                annuity_income_tracker_pre_purchase = max((annuity_income_tracker_pre_purchase - annuity_income_tracker_pre_purchase2 * (1 - annuity_tax_rate2) - annuity_income_tracker_pre_purchase3 * (1 - annuity_tax_rate3)), 0) 
-                            elif annuity_start_year2 <= annuity_start_year: 
-                                annuity_income_tracker_pre_purchase = max((annuity_income_tracker_pre_purchase - annuity_income_tracker_pre_purchase2 * (1 - annuity_tax_rate2)), 0)
-                            elif annuity_start_year3 <= annuity_start_year: 
-                                annuity_income_tracker_pre_purchase = max((annuity_income_tracker_pre_purchase - annuity_income_tracker_pre_purchase3 * (1 - annuity_tax_rate3)), 0)
-                            else: 
-                                annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase
-                            try: annuity_purchase_cost = (annuity_income_tracker_pre_purchase / (annuity_price / 100))
-                            except: annuity_purchase_cost = 0
-                            running_portfolio_value = running_portfolio_value - annuity_purchase_cost
-                            annuity_income = annuity_income_tracker_pre_purchase
-
-                        net_withdrawal = (withdrawal * draw_adjust[b + c] * ((1 + annual_withdrawal_inc) ** (b)) - annuity_income * (1 - annuity_tax_rate) - annuity_income2 * (1 - annuity_tax_rate2) - annuity_income3 * (1 - annuity_tax_rate3)) / (1 - draw_tax)
-                        if(running_portfolio_value >= 0): running_portfolio_value = running_portfolio_value - net_withdrawal
-                        if data_direction == 'back':
-                            if(running_portfolio_value >= 0): running_portfolio_value = running_portfolio_value * (1 + equity_real[b + a + c] * asset_mix[0] + bond_real[b + a + c] * asset_mix[3] + index_bond_real[b + a + c] * asset_mix[4])
-                        else:
-                            if(running_portfolio_value >= 0): running_portfolio_value = running_portfolio_value * (1 + equity_real[b + a + c] * asset_mix[0] + (bond_forward[b + c] - cpi[b + a + c]) * asset_mix[3] + index_bond_forward[b + c] * asset_mix[4])
-                        
-                        cpi_delta = cpi[b + a + c]
-                        if annuity_option == "1": annuity_income = annuity_income / (1 + cpi_delta)
-                        elif annuity_option == "2": annuity_income = annuity_income * (1 + annuity_increase / 100) / (1 + cpi_delta)
-                        else: annuity_income = annuity_income
-
-                        if annuity_option2 == "1": annuity_income2 = annuity_income2 / (1 + cpi_delta)
-                        elif annuity_option2 == "2": annuity_income2 = annuity_income2 * (1 + annuity_increase2 / 100) / (1 + cpi_delta)
-                        elif annuity_option2 == "3": annuity_income2 = annuity_income2
-                        else: annuity_income2 = annuity_income2 * (1 + annual_annuity2_inc)
-
-                        if annuity_option3 == "1": annuity_income3 = annuity_income3 / (1 + cpi_delta)
-                        elif annuity_option3 == "2": annuity_income3 = annuity_income3 * (1 + annuity_increase3 / 100) / (1 + cpi_delta)
-                        elif annuity_option3 == "3": annuity_income3 = annuity_income3
-                        else: annuity_income3 = annuity_income3 * (1 + annual_annuity3_inc)                    
-
-                    if (running_portfolio_value < 0): 
-                        withdrawal_counter -= 0.9
-                        break
-                    withdrawal_counter += 1.0
-                    
-                while withdrawal_counter < 100:
-                    running_portfolio_value = mid_simulation_running_portfolio_value
-                    withdrawal_unit = running_portfolio_value / 100
-                    withdrawal = withdrawal_counter * withdrawal_unit
-                    running_contribution = mid_simulation_running_contribution
-
-                    annuity_income = 0
-                    annuity_income_tracker_pre_purchase = (withdrawal * annuity_percent_withdrawal / 100) / (1 - annuity_tax_rate)
-                    annuity_income2 = 0                    
-                    annuity_income_tracker_pre_purchase2 = (annuity_percent_withdrawal2)
-                    annuity_income3 = 0                    
-                    annuity_income_tracker_pre_purchase3 = (annuity_percent_withdrawal3)
-
-                    for b in range(years - c):
-                        if b < (years_contributions - c):
-                            running_portfolio_value += running_contribution
-                            running_contribution = running_contribution * (1 + contribution_increase / 100)
-                        if b < (annuity_start_year2 - 1 - c):
-                            if b == 0 and c == 0: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2
-                            else: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2 * (1 + annual_annuity2_inc)
-                        elif b == (annuity_start_year2 - 1 - c):
-                            if b == 0 and c == 0: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2
-                            else: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2 * (1 + annual_annuity2_inc)                            
-                            try: annuity_purchase_cost2 = (annuity_income_tracker_pre_purchase2 / (annuity_price2 / 100))
-                            except: annuity_purchase_cost2 = 0
-                            running_portfolio_value = running_portfolio_value - annuity_purchase_cost2
-                            annuity_income2 = annuity_income_tracker_pre_purchase2
-
-                        if b < (years_contributions - c):
-                            running_portfolio_value += running_contribution
-                            running_contribution = running_contribution * (1 + contribution_increase / 100)
-                        if b < (annuity_start_year3 - 1 - c):
-                            if b == 0 and c == 0: annuity_income_tracker_pre_purchase3 = annuity_income_tracker_pre_purchase3
-                            else: annuity_income_tracker_pre_purchase3 = annuity_income_tracker_pre_purchase3 * (1 + annual_annuity3_inc)
-                        elif b == (annuity_start_year3 - 1 - c):
-                            if b == 0 and c == 0: annuity_income_tracker_pre_purchase3 = annuity_income_tracker_pre_purchase3
-                            else: annuity_income_tracker_pre_purchase3 = annuity_income_tracker_pre_purchase3 * (1 + annual_annuity3_inc)                            
-                            try: annuity_purchase_cost3 = (annuity_income_tracker_pre_purchase3 / (annuity_price3 / 100))
-                            except: annuity_purchase_cost3 = 0
-                            running_portfolio_value = running_portfolio_value - annuity_purchase_cost3
-                            annuity_income3 = annuity_income_tracker_pre_purchase3
-
-                        if b < (annuity_start_year - 1 - c):
-                            if b == 0 and c == 0: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase
-                            else: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase * (1 + annual_withdrawal_inc)
-                        elif b == (annuity_start_year - 1 - c):
-                            if b == 0 and c == 0: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase
-                            else: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase * (1 + annual_withdrawal_inc)
-                            if annuity_start_year2 and annuity_start_year3 <= annuity_start_year: 
-                                annuity_income_tracker_pre_purchase = max((annuity_income_tracker_pre_purchase - annuity_income_tracker_pre_purchase2 * (1 - annuity_tax_rate2) - annuity_income_tracker_pre_purchase3 * (1 - annuity_tax_rate3)), 0) 
-                            elif annuity_start_year2 <= annuity_start_year: 
-                                annuity_income_tracker_pre_purchase = max((annuity_income_tracker_pre_purchase - annuity_income_tracker_pre_purchase2 * (1 - annuity_tax_rate2)), 0) 
-                            elif annuity_start_year3 <= annuity_start_year: 
-                                annuity_income_tracker_pre_purchase = max((annuity_income_tracker_pre_purchase - annuity_income_tracker_pre_purchase3 * (1 - annuity_tax_rate3)), 0) 
-                            else: 
-                                annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase 
-                            try: annuity_purchase_cost = (annuity_income_tracker_pre_purchase / (annuity_price / 100))
-                            except: annuity_purchase_cost = 0
-                            running_portfolio_value = running_portfolio_value - annuity_purchase_cost
-                            annuity_income = annuity_income_tracker_pre_purchase
-
-                        net_withdrawal = (withdrawal * draw_adjust[b + c] * ((1 + annual_withdrawal_inc) ** (b)) - annuity_income * (1 - annuity_tax_rate) - annuity_income2 * (1 - annuity_tax_rate2) - annuity_income3 * (1 - annuity_tax_rate3)) / (1 - draw_tax)
-                        if(running_portfolio_value >= 0): running_portfolio_value = running_portfolio_value - net_withdrawal
-                        if data_direction == 'back':
-                            if(running_portfolio_value >= 0): running_portfolio_value = running_portfolio_value * (1 + equity_real[b + a + c] * asset_mix[0] + bond_real[b + a + c] * asset_mix[3] + index_bond_real[b + a + c] * asset_mix[4])
-                        else:
-                            if(running_portfolio_value >= 0): running_portfolio_value = running_portfolio_value * (1 + equity_real[b + a + c] * asset_mix[0] + (bond_forward[b + c] - cpi[b + a + c]) * asset_mix[3] + index_bond_forward[b + c] * asset_mix[4])
-                        
-                        cpi_delta = cpi[b + a + c]
-                        if annuity_option == "1": annuity_income = annuity_income / (1 + cpi_delta)
-                        elif annuity_option == "2": annuity_income = annuity_income * (1 + annuity_increase / 100) / (1 + cpi_delta)
-                        else: annuity_income = annuity_income
-
-                        if annuity_option2 == "1": annuity_income2 = annuity_income2 / (1 + cpi_delta)
-                        elif annuity_option2 == "2": annuity_income2 = annuity_income2 * (1 + annuity_increase2 / 100) / (1 + cpi_delta)
-                        elif annuity_option2 == "3": annuity_income2 = annuity_income2
-                        else: annuity_income2 = annuity_income2 * (1 + annual_annuity2_inc)
-
-                        if annuity_option3 == "1": annuity_income3 = annuity_income3 / (1 + cpi_delta)
-                        elif annuity_option3 == "2": annuity_income3 = annuity_income3 * (1 + annuity_increase3 / 100) / (1 + cpi_delta)
-                        elif annuity_option3 == "3": annuity_income3 = annuity_income3
-                        else: annuity_income3 = annuity_income3 * (1 + annual_annuity3_inc)                    
-
-                    if (running_portfolio_value < 0): 
-                        withdrawal_counter -= 0.09
-                        break
-                    withdrawal_counter += 0.1
-
-                while withdrawal_counter < 100:
-                    running_portfolio_value = mid_simulation_running_portfolio_value
-                    withdrawal_unit = running_portfolio_value / 100
-                    withdrawal = withdrawal_counter * withdrawal_unit
-                    running_contribution = mid_simulation_running_contribution
-
-                    annuity_income = 0
-                    annuity_income_tracker_pre_purchase = (withdrawal * annuity_percent_withdrawal / 100) / (1 - annuity_tax_rate)
-                    annuity_income2 = 0                    
-                    annuity_income_tracker_pre_purchase2 = (annuity_percent_withdrawal2)
-                    annuity_income3 = 0                    
-                    annuity_income_tracker_pre_purchase3 = (annuity_percent_withdrawal3)
-
-                    for b in range(years - c):
-                        if b < (years_contributions - c):
-                            running_portfolio_value += running_contribution
-                            running_contribution = running_contribution * (1 + contribution_increase / 100)
-                        if b < (annuity_start_year2 - 1 - c):
-                            if b == 0 and c == 0: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2
-                            else: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2 * (1 + annual_annuity2_inc)
-                        elif b == (annuity_start_year2 - 1 - c):
-                            if b == 0 and c == 0: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2
-                            else: annuity_income_tracker_pre_purchase2 = annuity_income_tracker_pre_purchase2 * (1 + annual_annuity2_inc)                            
-                            try: annuity_purchase_cost2 = (annuity_income_tracker_pre_purchase2 / (annuity_price2 / 100))
-                            except: annuity_purchase_cost2 = 0
-                            running_portfolio_value = running_portfolio_value - annuity_purchase_cost2
-                            annuity_income2 = annuity_income_tracker_pre_purchase2
-
-                        if b < (years_contributions - c):
-                            running_portfolio_value += running_contribution
-                            running_contribution = running_contribution * (1 + contribution_increase / 100)
-                        if b < (annuity_start_year3 - 1 - c):
-                            if b == 0 and c == 0: annuity_income_tracker_pre_purchase3 = annuity_income_tracker_pre_purchase3
-                            else: annuity_income_tracker_pre_purchase3 = annuity_income_tracker_pre_purchase3 * (1 + annual_annuity3_inc)
-                        elif b == (annuity_start_year3 - 1 - c):
-                            if b == 0 and c == 0: annuity_income_tracker_pre_purchase3 = annuity_income_tracker_pre_purchase3
-                            else: annuity_income_tracker_pre_purchase3 = annuity_income_tracker_pre_purchase3 * (1 + annual_annuity3_inc)                            
-                            try: annuity_purchase_cost3 = (annuity_income_tracker_pre_purchase3 / (annuity_price3 / 100))
-                            except: annuity_purchase_cost3 = 0
-                            running_portfolio_value = running_portfolio_value - annuity_purchase_cost3
-                            annuity_income3 = annuity_income_tracker_pre_purchase3
-
-                        if b < (annuity_start_year - 1 - c):
-                            if b == 0 and c == 0: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase
-                            else: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase * (1 + annual_withdrawal_inc)
-                        elif b == (annuity_start_year - 1 - c):
-                            if b == 0 and c == 0: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase
-                            else: annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase * (1 + annual_withdrawal_inc)
-                            if annuity_start_year2 and annuity_start_year3 <= annuity_start_year: 
-                                annuity_income_tracker_pre_purchase = max((annuity_income_tracker_pre_purchase - annuity_income_tracker_pre_purchase2 * (1 - annuity_tax_rate2) - annuity_income_tracker_pre_purchase3 * (1 - annuity_tax_rate3)), 0) 
-                            elif annuity_start_year2 <= annuity_start_year: 
-                                annuity_income_tracker_pre_purchase = max((annuity_income_tracker_pre_purchase - annuity_income_tracker_pre_purchase2 * (1 - annuity_tax_rate2)), 0)
-                            elif annuity_start_year3 <= annuity_start_year: 
-                                annuity_income_tracker_pre_purchase = max((annuity_income_tracker_pre_purchase - annuity_income_tracker_pre_purchase3 * (1 - annuity_tax_rate3)), 0) 
-                            else: 
-                                annuity_income_tracker_pre_purchase = annuity_income_tracker_pre_purchase
-                            try: annuity_purchase_cost = (annuity_income_tracker_pre_purchase / (annuity_price / 100))
-                            except: annuity_purchase_cost = 0
-                            running_portfolio_value = running_portfolio_value - annuity_purchase_cost
-                            annuity_income = annuity_income_tracker_pre_purchase
-
-                        net_withdrawal = (withdrawal * draw_adjust[b + c] * ((1 + annual_withdrawal_inc) ** (b)) - annuity_income * (1 - annuity_tax_rate) - annuity_income2 * (1 - annuity_tax_rate2) - annuity_income3 * (1 - annuity_tax_rate3)) / (1 - draw_tax)
-                        if(running_portfolio_value >= 0): running_portfolio_value = running_portfolio_value - net_withdrawal
-                        if data_direction == 'back':
-                            if(running_portfolio_value >= 0): running_portfolio_value = running_portfolio_value * (1 + equity_real[b + a + c] * asset_mix[0] + bond_real[b + a + c] * asset_mix[3] + index_bond_real[b + a + c] * asset_mix[4])
-                        else:
-                            if(running_portfolio_value >= 0): running_portfolio_value = running_portfolio_value * (1 + equity_real[b + a + c] * asset_mix[0] + (bond_forward[b + c] - cpi[b + a + c]) * asset_mix[3] + index_bond_forward[b + c] * asset_mix[4])
-                        
-                        cpi_delta = cpi[b + a + c]
-                        if annuity_option == "1": annuity_income = annuity_income / (1 + cpi_delta)
-                        elif annuity_option == "2": annuity_income = annuity_income * (1 + annuity_increase / 100) / (1 + cpi_delta)
-                        else: annuity_income = annuity_income
-
-                        if annuity_option2 == "1": annuity_income2 = annuity_income2 / (1 + cpi_delta)
-                        elif annuity_option2 == "2": annuity_income2 = annuity_income2 * (1 + annuity_increase2 / 100) / (1 + cpi_delta)
-                        elif annuity_option2 == "3": annuity_income2 = annuity_income2
-                        else: annuity_income2 = annuity_income2 * (1 + annual_annuity2_inc)
-
-                        if annuity_option3 == "1": annuity_income3 = annuity_income3 / (1 + cpi_delta)
-                        elif annuity_option3 == "2": annuity_income3 = annuity_income3 * (1 + annuity_increase3 / 100) / (1 + cpi_delta)
-                        elif annuity_option3 == "3": annuity_income3 = annuity_income3
-                        else: annuity_income3 = annuity_income3 * (1 + annual_annuity3_inc)                    
-
-                    if (running_portfolio_value < 0): 
-                        break
-                    withdrawal_counter += 0.01
-
-                safest_swr_in_year.append((withdrawal_counter - 0.01))
-            safest_swr_across_years.append(min(safest_swr_in_year))
-            safest_swr_in_year = []
+            mid_simulation_running_portfolio_value = float(np.max(start_running_portfolio_values[:, c]))
+
+            # contributions still to come start again from the first year's contribution and are added twice a year (before each of the state / occupational pension purchases)
+            mid_simulation_running_contribution = contribution
+            contribution_first = []
+            contribution_second = []
+            for b in range(years - c):
+                if b < (years_contributions - c):
+                    contribution_first.append(mid_simulation_running_contribution)
+                    mid_simulation_running_contribution = mid_simulation_running_contribution * (1 + contribution_increase / 100)
+                    contribution_second.append(mid_simulation_running_contribution)
+                    mid_simulation_running_contribution = mid_simulation_running_contribution * (1 + contribution_increase / 100)
+                else:
+                    contribution_first.append(0)
+                    contribution_second.append(0)
+            stretch = BacktestedSWRStretch(growth[:, c:], np.full(cycles, mid_simulation_running_portfolio_value), mid_simulation_running_portfolio_value / 100, draw_adjust[c:years], [(1 + annual_withdrawal_inc) ** (b) for b in range(years - c)], contribution_first, contribution_second, draw_tax, annual_withdrawal_inc, *annuity_parameters, cpi, cpi, c, 0, growth_to_end[:, c:])
+            safest_swr_across_years.append(SolveMaxSWRs(stretch, swr_tolerance, True, cycle_order).min_swr)
 
         self.safest_swr_across_years = safest_swr_across_years
         self.safe_withdrawal = safe_withdrawal
@@ -1575,495 +1378,317 @@ class CalcSafeFundingLevel:
         self.max_withdrawal_rate = max_withdrawal_rate
 
 
-# Algorithm that finds optimal asset mix combination for taking prepared parameter & return data set and by iterating through possible combinations (in 10% increments) and using the RunSimulation () class to test each iteration.  Returns two asset mix combinations ('max' and 'min' respectively) i) mix that returns highest expected end simulation value (for zero or lowest possible failure rate) ii) mix that has lowest real-term value volatility (for zero or lowest possible failure rate).
+# Process pools used by OptimiseAssetMix to run asset mixes in parallel.  A pool is started on first use with the given number of worker processes and then kept for the life of the server process.  Every web server process keeps its own pools, so the number of workers should be sized as CPU cores / web server processes (more workers than that compete for the cores under concurrent load).  Workers are spawned rather than forked as the server process may be running threads.
+class AssetMixProcessPool:
+    pools = {}
+    lock = threading.Lock()
+
+    def __init__(self, workers):
+        with AssetMixProcessPool.lock:
+            pool = AssetMixProcessPool.pools.get(workers)
+            if pool is None:
+                pool = concurrent.futures.ProcessPoolExecutor(max_workers = workers, mp_context = multiprocessing.get_context('spawn'))
+                AssetMixProcessPool.pools[workers] = pool
+        self.workers = workers
+        self.pool = pool
+
+    def discard(self):
+        # a broken pool (e.g. a worker process was killed) is dropped so that the next request starts a new one
+        with AssetMixProcessPool.lock:
+            if AssetMixProcessPool.pools.get(self.workers) is self.pool:
+                del AssetMixProcessPool.pools[self.workers]
+        self.pool.shutdown(wait = False, cancel_futures = True)
+
+# Copies prepared return series into a single shared memory block so that pool worker processes can read them without the series being pickled with each task.  'layout' maps each series name to its (offset, length) in the block.  The parent process must call release() once the workers have finished with the block.
+class SharedReturnSeries:
+    def __init__(self, series):
+        layout = {}
+        offset = 0
+        for name, values in series.items():
+            layout[name] = (offset, len(values))
+            offset += len(values)
+        self.shared = shared_memory.SharedMemory(create = True, size = max(offset, 1) * 8)
+        block = np.ndarray((offset,), dtype = np.float64, buffer = self.shared.buf)
+        for name, values in series.items():
+            block[layout[name][0]:layout[name][0] + layout[name][1]] = values
+        del block
+        self.name = self.shared.name
+        self.layout = layout
+
+    def release(self):
+        self.shared.close()
+        self.shared.unlink()
+
+# Runs a batch of asset mixes ((equity, fixed income bond, inflation linked bond) weightings as percentages) through RunSimulationCycles together - each pass runs the cycles of as many mixes as fit in batch_elements (rows x years) values, so memory use is capped however many mixes there are.  'series' holds the prepared return series and 'parameters' the remaining RunSimulationCycles arguments, both by argument name.  If parameters['income_totals'] is set the median (across cycles) of the average yearly income of a cycle is also found for each mix.  If parameters['safest_swr_across_years'] is None the maximum SWR by simulation year is found for each mix with CalcMaxBacktestedSWRs (which builds on the cached growth factor index of the mix), as a simulation of the mix on its own would.  Returns (simulation fails, average end value, median income (None if not found)) for each mix, the first two as RunSimulation gives for the mix on its own.
+class RunAssetMixBatch:
+    def __init__(self, mixes, series, parameters, batch_elements = ASSET_MIX_BATCH_ELEMENTS):
+        years = parameters['years']
+        cycles = len(series['equity_real']) - years
+        mixes_per_pass = max(batch_elements // max(cycles * years, 1), 1)
+        if parameters['safest_swr_across_years'] is None:
+            swr_parameters = {name: parameters[name] for name in ['start_sum', 'years', 'annual_withdrawal_inc', 'draw_adjust', 'draw_tax', 'annuity_option_list', 'annuity_increase_list', 'annuity_price_list', 'annuity_tax_rate_list', 'annuity_percent_withdrawal_list', 'annuity_start_year_list', 'data_direction', 'years_contributions', 'contribution', 'contribution_increase', 'years_between']}
+        results = []
+        for first_mix in range(0, len(mixes), mixes_per_pass):
+            asset_mix = np.array([[equity/100, 0, 0, fixed_income_bond/100, inflation_linked_bond/100] for equity, fixed_income_bond, inflation_linked_bond in mixes[first_mix:first_mix + mixes_per_pass]])
+            pass_parameters = parameters
+            if parameters['safest_swr_across_years'] is None:
+                pass_parameters = dict(parameters, safest_swr_across_years = [CalcMaxBacktestedSWRs(asset_mix = mix_weights, **series, **swr_parameters).safest_swr_across_years for mix_weights in asset_mix.tolist()])
+            simulation_cycles = RunSimulationCycles(asset_mix = asset_mix, streams = False, **series, **pass_parameters)
+            simulation_fails = simulation_cycles.simulation_fail_tag.reshape(len(asset_mix), cycles).mean(axis = 1)
+            avg_end_value = simulation_cycles.end_portfolio_values.reshape(len(asset_mix), cycles).mean(axis = 1)
+            if simulation_cycles.total_withdrawals is None:
+                median_income = [None] * len(asset_mix)
+            else:
+                median_income = np.median(simulation_cycles.total_withdrawals.reshape(len(asset_mix), cycles) / max(years - simulation_cycles.years_to_withdrawal, 1), axis = 1).tolist()
+            results += zip(simulation_fails.tolist(), avg_end_value.tolist(), median_income)
+        self.results = results
+
+# Pool worker entry point for RunAssetMixes.  Reads the prepared return series from the shared memory block, runs its chunk of asset mixes and only the results are sent back to the parent process.
+class RunSharedAssetMixChunk:
+    def __init__(self, shared_name, layout, mixes, parameters):
+        shared = shared_memory.SharedMemory(name = shared_name)
+        try:
+            block = np.ndarray((shared.size // 8,), dtype = np.float64, buffer = shared.buf)
+            series = {name: tuple(block[offset:offset + length].tolist()) for name, (offset, length) in layout.items()}
+            del block
+        finally:
+            shared.close()
+        self.results = RunAssetMixBatch(mixes, series, parameters).results
+
+# Runs a list of asset mixes with RunAssetMixBatch, split into contiguous chunks across a process pool of 'workers' processes (or in-process where workers is 1 or there is only one mix).  Results are returned in the same order as 'mixes'.
+class RunAssetMixes:
+    def __init__(self, mixes, series, parameters, workers):
+        chunk_count = min(workers, len(mixes))
+        if chunk_count <= 1:
+            self.results = RunAssetMixBatch(mixes, series, parameters).results
+            return
+        chunk_bounds = [round(i * len(mixes) / chunk_count) for i in range(chunk_count + 1)]
+        process_pool = AssetMixProcessPool(workers)
+        shared_series = SharedReturnSeries(series)
+        try:
+            futures = [process_pool.pool.submit(RunSharedAssetMixChunk, shared_series.name, shared_series.layout, mixes[chunk_bounds[i]:chunk_bounds[i + 1]], parameters) for i in range(chunk_count)]
+            results = []
+            for future in futures:
+                results += future.result().results
+        except concurrent.futures.BrokenExecutor:
+            process_pool.discard()
+            results = RunAssetMixBatch(mixes, series, parameters).results
+        finally:
+            shared_series.release()
+        self.results = results
+
+# Runs a list of tasks (a class of this module and its arguments by name, e.g. RunSimulation) on the process pool (AssetMixProcessPool) of 'workers' processes, or in this process with 1 worker or a single task (or if the pool breaks).  Returns the task objects in the order given.
+class RunPoolTasks:
+    def __init__(self, task, arguments_list, workers):
+        if min(workers, len(arguments_list)) <= 1:
+            self.results = [task(**arguments) for arguments in arguments_list]
+            return
+        process_pool = AssetMixProcessPool(workers)
+        try:
+            futures = [process_pool.pool.submit(task, **arguments) for arguments in arguments_list]
+            self.results = [future.result() for future in futures]
+        except concurrent.futures.BrokenExecutor:
+            process_pool.discard()
+            self.results = [task(**arguments) for arguments in arguments_list]
+
+# Runs the scenarios of a simulation batch, each given as (SWR key, CalcMaxBacktestedSWRs arguments, RunSimulation arguments without safest_swr_across_years).  CalcMaxBacktestedSWRs is only run once for each SWR key, then RunSimulation for every scenario, both across 'workers' processes (RunPoolTasks).  Returns (CalcMaxBacktestedSWRs, RunSimulation) results for each scenario.
+class RunSimulationScenarios:
+    def __init__(self, scenarios, workers):
+        swr_arguments = {}
+        for swr_key, arguments, simulation_arguments in scenarios:
+            if swr_key not in swr_arguments: swr_arguments[swr_key] = arguments
+        backtest_swrs = dict(zip(swr_arguments, RunPoolTasks(CalcMaxBacktestedSWRs, list(swr_arguments.values()), workers).results))
+        simulation_results = RunPoolTasks(RunSimulation, [dict(simulation_arguments, safest_swr_across_years = backtest_swrs[swr_key].safest_swr_across_years) for swr_key, arguments, simulation_arguments in scenarios], workers).results
+        self.swr_calculations = len(swr_arguments)
+        self.results = [(backtest_swrs[swr_key], simulation) for (swr_key, arguments, simulation_arguments), simulation in zip(scenarios, simulation_results)]
+
+# Picks the two optimised asset mixes from a list of evaluated asset mixes (in the order they were evaluated) and their (simulation fails, average end value, median income) results.  'max' is the mix with fewest fails and then highest average end value, 'min' the first mix evaluated with fewest fails (the iteration starts from the lowest volatility mix).  Ties resolve to the mix evaluated first.
+class SelectOptimisedAssetMixes:
+    def __init__(self, mixes, results):
+        best_result_max = None
+        best_result_min = None
+        for (equity, fixed_income_bond, inflation_linked_bond), (simulation_fails, avg_end_value, median_income) in zip(mixes, results):
+            mix_result = {'equity' : equity, 'fixed_income_bond' : fixed_income_bond, 'inflation_linked_bond' : inflation_linked_bond, 'fail' : simulation_fails, 'avg_value' : avg_end_value}
+            if best_result_min is None or simulation_fails < best_result_min['fail']:
+                best_result_min = mix_result
+            if best_result_max is None or simulation_fails < best_result_max['fail']:
+                best_result_max = mix_result
+            if simulation_fails == best_result_max['fail'] and avg_end_value > best_result_max['avg_value']:
+                best_result_max = mix_result
+        self.best_result_max = best_result_max
+        self.best_result_min = best_result_min
+
+# Asset mixes around which OptimiseAssetMix refines its search: the best refine_cells mixes evaluated so far on each of the 'max' (fail count, then average end value) and 'min' (fail count, then order evaluated) measures of SelectOptimisedAssetMixes.
+class AssetMixRefinementCells:
+    def __init__(self, mixes, results, refine_cells = ASSET_MIX_REFINE_CELLS):
+        max_ranking = sorted((simulation_fails, -avg_end_value, k) for k, (simulation_fails, avg_end_value, median_income) in enumerate(results))
+        min_ranking = sorted((simulation_fails, k) for k, (simulation_fails, avg_end_value, median_income) in enumerate(results))
+        cells = []
+        for ranking in [max_ranking, min_ranking]:
+            for ranked in ranking[:refine_cells]:
+                if mixes[ranked[-1]] not in cells: cells.append(mixes[ranked[-1]])
+        self.cells = cells
+
+# Asset mixes on a finer grid (step) around each of 'cells' that lie strictly inside the neighbouring mixes of the previous grid (previous_step) - equity and fixed income bond weightings are moved (inflation linked bond takes the rest) or, for data_direction "back", equity only (fixed income bond takes the rest).  Mixes outside the equity / bond / index-linked simplex are left out.
+class AssetMixRefinement:
+    def __init__(self, cells, step, previous_step, data_direction):
+        offsets = range(-((previous_step - 1) // step) * step, previous_step, step)
+        mixes = []
+        for equity, fixed_income_bond, inflation_linked_bond in cells:
+            for equity_offset in offsets:
+                refined_equity = equity + equity_offset
+                if not 0 <= refined_equity <= 100: continue
+                if data_direction == "back":
+                    mixes.append((refined_equity, 100 - refined_equity, 0))
+                    continue
+                for bond_offset in offsets:
+                    refined_fixed_income_bond = fixed_income_bond + bond_offset
+                    if 0 <= refined_fixed_income_bond <= 100 - refined_equity:
+                        mixes.append((refined_equity, refined_fixed_income_bond, 100 - refined_equity - refined_fixed_income_bond))
+        self.mixes = mixes
+
+# Algorithm that finds optimal asset mix combination for taking prepared parameter & return data set and by iterating through possible combinations (in grid_step % increments, 10% by default) and using the batched back-testing engine (RunAssetMixBatch) to test each iteration.  Where resolution is finer than grid_step the search is then refined around the best mixes found (AssetMixRefinementCells), halving the step each round down to resolution, until at most evaluation_budget mixes have been run (the coarse grid is always run in full).  Returns two asset mix combinations ('max' and 'min' respectively) i) mix that returns highest expected end simulation value (for zero or lowest possible failure rate) ii) mix that has lowest real-term value volatility (for zero or lowest possible failure rate), and the number of asset mixes run ('evaluations').  bonus_target is the withdrawal bonus target used for the 'constantbonus' withdrawal option.  With surface set, 'surface' also returns the whole allocation surface run (fail rate, average end value and median income of each asset mix).  The combinations are run across 'workers' processes by RunAssetMixes.
 class OptimiseAssetMix:
-    def __init__(self, equity_real, bond_real, index_bond_real, start_sum, withdrawal_amount, years, annual_withdrawal_inc, draw_adjust, cpi, index_bond_forward, bond_forward, draw_tax, dynamic_option, target_withdrawal_percent, min_withdrawal_floor, flex_real_decrease, flex_real_increase, years_no_flex, spring_back, annuity_option, annuity_increase, annuity_price, annuity_tax_rate, cpi_change, annuity_percent_withdrawal, start_simulation_age, annuity_start_year, mortality_data_pull, ilb_spot_curve, data_direction, years_contributions, contribution, contribution_increase, years_between, yale_weighting, vanguard_decrease_floor, vanguard_increase_ceiling, vpw_data, net_other_income):
-        # this sets the 'starting portfolio' against which the iteration tries to find an improvement.
+    def __init__(self, equity_real, bond_real, index_bond_real, start_sum, withdrawal_amount, years, annual_withdrawal_inc, draw_adjust, cpi, index_bond_forward, bond_forward, draw_tax, dynamic_option, target_withdrawal_percent, min_withdrawal_floor, flex_real_decrease, flex_real_increase, years_no_flex, spring_back, annuity_option, annuity_increase, annuity_price, annuity_tax_rate, cpi_change, annuity_percent_withdrawal, start_simulation_age, annuity_start_year, mortality_data_pull, ilb_spot_curve, data_direction, years_contributions, contribution, contribution_increase, years_between, yale_weighting, vanguard_decrease_floor, vanguard_increase_ceiling, vpw_data, net_other_income, workers = 1, grid_step = ASSET_MIX_GRID_STEP, resolution = None, evaluation_budget = None, bonus_target = 0, surface = False):
+        # this sets the 'starting portfolio' against which the iteration tries to find an improvement.  Mixes are held as (equity, fixed income bond, inflation linked bond) percentages.
         if data_direction == "back":
-            equity = 0
-            fixed_income_bond = 1
-            inflation_linked_bond = 0
-        else: 
-            equity = 0
-            fixed_income_bond = 0
-            inflation_linked_bond = 1
-        bonus_target = 0
-
-        # below is here as instances of RunSimulation() in this class require it (for flex and bonus withdrawal strategic calculations).  Ideally would call CalcMaxBacktestedSWRs for each asset mix iteration but it is too time consuming.  Putting safest_swr_across_years to 3 is suitably conservative fix.  
-        safest_swr_across_years = [3] * years
-
-        result = RunSimulation(equity_real, bond_real, index_bond_real, [equity,0,0,fixed_income_bond, inflation_linked_bond], start_sum, withdrawal_amount, years, annual_withdrawal_inc, draw_adjust, cpi, index_bond_forward, bond_forward, draw_tax, bonus_target, safest_swr_across_years, dynamic_option, target_withdrawal_percent, min_withdrawal_floor, flex_real_decrease, flex_real_increase, years_no_flex, spring_back, annuity_option, annuity_increase, annuity_price, annuity_tax_rate, cpi_change, annuity_percent_withdrawal, start_simulation_age, annuity_start_year, mortality_data_pull, ilb_spot_curve, data_direction, years_contributions, contribution, contribution_increase, years_between, yale_weighting, vanguard_decrease_floor, vanguard_increase_ceiling, vpw_data, net_other_income)
-        best_result_max = {'equity' : equity * 100, 'fixed_income_bond' : fixed_income_bond * 100, 'inflation_linked_bond' : inflation_linked_bond * 100, 'fail' : result.simulation_fails, 'avg_value' : result.avg_end_value}
-        best_result_min = {'equity' : equity * 100, 'fixed_income_bond' : fixed_income_bond * 100, 'inflation_linked_bond' : inflation_linked_bond * 100, 'fail' : result.simulation_fails, 'avg_value' : result.avg_end_value}
-        equity_weights = [0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100]
-        for a in equity_weights:
-            equity = a
+            mixes = [(0, 100, 0)]
+        else:
+            mixes = [(0, 0, 100)]
+
+        # withdrawal flex and bonus calculations read the maximum SWR by simulation year, which depends on the asset mix, so it is found for each mix as it is run (see RunAssetMixBatch).  Other withdrawal options do not use it.
+        if dynamic_option in ['constantflex', 'constantbonus']:
+            safest_swr_across_years = None
+        else:
+            safest_swr_across_years = [3] * years
+
+        equity_weights = range(0, 101, grid_step)
+        for equity in equity_weights:
             fixed_income = 100 - equity
             if data_direction == "back":
-                fixed_income_bond = fixed_income
-                inflation_linked_bond = 0
-                result = RunSimulation(equity_real, bond_real, index_bond_real, [equity/100,0,0,fixed_income_bond/100, inflation_linked_bond/100], start_sum, withdrawal_amount, years, annual_withdrawal_inc, draw_adjust, cpi, index_bond_forward, bond_forward, draw_tax, bonus_target, safest_swr_across_years, dynamic_option, target_withdrawal_percent, min_withdrawal_floor, flex_real_decrease, flex_real_increase, years_no_flex, spring_back, annuity_option, annuity_increase, annuity_price, annuity_tax_rate, cpi_change, annuity_percent_withdrawal, start_simulation_age, annuity_start_year, mortality_data_pull, ilb_spot_curve, data_direction, years_contributions, contribution, contribution_increase, years_between, yale_weighting, vanguard_decrease_floor, vanguard_increase_ceiling, vpw_data, net_other_income)
-                if result.simulation_fails < best_result_min['fail']:
-                    best_result_min = {'equity' : equity, 'fixed_income_bond' : fixed_income_bond, 'inflation_linked_bond' : inflation_linked_bond, 'fail' : result.simulation_fails, 'avg_value' : result.avg_end_value}
-                if result.simulation_fails < best_result_max['fail']:
-                    best_result_max = {'equity' : equity, 'fixed_income_bond' : fixed_income_bond, 'inflation_linked_bond' : inflation_linked_bond, 'fail' : result.simulation_fails, 'avg_value' : result.avg_end_value}
-                if result.simulation_fails == best_result_max['fail'] and result.avg_end_value > best_result_max['avg_value']:
-                    best_result_max = {'equity' : equity, 'fixed_income_bond' : fixed_income_bond, 'inflation_linked_bond' : inflation_linked_bond, 'fail' : result.simulation_fails, 'avg_value' : result.avg_end_value}
-
+                mixes.append((equity, fixed_income, 0))
             else:
-                for b in range(0, fixed_income + 1, 10):
-                    fixed_income_bond = b
-                    inflation_linked_bond = fixed_income - b
-                    result = RunSimulation(equity_real, bond_real, index_bond_real, [equity/100,0,0,fixed_income_bond/100, inflation_linked_bond/100], start_sum, withdrawal_amount, years, annual_withdrawal_inc, draw_adjust, cpi, index_bond_forward, bond_forward, draw_tax, bonus_target, safest_swr_across_years, dynamic_option, target_withdrawal_percent, min_withdrawal_floor, flex_real_decrease, flex_real_increase, years_no_flex, spring_back, annuity_option, annuity_increase, annuity_price, annuity_tax_rate, cpi_change, annuity_percent_withdrawal, start_simulation_age, annuity_start_year, mortality_data_pull, ilb_spot_curve, data_direction, years_contributions, contribution, contribution_increase, years_between, yale_weighting, vanguard_decrease_floor, vanguard_increase_ceiling, vpw_data, net_other_income)
-                    if result.simulation_fails < best_result_min['fail']:
-                        best_result_min = {'equity' : equity, 'fixed_income_bond' : fixed_income_bond, 'inflation_linked_bond' : inflation_linked_bond, 'fail' : result.simulation_fails, 'avg_value' : result.avg_end_value}
-                    if result.simulation_fails < best_result_max['fail']:
-                        best_result_max = {'equity' : equity, 'fixed_income_bond' : fixed_income_bond, 'inflation_linked_bond' : inflation_linked_bond, 'fail' : result.simulation_fails, 'avg_value' : result.avg_end_value}
-                    if result.simulation_fails == best_result_max['fail'] and result.avg_end_value > best_result_max['avg_value']:
-                        best_result_max = {'equity' : equity, 'fixed_income_bond' : fixed_income_bond, 'inflation_linked_bond' : inflation_linked_bond, 'fail' : result.simulation_fails, 'avg_value' : result.avg_end_value}
-            
-            self.optimised_equity_max = best_result_max['equity']
-            self.optimised_indexlinked_max = best_result_max['inflation_linked_bond']
-            self.optimised_fixedincome_max = best_result_max['fixed_income_bond']
-            self.optimised_failure_max = best_result_max['fail']
-            self.optimised_equity_min = best_result_min['equity']
-            self.optimised_indexlinked_min = best_result_min['inflation_linked_bond']
-            self.optimised_fixedincome_min = best_result_min['fixed_income_bond']
-            self.optimised_failure_min = best_result_min['fail']
-
-# Class is independent of other classes and calculates different analytical cuts of historic return data.  Serves the 'historics' view.
+                for fixed_income_bond in range(0, fixed_income + 1, grid_step):
+                    mixes.append((equity, fixed_income_bond, fixed_income - fixed_income_bond))
+        # (the starting portfolio is also on the grid - each mix is only run once)
+        mixes = list(dict.fromkeys(mixes))
+
+        series = {'equity_real': equity_real, 'bond_real': bond_real, 'index_bond_real': index_bond_real, 'cpi': cpi, 'index_bond_forward': index_bond_forward, 'bond_forward': bond_forward, 'cpi_change': cpi_change}
+        parameters = {'start_sum': start_sum, 'withdrawal_amount': withdrawal_amount, 'years': years, 'annual_withdrawal_inc': annual_withdrawal_inc, 'draw_adjust': draw_adjust, 'draw_tax': draw_tax, 'bonus_target': bonus_target, 'safest_swr_across_years': safest_swr_across_years, 'dynamic_option': dynamic_option, 'target_withdrawal_percent': target_withdrawal_percent, 'min_withdrawal_floor': min_withdrawal_floor, 'flex_real_decrease': flex_real_decrease, 'flex_real_increase': flex_real_increase, 'years_no_flex': years_no_flex, 'spring_back': spring_back, 'annuity_option_list': annuity_option, 'annuity_increase_list': annuity_increase, 'annuity_price_list': annuity_price, 'annuity_tax_rate_list': annuity_tax_rate, 'annuity_percent_withdrawal_list': annuity_percent_withdrawal, 'start_simulation_age': start_simulation_age, 'annuity_start_year_list': annuity_start_year, 'data_direction': data_direction, 'years_contributions': years_contributions, 'contribution': contribution, 'contribution_increase': contribution_increase, 'years_between': years_between, 'yale_weighting': yale_weighting, 'vanguard_decrease_floor': vanguard_decrease_floor, 'vanguard_increase_ceiling': vanguard_increase_ceiling, 'vpw_data': vpw_data, 'net_other_income': net_other_income, 'income_totals': surface}
+        results = RunAssetMixes(mixes, series, parameters, workers).results
+
+        # refinement rounds around the best mixes so far - only mixes not already run are run, in the order listed, and the round is cut short at the evaluation budget
+        if resolution is None: resolution = grid_step
+        step = grid_step
+        while step > resolution and (evaluation_budget is None or len(mixes) < evaluation_budget):
+            previous_step = step
+            step = max(resolution, step // 2)
+            cells = AssetMixRefinementCells(mixes, results).cells
+            evaluated = set(mixes)
+            refined_mixes = [mix for mix in dict.fromkeys(AssetMixRefinement(cells, step, previous_step, data_direction).mixes) if mix not in evaluated]
+            if evaluation_budget is not None: refined_mixes = refined_mixes[:evaluation_budget - len(mixes)]
+            mixes = mixes + refined_mixes
+            results = results + RunAssetMixes(refined_mixes, series, parameters, workers).results
+
+        optimised = SelectOptimisedAssetMixes(mixes, results)
+        best_result_max = optimised.best_result_max
+        best_result_min = optimised.best_result_min
+        self.evaluations = len(mixes)
+        # the allocation surface is every asset mix run (in the order run) as one row of the matrix
+        if surface:
+            self.surface = {'columns': ['equity', 'fixed_income_bond', 'inflation_linked_bond', 'fail', 'avg_end_value', 'median_income'], 'data': [list(mix) + list(result) for mix, result in zip(mixes, results)]}
+        else:
+            self.surface = None
+        self.optimised_equity_max = best_result_max['equity']
+        self.optimised_indexlinked_max = best_result_max['inflation_linked_bond']
+        self.optimised_fixedincome_max = best_result_max['fixed_income_bond']
+        self.optimised_failure_max = best_result_max['fail']
+        self.optimised_equity_min = best_result_min['equity']
+        self.optimised_indexlinked_min = best_result_min['inflation_linked_bond']
+        self.optimised_fixedincome_min = best_result_min['fixed_income_bond']
+        self.optimised_failure_min = best_result_min['fail']
+
+# Annualised return over every rolling 'period' year window along the last axis of a set of annual return series (window starts run to the last full window bar one, as the historic analysis has always used)
+class RollingAnnualisedReturns:
+    def __init__(self, returns, period):
+        growth = 1 + np.asarray(returns, dtype = float)
+        windows = np.lib.stride_tricks.sliding_window_view(growth, period, axis = -1)[..., :growth.shape[-1] - period, :]
+        self.result = (np.prod(windows, axis = -1) ** (1 / period)) - 1
+
+# Percentiles (0, 25th, 50th, 75th, 100th) and geometric average return of each row of a set of return series, taken in one axis-wise call each
+class ReturnSeriesSummary:
+    def __init__(self, returns):
+        returns = np.asarray(returns, dtype = float)
+        self.deciles = np.percentile(returns, range(0, 125, 25), axis = -1).T.tolist()
+        self.averages = ((np.prod(1 + returns, axis = -1) ** (1 / returns.shape[-1])) - 1).tolist()
+
+# Equity / bond / index-linked bond weights (percentage points) of the blends on the 'historics' risk/return frontier, from 100% equity down in 'step' point steps with the rest in bonds or, with index_bond set, with the rest split between bonds and index-linked bonds in 'step' point steps
+class FrontierBlendWeights:
+    def __init__(self, step, index_bond):
+        weights = []
+        for equity in range(100, -1, -step):
+            for index_bond_weight in (range(0, 100 - equity + 1, step) if index_bond else [0]):
+                weights.append([equity, 100 - equity - index_bond_weight, index_bond_weight])
+        self.weights = weights
+
+# Class is independent of other classes and calculates different analytical cuts of historic return data.  Serves the 'historics' view.  Each cut is worked out for all of its series at once as numpy arrays (rows of equity/bond blends, stacked asset series and rolling windows).
 class AnalyseHistoricData:
-    def __init__(self, equity, historic_bond, historic_index_bond, cpi, gbpusd, bond_coupon, index_bond_coupon, period, index_bond_forward, bond_forward, index_bond_forward_us, bond_forward_us):
-        
-        equity_nominal_1 = []
-        bond_nominal_1 = []
-        index_bond_nominal_1 = []
-        cpi_change_1 = []
-        equity_real_1 = []
-        bond_real_1 = []
-        index_bond_real_1 = [] 
-
-        equity_nominal_5 = []
-        bond_nominal_5 = []
-        index_bond_nominal_5 = []
-        cpi_change_5 = []
-        equity_real_5 = []
-        bond_real_5 = []
-        index_bond_real_5 = []
-        index_bond_forward_select = []
+    def __init__(self, equity, historic_bond, historic_index_bond, cpi, gbpusd, bond_coupon, index_bond_coupon, period, index_bond_forward, bond_forward, index_bond_forward_us, bond_forward_us, frontier_step = FRONTIER_STEP, frontier_windows = FRONTIER_WINDOWS, frontier_index_bond = False, forward_curves = None):
 
         # guessing this is for the forward looking bond market yields (code takes forward rates and constructs 5, 10, 20 and 30 year yields)
-        for a in range(len(index_bond_forward) - 13):
-            index_bond_forward_select.append(index_bond_forward[a + 3])
-        bond_forward_select = []
-        for a in range(len(bond_forward) - 13):
-            bond_forward_select.append(bond_forward[a + 3])
-        index_bond_forward_select_us = []
-        for a in range(len(index_bond_forward_us) - 13):
-            index_bond_forward_select_us.append(index_bond_forward_us[a + 3])
-        bond_forward_select_us = []
-        for a in range(len(bond_forward_us) - 13):
-            bond_forward_select_us.append(bond_forward_us[a + 3])
-
-        bond_gbp = [0, 0, 0, 0]
-        ilb_gbp = [0, 0, 0, 0]
-        bond_usd = [0, 0, 0, 0]
-        ilb_usd = [0, 0, 0, 0]
-        result = 1
-
-        y = [5, 10, 20, 30]
-        for a in range(len(y)):
-            for b in range(y[a]):
-                result = result * (1 + float(bond_forward[b]) / 100)
-            result = ((result ** (1 / y[a])) - 1) * 100
-            bond_gbp[a] = result
-            result = 1
-            for b in range(y[a]):
-                result = result * (1 + float(index_bond_forward[b]) / 100)
-            result = ((result ** (1 / y[a])) - 1) * 100
-            ilb_gbp[a] = result
-            result = 1
-            for b in range(y[a]):
-                result = result * (1 + float(bond_forward_us[b]) / 100)
-            result = ((result ** (1 / y[a])) - 1) * 100
-            bond_usd[a] = result
-            result = 1
-            for b in range(y[a]):
-                result = result * (1 + float(index_bond_forward_us[b]) / 100)
-            result = ((result ** (1 / y[a])) - 1) * 100
-            ilb_usd[a] = result
-            result = 1
-
-        five = [bond_gbp[0], ilb_gbp[0], bond_usd[0], ilb_usd[0]]
-        ten = [bond_gbp[1], ilb_gbp[1], bond_usd[1], ilb_usd[1]]
-        twenty = [bond_gbp[2], ilb_gbp[2], bond_usd[2], ilb_usd[2]]
-        thirty = [bond_gbp[3], ilb_gbp[3], bond_usd[3], ilb_usd[3]]
-
-        forward_chart_labels = []
-        for a in range(len(index_bond_forward_select)):
-            forward_chart_labels.append(a + 3)
+        index_bond_forward_select = list(index_bond_forward[3:len(index_bond_forward) - 10])
+        bond_forward_select = list(bond_forward[3:len(bond_forward) - 10])
+        index_bond_forward_select_us = list(index_bond_forward_us[3:len(index_bond_forward_us) - 10])
+        bond_forward_select_us = list(bond_forward_us[3:len(bond_forward_us) - 10])
+
+        # the yields are the spot rates of the GBP bond, GBP index bond, USD bond and USD index bond forward curves (given already built from the shared forward curves, see GetForwardCurves)
+        if forward_curves is None: forward_curves = ForwardCurves({'gbp_index_bond_forward': index_bond_forward, 'gbp_bond_forward': bond_forward, 'usd_index_bond_forward': index_bond_forward_us, 'usd_bond_forward': bond_forward_us})
+        spot_curves = np.array([forward_curves.curves[key].spot[:30] for key in [('GBP', 'bond'), ('GBP', 'index_bond'), ('USD', 'bond'), ('USD', 'index_bond')]])
+        five, ten, twenty, thirty = [(spot_curves[:, y - 1] * 100).tolist() for y in [5, 10, 20, 30]]
+
+        forward_chart_labels = list(range(3, 3 + len(index_bond_forward_select)))
 
         # below calculates lists of historic returns
-        for a in range(len(equity) - 1):
-            num = float(equity[a + 1]) / float(gbpusd [a + 1])
-            denom = float(equity[a]) / float(gbpusd [a])
-            change = ((num / denom) - 1)
-            equity_nominal_1.append(change)
-        for a in range(len(historic_bond) - 1):
-            num = PresentValue(float(historic_bond[a + 1]) / 100, 10, bond_coupon, 100).pv
-            denom = PresentValue(float(historic_bond[a]) / 100, 10, bond_coupon, 100).pv
-            change = ((num / denom) - 1) + (float(historic_bond[a]) / 100)
-            bond_nominal_1.append(change)
-        for a in range(len(historic_index_bond) - 1):
-            num = PresentValue(float(historic_index_bond[a + 1]) / 100, 10, index_bond_coupon, 100).pv
-            denom = PresentValue(float(historic_index_bond[a]) / 100, 10, index_bond_coupon, 100).pv
-            num_cpi = float(cpi[a + 1])
-            denom_cpi = float(cpi[a])
-            change = ((num / denom) - 1) + (float(historic_index_bond[a]) / 100) + ((num_cpi / denom_cpi) - 1)
-            index_bond_nominal_1.append(change)    
-        for a in range(len(cpi) - 1):
-            num_cpi = float(cpi[a + 1])
-            denom_cpi = float(cpi[a])
-            change = ((num_cpi / denom_cpi) - 1)
-            cpi_change_1.append(change)
-        for a in range(len(equity) - 1):
-            num = float(equity[a + 1]) / float(gbpusd [a + 1])
-            denom = float(equity[a]) / float(gbpusd [a])
-            num_cpi = float(cpi[a + 1])
-            denom_cpi = float(cpi[a])            
-            change = ((num / denom) - 1) - ((num_cpi / denom_cpi) - 1)
-            equity_real_1.append(change)
-        for a in range(len(historic_bond) - 1):
-            num = PresentValue(float(historic_bond[a + 1]) / 100, 10, bond_coupon, 100).pv
-            denom = PresentValue(float(historic_bond[a]) / 100, 10, bond_coupon, 100).pv
-            num_cpi = float(cpi[a + 1])
-            denom_cpi = float(cpi[a]) 
-            change = ((num / denom) - 1) + (float(historic_bond[a]) / 100) - ((num_cpi / denom_cpi) - 1)
-            bond_real_1.append(change)
-        for a in range(len(historic_index_bond) - 1):
-            num = PresentValue(float(historic_index_bond[a + 1]) / 100, 10, index_bond_coupon, 100).pv
-            denom = PresentValue(float(historic_index_bond[a]) / 100, 10, index_bond_coupon, 100).pv
-            change = ((num / denom) - 1) + (float(historic_index_bond[a]) / 100)
-            index_bond_real_1.append(change)
-
-        # below is for avg return / variance analysis
-        equity100nominal = []
-        equity80nominal = []
-        equity60nominal = []
-        equity40nominal = []
-        equity20nominal = []
-        equity0nominal = []
-        equity100real = []
-        equity90real = []
-        equity80real = []
-        equity70real = []
-        equity60real = []
-        equity50real = []
-        equity40real = []
-        equity30real = []
-        equity20real = []
-        equity10real = []
-        equity0real = []
-        
-        for a in range(len(equity_nominal_1)):
-            equity100nominal.append(equity_nominal_1[a] * 1 + bond_nominal_1[a] * 0)
-            equity80nominal.append(equity_nominal_1[a] * 0.8 + bond_nominal_1[a] * 0.2)
-            equity60nominal.append(equity_nominal_1[a] * 0.6 + bond_nominal_1[a] * 0.4)
-            equity40nominal.append(equity_nominal_1[a] * 0.4 + bond_nominal_1[a] * 0.6)
-            equity20nominal.append(equity_nominal_1[a] * 0.2 + bond_nominal_1[a] * 0.8)
-            equity0nominal.append(equity_nominal_1[a] * 0 + bond_nominal_1[a] * 1)
-            equity100real.append(equity_real_1[a] * 1 + bond_real_1[a] * 0)
-            equity90real.append(equity_real_1[a] * 0.9 + bond_real_1[a] * 0.1)
-            equity80real.append(equity_real_1[a] * 0.8 + bond_real_1[a] * 0.2)
-            equity70real.append(equity_real_1[a] * 0.7 + bond_real_1[a] * 0.3)
-            equity60real.append(equity_real_1[a] * 0.6 + bond_real_1[a] * 0.4)
-            equity50real.append(equity_real_1[a] * 0.5 + bond_real_1[a] * 0.5)
-            equity40real.append(equity_real_1[a] * 0.4 + bond_real_1[a] * 0.6)
-            equity30real.append(equity_real_1[a] * 0.3 + bond_real_1[a] * 0.7)
-            equity20real.append(equity_real_1[a] * 0.2 + bond_real_1[a] * 0.8)
-            equity10real.append(equity_real_1[a] * 0.1 + bond_real_1[a] * 0.9)
-            equity0real.append(equity_real_1[a] * 0 + bond_real_1[a] * 1)
-
-        p = 3
-        equity100real_three, equity90real_three, equity80real_three, equity70real_three, equity60real_three, equity50real_three, equity40real_three, equity30real_three, equity20real_three, equity10real_three, equity0real_three  = [], [], [], [], [], [], [], [], [], [], []
-        start100, start90, start80, start70, start60, start50, start40, start30, start20, start10, start0 = 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1
-        for a in range(len(equity100nominal) - p):
-            for b in range(p):
-                start100 = start100 * (1 + equity100real[a + b])
-                start90 = start90 * (1 + equity90real[a + b])
-                start80 = start80 * (1 + equity80real[a + b])
-                start70 = start70 * (1 + equity70real[a + b])
-                start60 = start60 * (1 + equity60real[a + b])
-                start50 = start50 * (1 + equity50real[a + b])
-                start40 = start40 * (1 + equity40real[a + b])
-                start30 = start30 * (1 + equity30real[a + b])
-                start20 = start20 * (1 + equity20real[a + b])
-                start10 = start10 * (1 + equity10real[a + b])
-                start0 = start0 * (1 + equity0real[a + b])
-            equity100real_three.append((start100 ** (1 / p)) - 1)
-            equity90real_three.append((start90 ** (1 / p)) - 1)
-            equity80real_three.append((start80 ** (1 / p)) - 1)
-            equity70real_three.append((start70 ** (1 / p)) - 1)
-            equity60real_three.append((start60 ** (1 / p)) - 1)
-            equity50real_three.append((start50 ** (1 / p)) - 1)
-            equity40real_three.append((start40 ** (1 / p)) - 1)
-            equity30real_three.append((start30 ** (1 / p)) - 1)
-            equity20real_three.append((start20 ** (1 / p)) - 1)
-            equity10real_three.append((start10 ** (1 / p)) - 1)
-            equity0real_three.append((start0 ** (1 / p)) - 1)
-            start100, start90, start80, start70, start60, start50, start40, start30, start20, start10, start0 = 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1
-
-        p = 10
-        equity100real_ten, equity90real_ten, equity80real_ten, equity70real_ten, equity60real_ten, equity50real_ten, equity40real_ten, equity30real_ten, equity20real_ten, equity10real_ten, equity0real_ten  = [], [], [], [], [], [], [], [], [], [], []
-        start100, start90, start80, start70, start60, start50, start40, start30, start20, start10, start0 = 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1
-        for a in range(len(equity100nominal) - p):
-            for b in range(p):
-                start100 = start100 * (1 + equity100real[a + b])
-                start90 = start90 * (1 + equity90real[a + b])
-                start80 = start80 * (1 + equity80real[a + b])
-                start70 = start70 * (1 + equity70real[a + b])
-                start60 = start60 * (1 + equity60real[a + b])
-                start50 = start50 * (1 + equity50real[a + b])
-                start40 = start40 * (1 + equity40real[a + b])
-                start30 = start30 * (1 + equity30real[a + b])
-                start20 = start20 * (1 + equity20real[a + b])
-                start10 = start10 * (1 + equity10real[a + b])
-                start0 = start0 * (1 + equity0real[a + b])
-            equity100real_ten.append((start100 ** (1 / p)) - 1)
-            equity90real_ten.append((start90 ** (1 / p)) - 1)
-            equity80real_ten.append((start80 ** (1 / p)) - 1)
-            equity70real_ten.append((start70 ** (1 / p)) - 1)
-            equity60real_ten.append((start60 ** (1 / p)) - 1)
-            equity50real_ten.append((start50 ** (1 / p)) - 1)
-            equity40real_ten.append((start40 ** (1 / p)) - 1)
-            equity30real_ten.append((start30 ** (1 / p)) - 1)
-            equity20real_ten.append((start20 ** (1 / p)) - 1)
-            equity10real_ten.append((start10 ** (1 / p)) - 1)
-            equity0real_ten.append((start0 ** (1 / p)) - 1)
-            start100, start90, start80, start70, start60, start50, start40, start30, start20, start10, start0 = 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1
-
-        p = 20
-        equity100real_twenty, equity90real_twenty, equity80real_twenty, equity70real_twenty, equity60real_twenty, equity50real_twenty, equity40real_twenty, equity30real_twenty, equity20real_twenty, equity10real_twenty, equity0real_twenty  = [], [], [], [], [], [], [], [], [], [], []
-        start100, start90, start80, start70, start60, start50, start40, start30, start20, start10, start0 = 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1
-        for a in range(len(equity100nominal) - p):
-            for b in range(p):
-                start100 = start100 * (1 + equity100real[a + b])
-                start90 = start90 * (1 + equity90real[a + b])
-                start80 = start80 * (1 + equity80real[a + b])
-                start70 = start70 * (1 + equity70real[a + b])
-                start60 = start60 * (1 + equity60real[a + b])
-                start50 = start50 * (1 + equity50real[a + b])
-                start40 = start40 * (1 + equity40real[a + b])
-                start30 = start30 * (1 + equity30real[a + b])
-                start20 = start20 * (1 + equity20real[a + b])
-                start10 = start10 * (1 + equity10real[a + b])
-                start0 = start0 * (1 + equity0real[a + b])
-            equity100real_twenty.append((start100 ** (1 / p)) - 1)
-            equity90real_twenty.append((start90 ** (1 / p)) - 1)
-            equity80real_twenty.append((start80 ** (1 / p)) - 1)
-            equity70real_twenty.append((start70 ** (1 / p)) - 1)
-            equity60real_twenty.append((start60 ** (1 / p)) - 1)
-            equity50real_twenty.append((start50 ** (1 / p)) - 1)
-            equity40real_twenty.append((start40 ** (1 / p)) - 1)
-            equity30real_twenty.append((start30 ** (1 / p)) - 1)
-            equity20real_twenty.append((start20 ** (1 / p)) - 1)
-            equity10real_twenty.append((start10 ** (1 / p)) - 1)
-            equity0real_twenty.append((start0 ** (1 / p)) - 1)
-            start100, start90, start80, start70, start60, start50, start40, start30, start20, start10, start0 = 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1
-
-        self.returnvariance = {
-        'one' : [
-            {'x': np.std(equity100real_three) * 100, 'y': np.mean(equity100real_three) * 100},
-            {'x': np.std(equity90real_three) * 100, 'y': np.mean(equity90real_three) * 100},
-            {'x': np.std(equity80real_three) * 100, 'y': np.mean(equity80real_three) * 100},
-            {'x': np.std(equity70real_three) * 100, 'y': np.mean(equity70real_three) * 100},
-            {'x': np.std(equity60real_three) * 100, 'y': np.mean(equity60real_three) * 100},
-            {'x': np.std(equity50real_three) * 100, 'y': np.mean(equity50real_three) * 100},
-            {'x': np.std(equity40real_three) * 100, 'y': np.mean(equity40real_three) * 100},
-            {'x': np.std(equity30real_three) * 100, 'y': np.mean(equity30real_three) * 100},
-            {'x': np.std(equity20real_three) * 100, 'y': np.mean(equity20real_three) * 100},
-            {'x': np.std(equity10real_three) * 100, 'y': np.mean(equity10real_three) * 100},
-            {'x': np.std(equity0real_three) * 100, 'y': np.mean(equity0real_three) * 100},
-        ],           
-        'ten' : [
-            {'x': np.std(equity100real_ten) * 100, 'y': np.mean(equity100real_ten) * 100},
-            {'x': np.std(equity90real_ten) * 100, 'y': np.mean(equity90real_ten) * 100},
-            {'x': np.std(equity80real_ten) * 100, 'y': np.mean(equity80real_ten) * 100},
-            {'x': np.std(equity70real_ten) * 100, 'y': np.mean(equity70real_ten) * 100},
-            {'x': np.std(equity60real_ten) * 100, 'y': np.mean(equity60real_ten) * 100},
-            {'x': np.std(equity50real_ten) * 100, 'y': np.mean(equity50real_ten) * 100},
-            {'x': np.std(equity40real_ten) * 100, 'y': np.mean(equity40real_ten) * 100},
-            {'x': np.std(equity30real_ten) * 100, 'y': np.mean(equity30real_ten) * 100},
-            {'x': np.std(equity20real_ten) * 100, 'y': np.mean(equity20real_ten) * 100},
-            {'x': np.std(equity10real_ten) * 100, 'y': np.mean(equity10real_ten) * 100},
-            {'x': np.std(equity0real_ten) * 100, 'y': np.mean(equity0real_ten) * 100},
-        ],
-        'twenty' : [
-            {'x': np.std(equity100real_twenty) * 100, 'y': np.mean(equity100real_twenty) * 100},
-            {'x': np.std(equity90real_twenty) * 100, 'y': np.mean(equity90real_twenty) * 100},
-            {'x': np.std(equity80real_twenty) * 100, 'y': np.mean(equity80real_twenty) * 100},
-            {'x': np.std(equity70real_twenty) * 100, 'y': np.mean(equity70real_twenty) * 100},
-            {'x': np.std(equity60real_twenty) * 100, 'y': np.mean(equity60real_twenty) * 100},
-            {'x': np.std(equity50real_twenty) * 100, 'y': np.mean(equity50real_twenty) * 100},
-            {'x': np.std(equity40real_twenty) * 100, 'y': np.mean(equity40real_twenty) * 100},
-            {'x': np.std(equity30real_twenty) * 100, 'y': np.mean(equity30real_twenty) * 100},
-            {'x': np.std(equity20real_twenty) * 100, 'y': np.mean(equity20real_twenty) * 100},
-            {'x': np.std(equity10real_twenty) * 100, 'y': np.mean(equity10real_twenty) * 100},
-            {'x': np.std(equity0real_twenty) * 100, 'y': np.mean(equity0real_twenty) * 100},
-        ],
-        }
+        equity = np.asarray(equity, dtype = float) / np.asarray(gbpusd, dtype = float)
+        historic_bond = np.asarray(historic_bond, dtype = float) / 100
+        historic_index_bond = np.asarray(historic_index_bond, dtype = float) / 100
+        cpi = np.asarray(cpi, dtype = float)
+        bond_price = PresentValue(historic_bond, 10, bond_coupon, 100).pv
+        index_bond_price = PresentValue(historic_index_bond, 10, index_bond_coupon, 100).pv
+        cpi_change_1 = (cpi[1:] / cpi[:-1]) - 1
+        equity_nominal_1 = (equity[1:] / equity[:-1]) - 1
+        bond_nominal_1 = ((bond_price[1:] / bond_price[:-1]) - 1) + historic_bond[:-1]
+        index_bond_real_1 = ((index_bond_price[1:] / index_bond_price[:-1]) - 1) + historic_index_bond[:-1]
+        index_bond_nominal_1 = index_bond_real_1 + cpi_change_1
+        equity_real_1 = equity_nominal_1 - cpi_change_1
+        bond_real_1 = bond_nominal_1 - cpi_change_1
+
+        # below is for avg return / variance analysis (rows of real_blends are the yearly real returns of each frontier blend, one matrix product of the blend weights with the asset returns)
+        blend_weights = FrontierBlendWeights(frontier_step, frontier_index_bond).weights
+        real_blends = (np.array(blend_weights) / 100) @ np.array([equity_real_1, bond_real_1, index_bond_real_1])
+        self.returnvariance = {}
+        for p in frontier_windows:
+            blend_returns = RollingAnnualisedReturns(real_blends, p).result
+            self.returnvariance[FRONTIER_WINDOW_KEYS.get(p, str(p))] = [{'x': x, 'y': y} for x, y in zip((np.std(blend_returns, axis = 1) * 100).tolist(), (np.mean(blend_returns, axis = 1) * 100).tolist())]
+        self.returnvariance_blends = blend_weights
 
         # this is the historic index chart
-        equity_chart = [1]
-        bond_chart = [1]
-        equity_index_running = 1
-        bond_index_running = 1
-        for a in range(len(equity_real_1)):
-            equity_index_running = equity_index_running * (1 + equity_real_1[a])
-            equity_chart.append(equity_index_running)
-        for a in range(len(bond_real_1)):
-            bond_index_running = bond_index_running * (1 + bond_real_1[a])
-            bond_chart.append(bond_index_running)        
+        equity_chart = [1] + np.cumprod(1 + equity_real_1).tolist()
+        bond_chart = [1] + np.cumprod(1 + bond_real_1).tolist()
 
+        # rows are equity nominal, bond nominal, index bond nominal, cpi change, equity real, bond real and index bond real returns
+        returns_1 = np.array([equity_nominal_1, bond_nominal_1, index_bond_nominal_1, cpi_change_1, equity_real_1, bond_real_1, index_bond_real_1])
 
         # this is working out the 5/10/15/20/25 year rolling returns (as given by period)
-        start = 1
-        for a in range(len(equity_nominal_1) - period):
-            for b in range(period):       
-                start = start * (1 + equity_nominal_1[a + b])
-            equity_nominal_5.append((start ** (1 / period)) - 1)
-            start = 1
-
-        start = 1
-        for a in range(len(bond_nominal_1) - period):
-            for b in range(period):       
-                start = start * (1 + bond_nominal_1[a + b])
-            bond_nominal_5.append((start ** (1 / period)) - 1)
-            start = 1
-
-        start = 1
-        for a in range(len(index_bond_nominal_1) - period):
-            for b in range(period):       
-                start = start * (1 + index_bond_nominal_1[a + b])
-            index_bond_nominal_5.append((start ** (1 / period)) - 1)
-            start = 1
-
-        start = 1
-        for a in range(len(cpi_change_1) - period):
-            for b in range(period):       
-                start = start * (1 + cpi_change_1[a + b])
-            cpi_change_5.append((start ** (1 / period)) - 1)
-            start = 1
-
-        start = 1
-        for a in range(len(equity_real_1) - period):
-            for b in range(period):       
-                start = start * (1 + equity_real_1[a + b])
-            equity_real_5.append((start ** (1 / period)) - 1)
-            start = 1
-
-        start = 1
-        for a in range(len(bond_real_1) - period):
-            for b in range(period):       
-                start = start * (1 + bond_real_1[a + b])
-            bond_real_5.append((start ** (1 / period)) - 1)
-            start = 1
-
-        start = 1
-        for a in range(len(index_bond_real_1) - period):
-            for b in range(period):       
-                start = start * (1 + index_bond_real_1[a + b])
-            index_bond_real_5.append((start ** (1 / period)) - 1)
-            start = 1   
-
-        start = 1   
-        for a in (equity_nominal_1):
-            start = start * (1 + a)
-        avg_equity_nominal_1 = start ** (1 / len(equity_nominal_1)) - 1
-        start = 1   
-        for a in (bond_nominal_1):
-            start = start * (1 + a)
-        avg_bond_nominal_1 = start ** (1 / len(bond_nominal_1)) - 1
-        start = 1   
-        for a in (index_bond_nominal_1):
-            start = start * (1 + a)
-        avg_index_bond_nominal_1 = start ** (1 / len(index_bond_nominal_1)) - 1
-        start = 1   
-        for a in (cpi_change_1):
-            start = start * (1 + a)
-        avg_cpi_change_1 = start ** (1 / len(cpi_change_1)) - 1
-        start = 1   
-        for a in (equity_real_1):
-            start = start * (1 + a)
-        avg_equity_real_1 = start ** (1 / len(equity_real_1)) - 1
-        start = 1   
-        for a in (bond_real_1):
-            start = start * (1 + a)
-        avg_bond_real_1 = start ** (1 / len(bond_real_1)) - 1
-        start = 1   
-        for a in (index_bond_real_1):
-            start = start * (1 + a)
-        avg_index_bond_real_1 = start ** (1 / len(index_bond_real_1)) - 1
- 
-        start = 1   
-        for a in (equity_nominal_5):
-            start = start * (1 + a)
-        avg_equity_nominal_5 = start ** (1 / len(equity_nominal_5)) - 1
-        start = 1   
-        for a in (bond_nominal_5):
-            start = start * (1 + a)
-        avg_bond_nominal_5 = start ** (1 / len(bond_nominal_5)) - 1
-        start = 1   
-        for a in (index_bond_nominal_5):
-            start = start * (1 + a)
-        avg_index_bond_nominal_5 = start ** (1 / len(index_bond_nominal_5)) - 1
-        start = 1   
-        for a in (cpi_change_5):
-            start = start * (1 + a)
-        avg_cpi_change_5 = start ** (1 / len(cpi_change_5)) - 1
-        start = 1   
-        for a in (equity_real_5):
-            start = start * (1 + a)
-        avg_equity_real_5 = start ** (1 / len(equity_real_5)) - 1
-        start = 1   
-        for a in (bond_real_5):
-            start = start * (1 + a)
-        avg_bond_real_5 = start ** (1 / len(bond_real_5)) - 1
-        start = 1   
-        for a in (index_bond_real_5):
-            start = start * (1 + a)
-        avg_index_bond_real_5 = start ** (1 / len(index_bond_real_5)) - 1
+        returns_5 = RollingAnnualisedReturns(returns_1, period).result
 
         # lastly the rolling returns are put into precentiles (0, 25th, 50th, 75th, 100th)
-        self.deciles_equity_nominal_1 = [np.percentile(equity_nominal_1, i) for i in range(0, 125, 25)]
-        self.deciles_bond_nominal_1 = [np.percentile(bond_nominal_1, i) for i in range(0, 125, 25)]
-        self.deciles_index_bond_nominal_1 = [np.percentile(index_bond_nominal_1, i) for i in range(0, 125, 25)]
-        self.deciles_cpi_change_1 = [np.percentile(cpi_change_1, i) for i in range(0, 125, 25)]
-        self.avg_equity_nominal_1 = avg_equity_nominal_1
-        self.avg_bond_nominal_1 = avg_bond_nominal_1
-        self.avg_index_bond_nominal_1 = avg_index_bond_nominal_1
-        self.avg_cpi_change_1 = avg_cpi_change_1
-        self.deciles_equity_real_1 = [np.percentile(equity_real_1, i) for i in range(0, 125, 25)]
-        self.deciles_bond_real_1 = [np.percentile(bond_real_1, i) for i in range(0, 125, 25)]
-        self.deciles_index_bond_real_1 = [np.percentile(index_bond_real_1, i) for i in range(0, 125, 25)]
-        self.avg_equity_real_1 = avg_equity_real_1
-        self.avg_bond_real_1 = avg_bond_real_1
-        self.avg_index_bond_real_1 = avg_index_bond_real_1
-
-        self.deciles_equity_nominal_5 = [np.percentile(equity_nominal_5, i) for i in range(0, 125, 25)]
-        self.deciles_bond_nominal_5 = [np.percentile(bond_nominal_5, i) for i in range(0, 125, 25)]
-        self.deciles_index_bond_nominal_5 = [np.percentile(index_bond_nominal_5, i) for i in range(0, 125, 25)]
-        self.deciles_cpi_change_5 = [np.percentile(cpi_change_5, i) for i in range(0, 125, 25)]
-        self.avg_equity_nominal_5 = avg_equity_nominal_5
-        self.avg_bond_nominal_5 = avg_bond_nominal_5
-        self.avg_index_bond_nominal_5 = avg_index_bond_nominal_5
-        self.avg_cpi_change_5 = avg_cpi_change_5
-        self.deciles_equity_real_5 = [np.percentile(equity_real_5, i) for i in range(0, 125, 25)]
-        self.deciles_bond_real_5 = [np.percentile(bond_real_5, i) for i in range(0, 125, 25)]
-        self.deciles_index_bond_real_5 = [np.percentile(index_bond_real_5, i) for i in range(0, 125, 25)]
-        self.avg_equity_real_5 = avg_equity_real_5
-        self.avg_bond_real_5 = avg_bond_real_5
-        self.avg_index_bond_real_5 = avg_index_bond_real_5
+        summary_1 = ReturnSeriesSummary(returns_1)
+        summary_5 = ReturnSeriesSummary(returns_5)
+        self.deciles_equity_nominal_1, self.deciles_bond_nominal_1, self.deciles_index_bond_nominal_1, self.deciles_cpi_change_1, self.deciles_equity_real_1, self.deciles_bond_real_1, self.deciles_index_bond_real_1 = summary_1.deciles
+        self.avg_equity_nominal_1, self.avg_bond_nominal_1, self.avg_index_bond_nominal_1, self.avg_cpi_change_1, self.avg_equity_real_1, self.avg_bond_real_1, self.avg_index_bond_real_1 = summary_1.averages
+        self.deciles_equity_nominal_5, self.deciles_bond_nominal_5, self.deciles_index_bond_nominal_5, self.deciles_cpi_change_5, self.deciles_equity_real_5, self.deciles_bond_real_5, self.deciles_index_bond_real_5 = summary_5.deciles
+        self.avg_equity_nominal_5, self.avg_bond_nominal_5, self.avg_index_bond_nominal_5, self.avg_cpi_change_5, self.avg_equity_real_5, self.avg_bond_real_5, self.avg_index_bond_real_5 = summary_5.averages
 
         self.index_bond_forward_select = index_bond_forward_select
         self.bond_forward_select = bond_forward_select
@@ -2080,3 +1705,80 @@ class AnalyseHistoricData:
         self.equity_chart = equity_chart
         self.bond_chart = bond_chart
 
+# Runs the 'historics' analysis of the static datafiles for one request configuration, i.e. AnalyseHistoricData along with the years and forward dataset update date shown with it
+class HistoricsAnalysis:
+    def __init__(self, historic_columns, forward_columns, forward_data_set_id, currency_set, geographic_set, start_year, end_year, period, bond_coupon, index_bond_coupon, frontier_step, frontier_windows, frontier_index_bond):
+        historic_data_set = LoadHistoricData(historic_columns, start_year, end_year, currency_set, geographic_set)
+        forward_data = RetrieveForwardData(forward_columns)
+        forward_curves = GetForwardCurves(forward_data_set_id, {'gbp_index_bond_forward': forward_data.gbp_index_bond_forward, 'gbp_bond_forward': forward_data.gbp_bond_forward, 'usd_index_bond_forward': forward_data.usd_index_bond_forward, 'usd_bond_forward': forward_data.usd_bond_forward, 'update_date': forward_data.update_date}).forward_curves
+        forward_data_set = LoadForwardData(forward_columns, 'GBP')
+        forward_data_set_us = LoadForwardData(forward_columns, 'USD')
+        self.analysis = AnalyseHistoricData(historic_data_set.historic_equity, historic_data_set.historic_bond, historic_data_set.historic_index_bond, historic_data_set.historic_cpi, historic_data_set.historic_fx, bond_coupon, index_bond_coupon, period, forward_data_set.forward_index_bond, forward_data_set.forward_bond, forward_data_set_us.forward_index_bond, forward_data_set_us.forward_bond, frontier_step, list(frontier_windows), frontier_index_bond, forward_curves)
+        self.years = historic_data_set.years[1:]
+        self.update_date = forward_data_set.update_date
+        # approximate memory held (fixed series / charts plus the frontier points, each a python dict of two floats, and blend weights), used to size-cap historics_cache
+        self.nbytes = 32 * 1024 + 256 * len(self.analysis.returnvariance_blends) * len(self.analysis.returnvariance) + 128 * len(self.analysis.returnvariance_blends)
+
+# Identifies the version of the static datafiles the 'historics' analysis is run on, i.e. the historic datafile content hash and the forward dataset update date
+class HistoricsDataVersion:
+    def __init__(self):
+        historic_registry = DataSetRegistry('staticfiles/historic_dataset.csv')
+        forward_registry = DataSetRegistry('staticfiles/forward_dataset.csv')
+        self.historic_columns = historic_registry.columns
+        self.forward_columns = forward_registry.columns
+        self.forward_data_set_id = forward_registry.content_hash
+        self.key = (historic_registry.content_hash, float(forward_registry.columns['update_date'][0]))
+
+# Returns the 'historics' analysis for a configuration (currency set, geographic set, start year, end year, period, bond coupon, index bond coupon, frontier step, frontier windows (tuple), frontier index bond) from historics_cache, running HistoricsAnalysis on a miss
+class CachedHistoricsAnalysis:
+    def __init__(self, version, configuration):
+        key = version.key + configuration
+        historics = historics_cache.get(key)
+        if historics is None:
+            historics = HistoricsAnalysis(version.historic_columns, version.forward_columns, version.forward_data_set_id, *configuration)
+            historics_cache.put(key, historics, historics.nbytes)
+        self.historics = historics
+
+# Precomputes the 'historics' analyses for the current version of the datafiles: the HISTORICS_WARM_CONFIGURATIONS defaults and the most requested configurations so far (so these are re-warmed when the datafiles change).  Each version is only warmed once per worker process.  Runs in the background on the first 'historics' request of each version and can also be run at worker start.
+class WarmHistoricsCache:
+    warmed_versions = set()
+    lock = threading.Lock()
+
+    def __init__(self):
+        version = HistoricsDataVersion()
+        self.configurations = []
+        with WarmHistoricsCache.lock:
+            if version.key in WarmHistoricsCache.warmed_versions: return
+            WarmHistoricsCache.warmed_versions.add(version.key)
+        data_object = AddDefaultData({}).data_object
+        years = version.historic_columns['Year'].tolist()
+        configurations = [(currency_set, geographic_set, years[0], years[-1], period, data_object['bond_coupon'] / 100, data_object['index_bond_coupon'] / 100, FRONTIER_STEP, tuple(FRONTIER_WINDOWS), False) for currency_set, geographic_set, period in HISTORICS_WARM_CONFIGURATIONS]
+        with GetHistoricsAnalysis.lock:
+            most_requested = GetHistoricsAnalysis.request_counts.most_common(HISTORICS_WARM_MOST_REQUESTED)
+        for configuration in configurations + [configuration for configuration, count in most_requested]:
+            if configuration in self.configurations: continue
+            # configurations requested against an earlier version may not fit the current datafiles (e.g. date range)
+            try:
+                CachedHistoricsAnalysis(version, configuration)
+            except (ValueError, IndexError):
+                continue
+            self.configurations.append(configuration)
+
+# Returns the 'historics' analysis for a request (see CachedHistoricsAnalysis) and counts requests per configuration for WarmHistoricsCache (at most HISTORICS_REQUEST_COUNTS_MAX configurations are counted).  Starts warming the cache in the background the first time a version of the datafiles is seen.
+class GetHistoricsAnalysis:
+    request_counts = collections.Counter()
+    lock = threading.Lock()
+
+    def __init__(self, currency_set, geographic_set, start_year, end_year, period, bond_coupon, index_bond_coupon, frontier_step = FRONTIER_STEP, frontier_windows = FRONTIER_WINDOWS, frontier_index_bond = False):
+        version = HistoricsDataVersion()
+        configuration = (currency_set, geographic_set, start_year, end_year, period, bond_coupon, index_bond_coupon, frontier_step, tuple(frontier_windows), frontier_index_bond)
+        if version.key not in WarmHistoricsCache.warmed_versions:
+            threading.Thread(target = WarmHistoricsCache, daemon = True).start()
+        self.historics = CachedHistoricsAnalysis(version, configuration).historics
+        with GetHistoricsAnalysis.lock:
+            request_counts = GetHistoricsAnalysis.request_counts
+            request_counts[configuration] += 1
+            if len(request_counts) > HISTORICS_REQUEST_COUNTS_MAX:
+                most_requested = request_counts.most_common(HISTORICS_REQUEST_COUNTS_MAX // 2)
+                request_counts.clear()
+                request_counts.update({counted: count // 2 for counted, count in most_requested if count // 2 > 0})
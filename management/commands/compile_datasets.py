@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from ... classes import STATIC_DATA_SET_FILES, CompileDataSet
+
+# Compiles the static csv datafiles into their memory-mappable columnar form (see CompileDataSet).  Run after the csv files in staticfiles are updated, e.g. 'python manage.py compile_datasets'.
+class Command(BaseCommand):
+    help = 'Compiles the static csv datafiles into memory-mappable column files'
+
+    def handle(self, *args, **options):
+        for file_path in STATIC_DATA_SET_FILES:
+            compiled = CompileDataSet(file_path)
+            self.stdout.write(file_path + ' -> ' + compiled.directory + ' (' + str(len(compiled.columns)) + ' columns, ' + compiled.content_hash[:12] + ')')
@@ -3,8 +3,7 @@ from rest_framework.decorators import api_view
 from rest_framework.serializers import Serializer
 from rest_framework import status
 import json
-import pandas as pd
-from . classes import GetVPWData, AddDefaultData, LoadHistoricData, PrepareHistoricDataSet, RetrieveHistoricData, RetrieveForwardData, RetrieveMortalityData, LoadForwardData, PrepareForwardDataSet, PrepareReturnData, RunSimulation, AnalyseHistoricData, OptimiseAssetMix, CalcMaxBacktestedSWRs, PrepareMortalityDataSet, CalcSafeFundingLevel
+from . classes import DATA_SET_ID_KEYS, SIMULATION_BATCH_MAX_VARIANTS, FRONTIER_STEP, FRONTIER_WINDOWS, FRONTIER_MAX_WINDOWS, FRONTIER_MAX_WINDOW, DefaultDataSets, validated_data_set_cache, GetPreparedReturnData, GetForwardCurves, GetVPWData, AddDefaultData, PrepareHistoricDataSet, PrepareForwardDataSet, RunSimulation, GetHistoricsAnalysis, OptimiseAssetMix, RunSimulationScenarios, CalcMaxBacktestedSWRs, PrepareMortalityDataSet, CalcSafeFundingLevel
 from . serializers import UserSerializer, HistoricDataAnalysisSerializer
 from django.http import HttpResponse, HttpResponseNotFound
 import os
@@ -12,50 +11,85 @@ from django.views import View
 from django.conf import settings
 from django.http import FileResponse
 
-# This view returns a JSON object containing three data directories - historic asset return data, forward asset return data and mortality data.  These can then be used in the 'simulation' view below.
+# This view returns a JSON object containing three data directories - historic asset return data, forward asset return data and mortality data.  These can then be used in the 'simulation' view below.  'dataset_ids' can be sent back in place of the datasets themselves ('historic_dataset_id', 'forward_dataset_id', 'mortality_dataset_id').
 @api_view(['GET'])
 def get_simulation_data(request):
-    historic_data = RetrieveHistoricData(pd.read_csv('staticfiles/historic_dataset.csv'))
-    forward_data = RetrieveForwardData(pd.read_csv('staticfiles/forward_dataset.csv'))
-    mortality_data = RetrieveMortalityData(pd.read_csv('staticfiles/mortality_risk_table.csv'))
+    default_data = DefaultDataSets()
     
     return Response({
-        'historic_dataset': {
-        'globaleq': historic_data.globaleq,
-        'useq': historic_data.useq,
-        'tengilt': historic_data.tengilt,
-        'ukcpi': historic_data.ukcpi,
-        'gbpusd': historic_data.gbpusd,
-        'year': historic_data.year,
-        'tentsy': historic_data.tentsy,
-        'uscpi': historic_data.uscpi,
-        'usdusd': historic_data.usdusd,
-        },
-        'forward_dataset': {
-        'gbp_index_bond_forward': forward_data.gbp_index_bond_forward,
-        'gbp_bond_forward': forward_data.gbp_bond_forward,
-        'usd_index_bond_forward': forward_data.usd_index_bond_forward,
-        'usd_bond_forward': forward_data.usd_bond_forward,
-        'update_date': forward_data.update_date,
-        },
-        'mortality_dataset': {
-        'male': mortality_data.male,
-        'female': mortality_data.female,
-        'joint': mortality_data.joint,
-        'male_years_left': mortality_data.male_years_left,
-        'female_years_left': mortality_data.female_years_left,
-        },
+        'historic_dataset': default_data.data_sets['historic_asset_return_data'],
+        'forward_dataset': default_data.data_sets['forward_asset_return_data'],
+        'mortality_dataset': default_data.data_sets['mortality_data'],
+        'dataset_ids': default_data.data_set_ids,
     });
 
-@api_view(['POST'])
-def simulation(request):
+# 'AddDefaultData' class checks the JSON object in the body of the POST request for missing key:value pairs and adds a default pairs as required.  'UserSerializer' executes back-end validation on the JSON object.  Datasets already validated (the server's own datasets, datasets given by id and custom datasets seen before) are taken out of the serializer so the large return series are not re-validated on every call.  Custom datasets that pass validation are cached by content hash.
+class ValidateModelParameters:
+    def __init__(self, data_object):
+        pre_serializer_data = AddDefaultData(data_object)
+        serializer = UserSerializer(data = pre_serializer_data.data_object)
+        for key in ['historic_asset_return_data', 'forward_asset_return_data', 'mortality_data']:
+            if key not in pre_serializer_data.data_object: serializer.fields.pop(key, None)
+        # 'fan_chart_percentiles' (percentiles shown on the fan charts) is not a serializer field so is checked here
+        fan_chart_percentiles = pre_serializer_data.data_object['fan_chart_percentiles']
+        if not (isinstance(fan_chart_percentiles, list) and 0 < len(fan_chart_percentiles) <= 21 and all(isinstance(q, (int, float)) and not isinstance(q, bool) and 0 <= q <= 100 for q in fan_chart_percentiles)):
+            pre_serializer_data.errors['fan_chart_percentiles'] = ['Must be a list of 1 to 21 percentiles between 0 and 100.']
+        # 'optimisation_resolution' (finest asset mix step, percentage points), 'optimisation_budget' (cap on asset mixes run) and 'allocation_surface' ("1" returns every asset mix run) set the asset mix optimisation search and are not serializer fields either
+        optimisation_resolution = pre_serializer_data.data_object['optimisation_resolution']
+        if not (isinstance(optimisation_resolution, int) and not isinstance(optimisation_resolution, bool) and 1 <= optimisation_resolution <= 10):
+            pre_serializer_data.errors['optimisation_resolution'] = ['Must be a whole number of percentage points from 1 to 10.']
+        optimisation_budget = pre_serializer_data.data_object['optimisation_budget']
+        if not (isinstance(optimisation_budget, int) and not isinstance(optimisation_budget, bool) and 0 <= optimisation_budget <= 10000):
+            pre_serializer_data.errors['optimisation_budget'] = ['Must be a whole number of asset mixes from 0 to 10000.']
+        if pre_serializer_data.data_object['allocation_surface'] not in ["0", "1"]:
+            pre_serializer_data.errors['allocation_surface'] = ['Must be "0" or "1".']
+        self.is_valid = serializer.is_valid() and not pre_serializer_data.errors
+        if self.is_valid:
+            data = dict(serializer.data)
+            data['fan_chart_percentiles'] = [float(q) for q in fan_chart_percentiles]
+            data['optimisation_resolution'] = optimisation_resolution
+            data['optimisation_budget'] = optimisation_budget
+            data['allocation_surface'] = pre_serializer_data.data_object['allocation_surface']
+            for key in pre_serializer_data.unvalidated_data_set_ids:
+                validated_data_set_cache.put((key, pre_serializer_data.unvalidated_data_set_ids[key]), data[key])
+            data.update(pre_serializer_data.data_sets)
+            self.data = data
+            self.errors = None
+        else:
+            errors = dict(serializer.errors)
+            errors.update(pre_serializer_data.errors)
+            self.data = None
+            self.errors = errors
+        self.data_set_ids = pre_serializer_data.data_set_ids
 
-    # 'AddDefaultData' class checks the JSON object in the body of the POST request for missing key:value pairs and adds a default pairs as required.  'UserSerializer' executes back-end validation on the JSON object and will return an error if the validation fails. 
-    pre_serializer_data = AddDefaultData(json.loads(request.body))
-    serializer = UserSerializer(data = pre_serializer_data.data_object)
+# Checks the risk/return frontier settings of a 'historics' request, which are not serializer fields: 'frontier_step' (equity percentage points between blends, 1 to 100), 'frontier_windows' (rolling windows in years) and 'frontier_index_bond' ("1" splits the non-equity part of each blend between bonds and index-linked bonds).  Missing settings are given their defaults.
+class ValidateFrontierParameters:
+    def __init__(self, data_object):
+        frontier_step = data_object.get('frontier_step', FRONTIER_STEP)
+        frontier_windows = data_object.get('frontier_windows', list(FRONTIER_WINDOWS))
+        frontier_index_bond = data_object.get('frontier_index_bond', "0")
+        errors = {}
+        if not (isinstance(frontier_step, int) and not isinstance(frontier_step, bool) and 1 <= frontier_step <= 100):
+            errors['frontier_step'] = ['Must be a whole number of percentage points from 1 to 100.']
+        if not (isinstance(frontier_windows, list) and 0 < len(frontier_windows) <= FRONTIER_MAX_WINDOWS and all(isinstance(p, int) and not isinstance(p, bool) and 1 <= p <= FRONTIER_MAX_WINDOW for p in frontier_windows) and len(set(frontier_windows)) == len(frontier_windows)):
+            errors['frontier_windows'] = ['Must be a list of 1 to ' + str(FRONTIER_MAX_WINDOWS) + ' different whole numbers of years from 1 to ' + str(FRONTIER_MAX_WINDOW) + '.']
+        else:
+            # each window needs at least one rolling window start in the annual returns of the date range (data_end_year - data_start_year years of returns); the years themselves are checked by the serializer
+            data_start_year = data_object.get('data_start_year')
+            data_end_year = data_object.get('data_end_year')
+            if isinstance(data_start_year, int) and isinstance(data_end_year, int) and max(frontier_windows) >= data_end_year - data_start_year:
+                errors['frontier_windows'] = ['Windows must be shorter than the ' + str(max(data_end_year - data_start_year, 0)) + ' years of returns in the date range.']
+        if frontier_index_bond not in ["0", "1"]:
+            errors['frontier_index_bond'] = ['Must be "0" or "1".']
+        self.frontier_step = frontier_step
+        self.frontier_windows = frontier_windows
+        self.frontier_index_bond = frontier_index_bond == "1"
+        self.errors = errors
 
-    if serializer.is_valid():
-        data = serializer.data
+# Works out the CalcMaxBacktestedSWRs and RunSimulation arguments ('swr_arguments' / 'simulation_arguments', by argument name) of a simulation scenario from validated model parameters (see ValidateModelParameters), along with the simulation years shown in the response.  'swr_key' identifies the max back-tested SWR calculation so it can be shared between scenarios of a batch.
+class SimulationScenario:
+    def __init__(self, parameters):
+        data = parameters.data
         historic_asset_return_data = data.get('historic_asset_return_data')
         forward_asset_return_data = data.get('forward_asset_return_data')
         mortality_data = data.get('mortality_data')
@@ -68,6 +102,7 @@ def simulation(request):
         historic_data_set = PrepareHistoricDataSet(historic_asset_return_data, data_start_year, data_end_year, currency_set, geographic_set)
         mortality_data_pull = PrepareMortalityDataSet(mortality_data)
         forward_data_set = PrepareForwardDataSet(forward_asset_return_data, currency_set) 
+        forward_curves = GetForwardCurves(parameters.data_set_ids['forward_asset_return_data'], forward_asset_return_data).forward_curves
 
         equity_tax = float(data.get('equity_tax'))/100
         fees = float(data.get('fees'))/10000
@@ -119,58 +154,119 @@ def simulation(request):
         vanguard_increase_ceiling = data.get('vanguard_increase_ceiling')
         vpw_data = GetVPWData()
         net_other_income = data.get('net_other_income')
+        fan_chart_percentiles = data.get('fan_chart_percentiles')
 
-        # PrepareReturnData calcuates asset returns on a annual percentage basis in real terms and with net of asset return taxation ready for use in CalcMaxBacktestedSWRs and RunSimulation
-        return_data_set = PrepareReturnData(historic_data_set.historic_equity, historic_data_set.historic_bond, historic_data_set.historic_index_bond, historic_data_set.historic_cpi, historic_data_set.historic_fx, equity_tax, bond_tax, bond_coupon, index_bond_coupon, forward_data_set.forward_index_bond, forward_data_set.forward_bond, fees, circular_simulation)
+        # PrepareReturnData calcuates asset returns on a annual percentage basis in real terms and with net of asset return taxation ready for use in CalcMaxBacktestedSWRs and RunSimulation.  GetPreparedReturnData reuses it from cache if the same datasets have been prepared with the same settings.
+        prepared_return_data = GetPreparedReturnData(parameters.data_set_ids, historic_data_set, forward_data_set, data_start_year, data_end_year, currency_set, geographic_set, equity_tax, bond_tax, bond_coupon, index_bond_coupon, fees, circular_simulation, forward_curves)
+        return_data_set = prepared_return_data.return_data_set
         
         # CalcMaxBacktestedSWRs contains an algorithm that produces a curve of max back-tested zero-failure SWRs for the portfolio through the simulation years. This is used in RunSimulation in dynamically setting the withdrawal flex and withdrawal bonus.
         # Need to sort out double instance of cpi_change and cpi 
-        backtest_swr = CalcMaxBacktestedSWRs(return_data_set.historic_equity_real, return_data_set.historic_bond_real, return_data_set.historic_index_bond_real, asset_mix, start_sum, years, annual_withdrawal_inc, draw_adjust, return_data_set.cpi_change, return_data_set.forward_index_bond_taxed, return_data_set.forward_bond_taxed, draw_tax, annuity_option, annuity_increase, annuity_price, annuity_tax_rate, return_data_set.cpi_change, annuity_percent_withdrawal, annuity_start_year, data_direction, years_contributions, contribution, contribution_increase, years_between) 
-        
-        # RunSimulation runs the core model simulation.  ReverseArray transposes the structure of the results to prepare for presentation in the front end.
-        simulation_results = RunSimulation(return_data_set.historic_equity_real, return_data_set.historic_bond_real, return_data_set.historic_index_bond_real, asset_mix, start_sum, withdrawal_amount, years, annual_withdrawal_inc, draw_adjust, return_data_set.cpi_change, return_data_set.forward_index_bond_taxed, return_data_set.forward_bond_taxed, draw_tax, bonus_target, backtest_swr.safest_swr_across_years, dynamic_option, target_withdrawal_percent, min_withdrawal_floor, flex_real_decrease, flex_real_increase, years_no_flex, spring_back, annuity_option, annuity_increase, annuity_price, annuity_tax_rate, return_data_set.cpi_change, annuity_percent_withdrawal, start_simulation_age, annuity_start_year, mortality_data_pull, return_data_set.forward_index_bond_spot_curve, data_direction, years_contributions, contribution, contribution_increase, years_between, yale_weighting, vanguard_decrease_floor, vanguard_increase_ceiling, vpw_data, net_other_income) 
-        # transposed_simulation_results = ReverseArray(simulation_results.all_withdrawal_streams)
-        safe_funding_levels = CalcSafeFundingLevel(backtest_swr.safest_swr_across_years, simulation_results.unadjusted_draw_tracker, (years_contributions + years_between))
+        self.swr_arguments = {'equity_real': return_data_set.historic_equity_real, 'bond_real': return_data_set.historic_bond_real, 'index_bond_real': return_data_set.historic_index_bond_real, 'asset_mix': asset_mix, 'start_sum': start_sum, 'years': years, 'annual_withdrawal_inc': annual_withdrawal_inc, 'draw_adjust': draw_adjust, 'cpi': return_data_set.cpi_change, 'index_bond_forward': return_data_set.forward_index_bond_taxed, 'bond_forward': return_data_set.forward_bond_taxed, 'draw_tax': draw_tax, 'annuity_option_list': annuity_option, 'annuity_increase_list': annuity_increase, 'annuity_price_list': annuity_price, 'annuity_tax_rate_list': annuity_tax_rate, 'cpi_change': return_data_set.cpi_change, 'annuity_percent_withdrawal_list': annuity_percent_withdrawal, 'annuity_start_year_list': annuity_start_year, 'data_direction': data_direction, 'years_contributions': years_contributions, 'contribution': contribution, 'contribution_increase': contribution_increase, 'years_between': years_between}
+        # scenarios with the same prepared return data and SWR arguments have the same max back-tested SWRs (the return series are identified by the prepared return data key)
+        self.swr_key = (prepared_return_data.key, json.dumps([self.swr_arguments[key] for key in self.swr_arguments if key not in ['equity_real', 'bond_real', 'index_bond_real', 'cpi', 'index_bond_forward', 'bond_forward', 'cpi_change']]))
+
+        # RunSimulation runs the core model simulation (safest_swr_across_years is added from the CalcMaxBacktestedSWRs results).  ReverseArray transposes the structure of the results to prepare for presentation in the front end.  Results are numpy arrays and are converted to lists in the response (see SimulationResponse).
+        self.simulation_arguments = {'equity_real': return_data_set.historic_equity_real, 'bond_real': return_data_set.historic_bond_real, 'index_bond_real': return_data_set.historic_index_bond_real, 'asset_mix': asset_mix, 'start_sum': start_sum, 'withdrawal_amount': withdrawal_amount, 'years': years, 'annual_withdrawal_inc': annual_withdrawal_inc, 'draw_adjust': draw_adjust, 'cpi': return_data_set.cpi_change, 'index_bond_forward': return_data_set.forward_index_bond_taxed, 'bond_forward': return_data_set.forward_bond_taxed, 'draw_tax': draw_tax, 'bonus_target': bonus_target, 'dynamic_option': dynamic_option, 'target_withdrawal_percent': target_withdrawal_percent, 'min_withdrawal_floor': min_withdrawal_floor, 'flex_real_decrease': flex_real_decrease, 'flex_real_increase': flex_real_increase, 'years_no_flex': years_no_flex, 'spring_back': spring_back, 'annuity_option_list': annuity_option, 'annuity_increase_list': annuity_increase, 'annuity_price_list': annuity_price, 'annuity_tax_rate_list': annuity_tax_rate, 'cpi_change': return_data_set.cpi_change, 'annuity_percent_withdrawal_list': annuity_percent_withdrawal, 'start_simulation_age': start_simulation_age, 'annuity_start_year_list': annuity_start_year, 'mortality_data_pull': mortality_data_pull, 'ilb_spot_curve': return_data_set.forward_index_bond_spot_curve, 'data_direction': data_direction, 'years_contributions': years_contributions, 'contribution': contribution, 'contribution_increase': contribution_increase, 'years_between': years_between, 'yale_weighting': yale_weighting, 'vanguard_decrease_floor': vanguard_decrease_floor, 'vanguard_increase_ceiling': vanguard_increase_ceiling, 'vpw_data': vpw_data, 'net_other_income': net_other_income, 'fan_chart_percentiles': fan_chart_percentiles}
 
         if circular_simulation == "1":
             simulation_years  = historic_data_set.years
         else:
             simulation_years = historic_data_set.years[1:-years]
+        self.simulation_years = simulation_years
+        self.years_to_withdrawal = years_contributions + years_between
+        self.data_set_ids = parameters.data_set_ids
 
-        return Response({
-            'simulation_years' : simulation_years,            
+# Builds the 'simulation' response of a scenario (SimulationScenario) from its CalcMaxBacktestedSWRs and RunSimulation results
+class SimulationResponse:
+    def __init__(self, scenario, backtest_swr, simulation_results):
+        # transposed_simulation_results = ReverseArray(simulation_results.all_withdrawal_streams)
+        safe_funding_levels = CalcSafeFundingLevel(backtest_swr.safest_swr_across_years, simulation_results.unadjusted_draw_tracker, scenario.years_to_withdrawal)
+
+        self.response = {
+            'simulation_years' : scenario.simulation_years,            
             'simulation_fails': simulation_results.simulation_fails,
-            'portfolio_end_value_decile': simulation_results.value_decile_data,
-            'portfolio_all_value_streams': simulation_results.all_value_streams,
-            'portfolio_all_value_streams_percentiles' : simulation_results.portfolio_value_fan_chart_data,
-            'income_all_streams' : simulation_results.all_withdrawal_streams,
-            'median_income_by_type_all_cycles': simulation_results.median_withdraw_by_type_all_cycles,
-            'income_all_streams_percentiles' : simulation_results.income_value_fan_chart_data,
-            'income_histogram_data' : simulation_results.withdrawal_histogram_data,
-            'income_histogram_edges' : simulation_results.withdrawal_histogram_edges,  
+            'portfolio_end_value_decile': simulation_results.value_decile_data.tolist(),
+            'portfolio_all_value_streams': simulation_results.all_value_streams.tolist(),
+            'portfolio_all_value_streams_percentiles' : simulation_results.portfolio_value_fan_chart_data.tolist(),
+            'income_all_streams' : simulation_results.all_withdrawal_streams.tolist(),
+            'median_income_by_type_all_cycles': simulation_results.median_withdraw_by_type_all_cycles.tolist(),
+            'income_all_streams_percentiles' : simulation_results.income_value_fan_chart_data.tolist(),
+            'fan_chart_percentiles' : simulation_results.fan_chart_percentiles,
+            'income_histogram_data' : simulation_results.withdrawal_histogram_data.tolist(),
+            'income_histogram_edges' : simulation_results.withdrawal_histogram_edges.tolist(),
             'max_zero_fail_SWR_by_cycle' : backtest_swr.safe_withdrawal,
             'max_SWR_by_simulation_year' : safe_funding_levels.max_withdrawal_rate,
             'safe_funding_level' : safe_funding_levels.min_funding_level,
             'avg_income' : simulation_results.avg_withdrawal,
             'avg_mort_adjusted_income' : simulation_results.avg_mort_adjusted_withdrawal,
             'sum_mort_adjusted_discounted_income' : simulation_results.sum_mort_adjusted_discounted_withdrawal,
-            })
+            'dataset_ids' : scenario.data_set_ids,
+            }
+
+
+@api_view(['POST'])
+def simulation(request):
+
+    # 'ValidateModelParameters' adds default data to the JSON object in the body of the POST request and validates it (see above).  An error is returned if the validation fails.
+    parameters = ValidateModelParameters(json.loads(request.body))
+
+    if parameters.is_valid:
+        # 'SimulationScenario' prepares the return data (PrepareReturnData, reused from cache where possible) and the arguments of the model classes from the validated parameters
+        scenario = SimulationScenario(parameters)
+        # CalcMaxBacktestedSWRs produces a curve of max back-tested zero-failure SWRs for the portfolio through the simulation years, used in RunSimulation in dynamically setting the withdrawal flex and withdrawal bonus.  RunSimulation runs the core model simulation.
+        backtest_swr = CalcMaxBacktestedSWRs(**scenario.swr_arguments)
+        simulation_results = RunSimulation(safest_swr_across_years = backtest_swr.safest_swr_across_years, **scenario.simulation_arguments)
+        return Response(SimulationResponse(scenario, backtest_swr, simulation_results).response)
 
     else:
-        errors = serializer.errors
+        errors = parameters.errors
         return Response(errors)
 
+# This view runs a batch of variants of one simulation in a single request: {'base': model parameters, 'variants': [parameter overrides, ...]}.  Each variant is the base with its overrides applied and gets the 'simulation' response it would get on its own, in 'results' (in the order given).  The base is validated once and its datasets are passed to the variants by dataset id, so large datasets are only hashed and validated once.  Max back-tested SWRs shared by several variants (same prepared return data, asset mix and withdrawal / annuity / contribution settings) are only calculated once and the calculations are run across a pool of SIMULATION_BATCH_WORKERS processes (defaults to 1, which runs them in the request process; size it as CPU cores / web server processes, as for ASSET_MIX_OPTIMISATION_WORKERS).  Errors are returned for the base or by variant index.
+@api_view(['POST'])
+def simulation_batch(request):
+    batch = json.loads(request.body)
+    base = batch.get('base', {}) if isinstance(batch, dict) else None
+    variants = batch.get('variants') if isinstance(batch, dict) else None
+    if not isinstance(base, dict) or not (isinstance(variants, list) and 0 < len(variants) <= SIMULATION_BATCH_MAX_VARIANTS and all(isinstance(variant, dict) for variant in variants)):
+        return Response({'variants': ['Must be a base parameter object and a list of 1 to ' + str(SIMULATION_BATCH_MAX_VARIANTS) + ' parameter override objects.']})
+
+    base_parameters = ValidateModelParameters(dict(base))
+    if not base_parameters.is_valid:
+        return Response({'base': base_parameters.errors})
+    shared_base = {key: base[key] for key in base if key not in DATA_SET_ID_KEYS}
+    for key in DATA_SET_ID_KEYS:
+        shared_base[DATA_SET_ID_KEYS[key]] = base_parameters.data_set_ids[key]
+
+    scenarios = []
+    errors = {}
+    for index, variant in enumerate(variants):
+        parameters = ValidateModelParameters(dict(shared_base, **variant))
+        if parameters.is_valid:
+            scenarios.append(SimulationScenario(parameters))
+        else:
+            errors[str(index)] = parameters.errors
+    if errors:
+        return Response({'variants': errors})
+
+    workers = getattr(settings, 'SIMULATION_BATCH_WORKERS', 1)
+    batch_results = RunSimulationScenarios([(scenario.swr_key, scenario.swr_arguments, scenario.simulation_arguments) for scenario in scenarios], workers).results
+    return Response({
+        'results': [SimulationResponse(scenario, backtest_swr, simulation_results).response for scenario, (backtest_swr, simulation_results) in zip(scenarios, batch_results)],
+        'dataset_ids': base_parameters.data_set_ids,
+        })
+
 
 
 @api_view(['POST'])
 def asset_mix_optimisation(request):
 
-    # 'AddDefaultData' class checks the JSON object in the body of the POST request for missing key:value pairs and adds a default pairs as required.  'UserSerializer' executes back-end validation on the JSON object and will return an error if the validation fails. 
-    pre_serializer_data = AddDefaultData(json.loads(request.body))
-    serializer = UserSerializer(data = pre_serializer_data.data_object)
+    # 'ValidateModelParameters' adds default data to the JSON object in the body of the POST request and validates it (see above).  An error is returned if the validation fails.
+    parameters = ValidateModelParameters(json.loads(request.body))
 
-    if serializer.is_valid():
-        data = serializer.data
+    if parameters.is_valid:
+        data = parameters.data
         historic_asset_return_data = data.get('historic_asset_return_data')
         forward_asset_return_data = data.get('forward_asset_return_data')
         mortality_data = data.get('mortality_data')
@@ -184,6 +280,8 @@ def asset_mix_optimisation(request):
         historic_data_set = PrepareHistoricDataSet(historic_asset_return_data, data_start_year, data_end_year, currency_set, geographic_set)
         mortality_data_pull = PrepareMortalityDataSet(mortality_data)
         forward_data_set = PrepareForwardDataSet(forward_asset_return_data, currency_set)     
+        # GetForwardCurves gives the spot / par yield curves of the forward dataset, built once per forward dataset update
+        forward_curves = GetForwardCurves(parameters.data_set_ids['forward_asset_return_data'], forward_asset_return_data).forward_curves
 
         equity_tax = float(data.get('equity_tax'))/100
         fees = float(data.get('fees'))/10000
@@ -228,13 +326,15 @@ def asset_mix_optimisation(request):
         vanguard_increase_ceiling = data.get('vanguard_increase_ceiling')
         vpw_data = GetVPWData()
         net_other_income = data.get('net_other_income')
+        bonus_target = float(data.get('bonus_target'))
 
-        # PrepareReturnData calculates asset returns on a annual percentage basis in real terms and with net of asset return taxation ready for use in CalcMaxBacktestedSWRs and RunSimulation
-        return_data_set = PrepareReturnData(historic_data_set.historic_equity, historic_data_set.historic_bond, historic_data_set.historic_index_bond, historic_data_set.historic_cpi, historic_data_set.historic_fx, equity_tax, bond_tax, bond_coupon, index_bond_coupon, forward_data_set.forward_index_bond, forward_data_set.forward_bond, fees, circular_simulation)
+        # PrepareReturnData calculates asset returns on a annual percentage basis in real terms and with net of asset return taxation ready for use in CalcMaxBacktestedSWRs and RunSimulation.  GetPreparedReturnData reuses it from cache if the same datasets have been prepared with the same settings.
+        return_data_set = GetPreparedReturnData(parameters.data_set_ids, historic_data_set, forward_data_set, data_start_year, data_end_year, currency_set, geographic_set, equity_tax, bond_tax, bond_coupon, index_bond_coupon, fees, circular_simulation, forward_curves).return_data_set
         
-        # OptimiseAssetMix runs an algorithm to find the optimal asset allocation weightings given the parameterisation of the portfolio
-        optimise = OptimiseAssetMix(return_data_set.historic_equity_real, return_data_set.historic_bond_real, return_data_set.historic_index_bond_real, start_sum, withdrawal_amount, years, annual_withdrawal_inc, draw_adjust, return_data_set.cpi_change, return_data_set.forward_index_bond_taxed, return_data_set.forward_bond_taxed, draw_tax, dynamic_option, target_withdrawal_percent, min_withdrawal_floor, flex_real_decrease, flex_real_increase, years_no_flex, spring_back, annuity_option, annuity_increase, annuity_price, annuity_tax_rate, return_data_set.cpi_change, annuity_percent_withdrawal, start_simulation_age, annuity_start_year, mortality_data_pull, return_data_set.forward_index_bond_spot_curve, data_direction, years_contributions, contribution, contribution_increase, years_between, yale_weighting, vanguard_decrease_floor, vanguard_increase_ceiling, vpw_data, net_other_income)
-        return Response({
+        # OptimiseAssetMix runs an algorithm to find the optimal asset allocation weightings given the parameterisation of the portfolio.  It runs a 10% grid of asset mixes then refines around the best mixes down to 'optimisation_resolution' percentage points, running at most 'optimisation_budget' mixes in all.  The asset mixes are run across a pool of ASSET_MIX_OPTIMISATION_WORKERS processes (defaults to 1, which runs them in the request process).  Each web server process keeps its own pool, so the setting should be sized as CPU cores / web server processes.
+        workers = getattr(settings, 'ASSET_MIX_OPTIMISATION_WORKERS', 1)
+        optimise = OptimiseAssetMix(return_data_set.historic_equity_real, return_data_set.historic_bond_real, return_data_set.historic_index_bond_real, start_sum, withdrawal_amount, years, annual_withdrawal_inc, draw_adjust, return_data_set.cpi_change, return_data_set.forward_index_bond_taxed, return_data_set.forward_bond_taxed, draw_tax, dynamic_option, target_withdrawal_percent, min_withdrawal_floor, flex_real_decrease, flex_real_increase, years_no_flex, spring_back, annuity_option, annuity_increase, annuity_price, annuity_tax_rate, return_data_set.cpi_change, annuity_percent_withdrawal, start_simulation_age, annuity_start_year, mortality_data_pull, return_data_set.forward_index_bond_spot_curve, data_direction, years_contributions, contribution, contribution_increase, years_between, yale_weighting, vanguard_decrease_floor, vanguard_increase_ceiling, vpw_data, net_other_income, workers, resolution = data.get('optimisation_resolution'), evaluation_budget = data.get('optimisation_budget'), bonus_target = bonus_target, surface = data.get('allocation_surface') == "1")
+        response = {
             'optimised_bond_max' : optimise.optimised_fixedincome_max,
             'optimised_index_bond_max' : optimise.optimised_indexlinked_max,
             'optimised_equity_max' : optimise.optimised_equity_max,
@@ -243,25 +343,25 @@ def asset_mix_optimisation(request):
             'optimised_index_bond_min' : optimise.optimised_indexlinked_min,
             'optimised_equity_min' : optimise.optimised_equity_min,
             'optimised_failure_min' : optimise.optimised_failure_min,
-            })
+            'optimisation_evaluations' : optimise.evaluations,
+            'dataset_ids' : parameters.data_set_ids,
+            }
+        if optimise.surface is not None: response['allocation_surface'] = optimise.surface
+        return Response(response)
 
     else:
-        errors = serializer.errors
+        errors = parameters.errors
         return Response(errors)
 
-# This view is used for API call outside the core model that returns a dataset of historic returns data
+# This view is used for API call outside the core model that returns a dataset of historic returns data.  Analyses are cached per configuration and version of the datafiles (see GetHistoricsAnalysis).
 @api_view(['POST'])
 def historics(request):
     serializer = HistoricDataAnalysisSerializer(data = json.loads(request.body))
-    if serializer.is_valid():
+    frontier = ValidateFrontierParameters(json.loads(request.body))
+    if serializer.is_valid() and not frontier.errors:
         data = json.loads(request.body)
-        historic_data_set = LoadHistoricData(pd.read_csv('staticfiles/historic_dataset.csv'), data.get('data_start_year'), data.get('data_end_year'), data.get('currency_set'), data.get('geographic_set'))
-        forward_data_set = LoadForwardData(pd.read_csv('staticfiles/forward_dataset.csv'), 'GBP')    
-        forward_data_set_us = LoadForwardData(pd.read_csv('staticfiles/forward_dataset.csv'), 'USD')
-        bond_coupon = float(data.get('bond_coupon'))/100
-        index_bond_coupon = float(data.get('index_bond_coupon'))/100
-        period = int(data.get('period'))
-        data_set = AnalyseHistoricData(historic_data_set.historic_equity, historic_data_set.historic_bond, historic_data_set.historic_index_bond, historic_data_set.historic_cpi, historic_data_set.historic_fx, bond_coupon, index_bond_coupon, period, forward_data_set.forward_index_bond, forward_data_set.forward_bond, forward_data_set_us.forward_index_bond, forward_data_set_us.forward_bond)
+        historics = GetHistoricsAnalysis(data.get('currency_set'), data.get('geographic_set'), data.get('data_start_year'), data.get('data_end_year'), int(data.get('period')), float(data.get('bond_coupon'))/100, float(data.get('index_bond_coupon'))/100, frontier.frontier_step, frontier.frontier_windows, frontier.frontier_index_bond).historics
+        data_set = historics.analysis
         return Response({
             'deciles_equity_nominal_1': data_set.deciles_equity_nominal_1,
             'deciles_bond_nominal_1' : data_set.deciles_bond_nominal_1,
@@ -296,8 +396,8 @@ def historics(request):
             'index_bond_forward_select_us' : data_set.index_bond_forward_select_us,
             'bond_forward_select_us' : data_set.bond_forward_select_us,
             'forward_chart_labels' : data_set.forward_chart_labels,
-            'update_date' : forward_data_set.update_date,
-            'years' : historic_data_set.years[1:], 
+            'update_date' : historics.update_date,
+            'years' : historics.years,
             'five' : data_set.five,
             'ten' : data_set.ten,
             'twenty' : data_set.twenty,
@@ -305,9 +405,11 @@ def historics(request):
             'equity_chart' : data_set.equity_chart,
             'bond_chart' : data_set.bond_chart,
             'returnvariance' : data_set.returnvariance,
+            'returnvariance_blends' : data_set.returnvariance_blends,
         })
     else:
-        errors = serializer.errors
+        errors = dict(serializer.errors)
+        errors.update(frontier.errors)
         return Response(errors)
 
 # Below views support front end functionality and are not part of the core simulation model code